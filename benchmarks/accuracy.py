@@ -0,0 +1,191 @@
+'''
+accuracy versus speed of the precision tiers (skyfieldcalcs.PRECISION_TIERS) against a golden dataset of
+contact times from Xavier Jubier's local circumstances service
+
+    python -m benchmarks.accuracy --build                  # once, with network, saves the golden dataset
+    python -m benchmarks.accuracy --output accuracy.json
+
+for each tier the report gives the wall time over all cases and the error in seconds of each contact, so the
+cheapest tier that meets a product's tolerance can be picked
+
+the dataset shipped in benchmarks/fixtures is built with --build --source analytic, the contacts of the analytic
+theory on a 0.05 s grid. Run against it (on the same theory) the tiers differ from it only by their grids, which
+TIER_ERROR_S and MAX_ERROR_S bound, so it checks the interpolation of the tiers without a kernel or the network.
+Against Jubier's dataset the error also includes that of the ephemeris and delta T
+'''
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+GOLDEN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'golden_contacts.json')
+# a spread of sites and eras, total, annular and partial, from antiquity to the next century
+GOLDEN_CASES = [
+    {'label': 'Thales, Halys River', 'eclipse': '-05840528', 'lat': 39.9, 'lon': 34.0, 'ele': 800},
+    {'label': 'Novgorod', 'eclipse': '+11850501', 'lat': 58.52, 'lon': 31.27, 'ele': 25},
+    {'label': 'Wadesboro, NC', 'eclipse': '+19000528', 'lat': 34.9682, 'lon': -80.0767, 'ele': 130},
+    {'label': 'Munich', 'eclipse': '+19990811', 'lat': 48.1351, 'lon': 11.5820, 'ele': 520},
+    {'label': 'Nashville, TN', 'eclipse': '+20170821', 'lat': 36.1627, 'lon': -86.7816, 'ele': 180},
+    {'label': 'Albuquerque, NM', 'eclipse': '+20231014', 'lat': 35.0844, 'lon': -106.6504, 'ele': 1490},
+    {'label': 'Raleigh, NC', 'eclipse': '+20240408', 'lat': 35.7945, 'lon': -78.6376, 'ele': 100},
+    {'label': 'Dallas, TX', 'eclipse': '+20240408', 'lat': 32.7767, 'lon': -96.7970, 'ele': 140},
+    {'label': 'Mazatlan', 'eclipse': '+20240408', 'lat': 23.2494, 'lon': -106.4111, 'ele': 10},
+    {'label': 'Orlando, FL', 'eclipse': '+20450812', 'lat': 28.5384, 'lon': -81.3789, 'ele': 30},
+    {'label': 'Sydney', 'eclipse': '+20280722', 'lat': -33.8688, 'lon': 151.2093, 'ele': 40},
+]
+CONTACTS = {'c1': 'c1', 'c2': 'c2', 'max': 'mid', 'c3': 'c3', 'c4': 'c4'}  # Jubier's name: local_contacts name
+# seconds, bound on the C1 to C4 errors of each tier's grids against the analytic dataset, maximum eclipse is the
+# least separation, too flat a minimum to time better than MAX_ERROR_S at any step
+TIER_ERROR_S = {'fast': 0.1, 'standard': 0.005, 'precise': 0.001}
+MAX_ERROR_S = 0.1
+ANALYTIC_GRID = {'step': 0.05, 'coarse': 10}
+
+
+def build_golden_dataset(filename=GOLDEN_FILE, cases=None, source='jubier'):
+    '''
+    fetches the contact times of each case from Xavier Jubier's site, cases with no eclipse are kept with
+    no contacts so the tiers are also checked for not finding one
+    :param source: 'jubier', or 'analytic' for contacts (as TT julian dates) of the analytic theory on a fine grid
+    '''
+    if cases is None:
+        cases = GOLDEN_CASES
+    if source == 'analytic':
+        golden = [dict(case, contacts=analytic_contacts(case)) for case in cases]
+        _write_golden(filename, {'source': 'analytic', 'grid': ANALYTIC_GRID, 'cases': golden})
+        return golden
+    from circumstances.xavier_circ import get_jubier_circumstances
+    golden = []
+    for case in cases:
+        try:
+            data = get_jubier_circumstances(eclipse=case['eclipse'], height=case['ele'], latstr=case['lat'],
+                                            lonstr=case['lon'])
+        except Exception as e:
+            print(f"error getting Jubier circumstances for {case['label']}, {e}")
+            continue
+        contacts = {}
+        if data is not None:
+            contacts = {name: data[name]['utc_iso'] for name in CONTACTS if data.get(name, {}).get('utc_iso')}
+        golden.append(dict(case, contacts=contacts))
+    _write_golden(filename, {'source': 'http://xjubier.free.fr', 'cases': golden})
+    return golden
+
+
+def analytic_contacts(case):
+    '''
+    contacts of a case from the analytic theory on the fine ANALYTIC_GRID, found over the UT day of the eclipse
+    every minute then refined within 3 hours of maximum
+    :return: dictionary of Jubier's contact names to TT julian dates
+    '''
+    from circumstances.analytic import analytic_positions
+    from circumstances.skyfieldcalcs import eclipse_window, local_contacts
+    from circumstances.utils import utc_iso_to_tt
+    e = case['eclipse']
+    noon = utc_iso_to_tt(f"{e[0]}{e[1:5]}-{e[5:7]}-{e[7:9]}T12:00:00Z")
+    day = local_contacts(analytic_positions(eclipse_window(noon, hours=12, step=60)), case['lat'], case['lon'],
+                         case['ele'], coarse=600)
+    if np.isnan(day['mid'][0]):
+        return {}
+    geo = analytic_positions(eclipse_window(day['mid'][0], hours=3, step=ANALYTIC_GRID['step']))
+    result = local_contacts(geo, case['lat'], case['lon'], case['ele'], coarse=ANALYTIC_GRID['coarse'])
+    return {name: float(result[attr][0]) for name, attr in CONTACTS.items() if not np.isnan(result[attr][0])}
+
+
+def _write_golden(filename, golden):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    fp = open(filename, 'w')
+    json.dump(dict(golden, created=datetime.now(timezone.utc).isoformat(timespec='seconds')), fp, indent=1)
+    fp.close()
+
+
+def load_golden_dataset(filename=GOLDEN_FILE):
+    '''
+    :return: dictionary of source and cases, contacts of each case as UTC ISO time stamps or TT julian dates
+    '''
+    if not os.path.exists(filename):
+        raise FileNotFoundError(f"{filename} not found, build it with python -m benchmarks.accuracy --build")
+    fp = open(filename)
+    golden = json.load(fp)
+    fp.close()
+    return golden
+
+
+def run_harness(tiers=None, golden=None):
+    '''
+    times each precision tier over the golden cases and measures its contact time errors, on the analytic theory
+    when the dataset is from it
+    :param tiers: names of precision tiers (default, all of PRECISION_TIERS)
+    :param golden: dataset from load_golden_dataset
+    :return: dictionary keyed by tier of wall time, per contact error statistics and per case errors
+    '''
+    from circumstances.skyfieldcalcs import PRECISION_TIERS, eclipse_positions, local_contacts
+    from circumstances.utils import load_ephemeris, ts, utc_iso_to_tt
+    if tiers is None:
+        tiers = list(PRECISION_TIERS)
+    if golden is None:
+        golden = load_golden_dataset()
+    engine = 'analytic' if golden.get('source') == 'analytic' else 'ephemeris'
+    report = {}
+    for tier in tiers:
+        wall = 0.0
+        errors = {name: [] for name in CONTACTS}
+        cases = []
+        for case in golden['cases']:
+            contacts = {name: utc_iso_to_tt(when) if isinstance(when, str) else when
+                        for name, when in case['contacts'].items()}
+            tt = contacts.get('max', np.mean(list(contacts.values())) if contacts else None)
+            if tt is None:
+                continue
+            # loading the kernel is not part of the tier's cost
+            eph = None
+            if engine == 'ephemeris':
+                eph = load_ephemeris(ts.tt_jd(tt).tt_calendar()[0], kernel=PRECISION_TIERS[tier]['kernel'])
+            start = time.perf_counter()
+            geo = eclipse_positions(tt, engine=engine, precision=tier, eph=eph)
+            result = local_contacts(geo, case['lat'], case['lon'], case['ele'], coarse=PRECISION_TIERS[tier]['coarse'])
+            wall += time.perf_counter() - start
+            case_errors = {}
+            for name, attr in CONTACTS.items():
+                found = not np.isnan(result[attr][0])
+                if name not in contacts and not found:
+                    continue
+                if name in contacts and found:
+                    case_errors[name] = (result[attr][0] - contacts[name]) * 86400
+                    errors[name].append(abs(case_errors[name]))
+                else:
+                    case_errors[name] = 'missing' if name in contacts else 'unexpected'
+            cases.append({'label': case['label'], 'eclipse': case['eclipse'], 'errors_s': case_errors})
+        report[tier] = {'settings': PRECISION_TIERS[tier],
+                        'wall_s': wall,
+                        'cases': cases,
+                        'errors_s': {name: {'n': len(e), 'mean': float(np.mean(e)) if e else None,
+                                            'max': float(np.max(e)) if e else None} for name, e in errors.items()}}
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--build', action='store_true', help='fetch the golden dataset (needs network)')
+    parser.add_argument('--source', default='jubier', choices=['jubier', 'analytic'],
+                        help='what --build takes the contacts from')
+    parser.add_argument('--tiers', help='comma separated precision tiers, ex. fast,standard')
+    parser.add_argument('--output', help='write the JSON report here (default, stdout)')
+    args = parser.parse_args(argv)
+    if args.build:
+        build_golden_dataset(source=args.source)
+        return
+    report = run_harness(tiers=args.tiers.split(',') if args.tiers else None)
+    if args.output:
+        fp = open(args.output, 'w')
+        json.dump(report, fp, indent=2)
+        fp.close()
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
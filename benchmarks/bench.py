@@ -0,0 +1,317 @@
+'''
+offline benchmarks of the circumstance engine, canon loading and localization, emitted as JSON so runs can be
+compared across releases
+
+    python -m benchmarks.bench --output bench_output.txt
+    python -m benchmarks.bench --record                 # with network, Chrome and a JPL kernel
+
+the pages the scrapers parse and an ephemeris subset (2023-2025) are in benchmarks/fixtures. --record fetches
+the pages again from the sites and cuts the subset out of a full kernel, benchmarks/pages.py writes pages of the
+same layouts from the engine when the sites can't be reached. Every benchmark runs in a scratch directory so
+neither the network nor the caches of the working tree are touched
+'''
+import argparse
+import contextlib
+import io
+import json
+import os
+import pickle
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import urllib3
+from requests.adapters import BaseAdapter, HTTPAdapter
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+SITE = {'name': 'Raleigh, NC', 'lat': 35.7945, 'lon': -78.6376, 'ele': 100, 'tz': 'US/Eastern'}
+ECLIPSE = {'name': '+2024-04-08', 'type': 'T', 'kml': '+20240408', 'century': 2001}
+FIXTURE_FILES = {'canon': 'SE2001-2100.html',
+                 'path': 'SE2024Apr08Tpath.html',
+                 'jsex': 'JSEX-Raleigh-2001-2100.html',
+                 'kml': 'Jubier-Raleigh-20240408.kml',
+                 'ephemeris': 'de421-2023-2025.bsp'}
+
+
+def fixture(label):
+    '''
+    contents of a fixture, the ephemeris subset is loaded with skyfield
+    '''
+    filename = os.path.join(FIXTURES, FIXTURE_FILES[label])
+    if label == 'ephemeris':
+        from skyfield.api import load_file
+        return load_file(filename)
+    fp = open(filename, encoding='utf-8')
+    s = fp.read()
+    fp.close()
+    return s
+
+
+def timed(fn, repeat=5, setup=None):
+    '''
+    runs fn repeat times, calling setup (untimed) before each
+    :return: dictionary of best, mean and standard deviation in seconds
+    '''
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {'repeat': repeat,
+            'best_s': min(times),
+            'mean_s': statistics.mean(times),
+            'stdev_s': statistics.stdev(times) if len(times) > 1 else 0.0}
+
+
+def synthetic_separations(n=10000):
+    '''separation and apparent radii in degrees across a full partial-to-central range'''
+    separation = np.linspace(0.0001, 0.6, n)
+    return separation, np.full(n, 0.2666), np.full(n, 0.2742)
+
+
+def bench_eclipse_fraction(repeat):
+    from circumstances.skyfieldcalcs import eclipse_fraction, obscuration
+    s, sun_r, moon_r = synthetic_separations()
+    results = {'eclipse_fraction': timed(lambda: [eclipse_fraction(*x) for x in zip(s, moon_r, sun_r)], repeat),
+               'obscuration': timed(lambda: obscuration(s, sun_r, moon_r), repeat)}
+    for result in results.values():
+        result['n'] = len(s)
+    return results
+
+
+def bench_contact_points(repeat):
+    from circumstances.skyfieldcalcs import contact_points, obscuration
+    # the minute grid circumstances() builds, with a central eclipse in the middle of it
+    minutes = np.arange(-1440, 1440)
+    s = np.abs(minutes) * 0.5 / 60
+    df = pd.DataFrame({'ordinal': 738984.5 + minutes / 1440,
+                       'eclipse_fraction': obscuration(s, 0.2666, 0.2742) * 1.01})
+    return {'contact_points': dict(timed(lambda: contact_points(df), repeat), n=len(df))}
+
+
+def bench_circumstances(repeat):
+    from circumstances.skyfieldcalcs import _contact_rows, circumstances
+    from circumstances.utils import ts
+    eph = fixture('ephemeris')
+    lat, lon, ele = SITE['lat'], SITE['lon'], SITE['ele']
+    start = ts.utc(2024, 4, 8)
+    c1, c2, mid, c3, c4 = circumstances(start, lat, lon, ele=ele, eph=eph)
+    # the passes of circumstances(), every minute of the two days around noon then every second from C1 to C4
+    minutes = ts.utc(2024, 4, 8, 12, range(-1440, 1440))
+    coarse = timed(lambda: _contact_rows(minutes, lat, lon, ele, eph), repeat)
+    coarse['rows'] = len(minutes)
+    fine = timed(lambda: circumstances(c1.tt, lat, lon, ele=ele, end=c4.tt, eph=eph), repeat)
+    fine['rows'] = int(round((c4.tt - c1.tt) * 86400)) + 120
+    return {'circumstances': timed(lambda: circumstances(start, lat, lon, ele=ele, eph=eph), repeat),
+            'circumstances_coarse': coarse,
+            'circumstances_fine': fine}
+
+
+class fixture_adapter(BaseAdapter):
+    '''serves the fixture pages in place of the sites, by url'''
+
+    def __init__(self, pages):
+        super().__init__()
+        self.pages = pages
+
+    def send(self, request, **kwargs):
+        raw = urllib3.HTTPResponse(body=io.BytesIO(self.pages[request.url].encode()), status=200,
+                                   headers={'Content-Type': 'text/html'}, preload_content=False,
+                                   request_url=request.url)
+        return HTTPAdapter().build_response(request, raw)
+
+    def close(self):
+        pass
+
+
+def bench_canon(repeat):
+    from circumstances.circumstances import canon_page_url, get_canon_Espenak
+    from circumstances.utils import cached_session
+    year0 = ECLIPSE['century']
+    session = cached_session('caches/espenak_eclipse_cache.sqlite')
+    session.mount('https://eclipsewise.com/', fixture_adapter({canon_page_url(year0): fixture('canon')}))
+
+    def empty_caches():
+        if os.path.exists('caches/espenak_solar_eclipse_canon.pickle'):
+            os.remove('caches/espenak_solar_eclipse_canon.pickle')
+        session.cache.clear()
+
+    # cold is the fetch (from the fixture), parse and pickle of a century, warm the read of that pickle
+    cold = timed(lambda: get_canon_Espenak(year0, year0 + 100), repeat, setup=empty_caches)
+    cold['pages'] = 1
+    warm = timed(get_canon_Espenak, repeat)
+    warm['eclipses'] = len(get_canon_Espenak()[0])
+    return {'get_canon_Espenak_cold': cold, 'get_canon_Espenak_warm': warm}
+
+
+def bench_gsfc_table(repeat):
+    s = fixture('jsex')
+    from circumstances.circumstances import process_gsfc_history_table
+    result = timed(lambda: process_gsfc_history_table(s), repeat)
+    result['eclipses'] = len(process_gsfc_history_table(s)[0])
+    return {'process_gsfc_history_table': result}
+
+
+def bench_localize(repeat):
+    from circumstances.circumstances import parse_canon_page, process_gsfc_history_table, solar_eclipse_local
+    results, otherdates = {}, {}
+    parse_canon_page(fixture('canon'), results, otherdates)
+    write_canon_pickle(results, otherdates)
+
+    uut = solar_eclipse_local(SITE['name'], SITE['lat'], SITE['lon'], ele=SITE['ele'], timezone=SITE['tz'])
+    eclipses, by_year = process_gsfc_history_table(fixture('jsex'))
+    os.makedirs('caches/gsfc_local', exist_ok=True)
+    fp = open(f'caches/gsfc_local/{uut.lat},{uut.lon}.pickle', 'wb')
+    pickle.dump({uut.key: {'city': uut.name, 'lat': uut.lat, 'lon': uut.lon, 'ele': uut.ele, 'eclipses': eclipses,
+                           'by_year': by_year, 'centuries_checked': [int(ECLIPSE['century'] / 100)]}}, fp)
+    fp.close()
+    result = timed(lambda: uut.localize(years=[2023, 2024]), repeat)
+    result['eclipses'] = len(eclipses)
+    return {'localize': result}
+
+
+def bench_distance_to_path(repeat):
+    s = fixture('path')
+    from circumstances.circumstances import distance_to_path, parse_eclipse_path
+    fn = lambda: distance_to_path(SITE['lat'], SITE['lon'], ECLIPSE['name'], ECLIPSE['type'],
+                                  path_data=parse_eclipse_path(s))
+    return {'distance_to_path': timed(fn, repeat)}
+
+
+def bench_jubier(repeat):
+    s = fixture('kml')
+    from circumstances.xavier_circ import parse_jubier_kml
+    return {'parse_jubier_kml': timed(lambda: parse_jubier_kml(s), repeat)}
+
+
+BENCHMARKS = [bench_eclipse_fraction, bench_contact_points, bench_circumstances, bench_canon, bench_gsfc_table,
+              bench_localize, bench_distance_to_path, bench_jubier]
+
+
+def write_canon_pickle(results, otherdates):
+    os.makedirs('caches', exist_ok=True)
+    fp = open('caches/espenak_solar_eclipse_canon.pickle', 'wb')
+    pickle.dump({'results': results, 'otherdates': otherdates}, fp)
+    fp.close()
+
+
+def run_benchmarks(repeat=5, only=None):
+    '''
+    runs the benchmarks in a scratch directory
+    :param repeat: times to run each benchmark
+    :param only: names of benchmark functions to run, ex. ['bench_canon'] (default, all)
+    :return: dictionary of environment and results, ready for json.dump
+    '''
+    cwd = os.getcwd()
+    results = {}
+    # what the code under test prints goes to stderr, stdout is left for the report
+    with tempfile.TemporaryDirectory() as scratch, contextlib.redirect_stdout(sys.stderr):
+        os.chdir(scratch)
+        try:
+            for bench in BENCHMARKS:
+                if only and bench.__name__ not in only:
+                    continue
+                try:
+                    results.update(bench(repeat))
+                except Exception as e:
+                    print(f"error running {bench.__name__}, {e}")
+                    results[bench.__name__] = {'error': str(e)}
+        finally:
+            os.chdir(cwd)
+    return {'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'versions': package_versions(),
+            'results': results}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(FIXTURES), check=True).stdout.strip()
+    except Exception as e:
+        return None
+
+
+def package_versions():
+    versions = {}
+    for package in ['numpy', 'pandas', 'skyfield', 'bs4', 'lxml']:
+        try:
+            versions[package] = __import__(package).__version__
+        except Exception as e:
+            versions[package] = None
+    return versions
+
+
+def record_fixtures(ephemeris='/var/data/de421.bsp'):
+    '''
+    fetches the fixture pages from eclipsewise, NASA GSFC (needs Chrome) and Xavier Jubier's site, and cuts
+    the small ephemeris subset the benchmarks use out of a full JPL kernel
+    '''
+    import requests
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    from circumstances.circumstances import eclipse_path_url, enter_coordinates, enter_elevation, get_canon_page
+    from circumstances.utils import directional_DMS_coordinates, get_driver
+    from circumstances.xavier_circ import fetch_google_circ
+
+    os.makedirs(FIXTURES, exist_ok=True)
+    session = requests.Session()
+    pages = {'canon': get_canon_page(session, ECLIPSE['century'])[0].text,
+             'path': session.get(eclipse_path_url(ECLIPSE['name'], ECLIPSE['type'])).text,
+             'kml': fetch_google_circ(ECLIPSE['kml'], SITE['ele'], SITE['lat'], SITE['lon'], session=session)}
+
+    driver = get_driver()
+    EW, NS, latd, latm, lats, lond, lonm, lons = directional_DMS_coordinates(SITE['lat'], SITE['lon'])
+    enter_coordinates(driver, SITE['name'], latd, latm, lats, NS, lond, lonm, lons, EW)
+    button_no = int((ECLIPSE['century'] / 100) + 15)  # same button arithmetic as solar_eclipse_local.get_year
+    enter_elevation((button_no % 5) + 1, driver, SITE['ele'], int(button_no / 5) + 2)
+    table = WebDriverWait(driver, 20).until(EC.presence_of_element_located((By.ID, 'el_resultstable')))
+    pages['jsex'] = table.get_attribute('innerHTML')
+    driver.quit()
+
+    for label, s in pages.items():
+        fp = open(os.path.join(FIXTURES, FIXTURE_FILES[label]), 'w', encoding='utf-8')
+        fp.write(s)
+        fp.close()
+
+    # the Earth, Moon and Sun for the geometry, Jupiter and Saturn for skyfield's light deflection
+    subprocess.run([sys.executable, '-m', 'jplephem', 'excerpt', '--targets', '3,5,6,10,301,399',
+                    '2023/1/1', '2026/1/1', ephemeris, os.path.join(FIXTURES, FIXTURE_FILES['ephemeris'])],
+                   check=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help='write the JSON report here (default, stdout)')
+    parser.add_argument('--repeat', type=int, default=5, help='times to run each benchmark')
+    parser.add_argument('--only', help='comma separated benchmark functions, ex. bench_canon,bench_jubier')
+    parser.add_argument('--record', action='store_true', help='record the fixtures (needs network and Chrome)')
+    parser.add_argument('--ephemeris', default='/var/data/de421.bsp', help='JPL kernel to cut the subset from')
+    args = parser.parse_args(argv)
+    if args.record:
+        record_fixtures(ephemeris=args.ephemeris)
+        return
+    report = run_benchmarks(repeat=args.repeat, only=args.only.split(',') if args.only else None)
+    if args.output:
+        fp = open(args.output, 'w')
+        json.dump(report, fp, indent=2)
+        fp.close()
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+'''
+writes the benchmark fixture pages in the layouts of the pages they stand in for, for when eclipsewise, NASA
+GSFC's JSEX and Xavier Jubier's site can't be reached to record them (python -m benchmarks.bench --record)
+
+    python -m benchmarks.pages
+
+the canon and the JSEX table of the century are computed with the analytic theory, the path and the KML of
+2024 Apr 08 with the ephemeris subset in benchmarks/fixtures. The values are this package's own, good to the
+accuracy of the engine rather than a copy of the sites' figures, what the benchmarks time is the parsing and
+localizing of pages of the same size and shape
+'''
+import argparse
+import math
+import os
+import tempfile
+
+import numpy as np
+from geographiclib.geodesic import Geodesic
+
+from benchmarks.bench import ECLIPSE, FIXTURE_FILES, FIXTURES, SITE, fixture
+from circumstances.analytic import analytic_positions
+from circumstances.path import WGS84_A, WGS84_E2, compute_eclipse_path, format_duration, path_limits, \
+    shadow_axis_intercept
+from circumstances.skyfieldcalcs import eclipse_possible, eclipse_window, geocentric_positions, local_altaz, \
+    local_contacts, local_geometry, site_xyz
+from circumstances.utils import MOON_RADIUS_KM, SUN_RADIUS_KM, greatest_eclipse_tt, months, ts
+
+CANON_HEADERS = ['Calendar Date', 'TD of Greatest Eclipse', 'ΔT (s)', 'ΔT σ (s)', 'Luna Num', 'Saros Num',
+                 'Ecl. Type', 'QLE', 'Gamma', 'Ecl. Mag.', 'Lat.', 'Long.', 'Sun Alt', 'Path Width (km)',
+                 'Central Dur.']
+JSEX_HEADERS = ['Calendar Date', 'Ecl. Type', 'Partial Eclipse Begins', 'Sun Alt', 'A or T Eclipse Begins',
+                'Maximum Eclipse', 'Sun Alt', 'Sun Azm', 'A or T Eclipse Ends', 'Partial Eclipse Ends', 'Sun Alt',
+                'Ecl. Mag.', 'Ecl. Obs.', 'A or T Ecl. Durat.']
+
+
+def canon_rows(century=2001):
+    '''
+    the solar eclipses of a century as rows of the eclipsewise catalog, greatest eclipse is when the shadow axis
+    passes closest to the centre of the Earth
+    :return: list of lists of 15 cell strings
+    '''
+    rows = []
+    first, last = math.floor((century - 2000) * 12.3685) - 1, math.ceil((century + 100 - 2000) * 12.3685) + 1
+    for k in range(first, last):
+        # mean new moon and argument of latitude, Meeus chapter 49, only lunations near a node can eclipse
+        jde = 2451550.09766 + 29.530588861 * k
+        F = math.radians(160.7108 + 390.67050284 * k)
+        if abs(math.sin(F)) > 0.36:
+            continue
+        row = canon_row(jde, k)
+        if row is not None and century <= int(row[0].split('-')[-3]) < century + 100:
+            rows.append(row)
+    return rows
+
+
+def canon_row(jde, k):
+    '''cells of the catalog for the new moon near TT julian date jde, None if it isn't an eclipse'''
+    coarse = analytic_positions(ts.tt_jd(jde, np.arange(-1.5, 1.5, 300 / 86400)))
+    rough = coarse['tt'][np.argmin(axis_distance(coarse)[0])]
+    geo = analytic_positions(ts.tt_jd(rough, np.arange(-600, 601) / 86400))
+    distance, closest = axis_distance(geo)
+    i = int(np.argmin(distance))
+    sun, moon = geo['sun'][:, i], geo['moon'][:, i]
+    L1, L2 = shadow_radii(sun, moon, np.zeros(3))
+    if distance[i] > WGS84_A + L1[0]:
+        return None
+    gamma = math.copysign(distance[i] / WGS84_A, closest[2, i])
+
+    (lat, lon), found = shadow_axis_intercept(sun[:, None], moon[:, None])
+    if found[0]:
+        lat, lon = lat[0], lon[0]
+        surface_L2 = shadow_radii(sun, moon, site_xyz(lat, lon)[:, 0])[1][0]
+        eclipse_type = central_type(geo['tt'][i], surface_L2)
+        separation, sun_r, moon_r = local_geometry(sun[:, None], moon[:, None], site_xyz(lat, lon))
+        magnitude = moon_r[0] / sun_r[0]
+        northern, southern = path_limits(sun[:, None], moon[:, None], np.array([lat]), np.array([lon]))
+        width = str(round(Geodesic.WGS84.Inverse(northern[0][0], northern[1][0], southern[0][0],
+                                                 southern[1][0])['s12'] / 1000))
+        contacts = local_contacts(analytic_positions(eclipse_window(geo['tt'][i], hours=0.25)), lat, lon)
+        duration = format_duration(contacts['duration'][0])[:5] + 's'
+    else:
+        # the point of the Earth nearest the axis
+        p = closest[:, i] * WGS84_A / distance[i]
+        lat = math.degrees(math.atan2(p[2], (1 - WGS84_E2) * math.hypot(p[0], p[1])))
+        lon = math.degrees(math.atan2(p[1], p[0]))
+        eclipse_type = 'P' if distance[i] > WGS84_A + abs(L2[0]) else ('Tn' if L2[0] < 0 else 'An')
+        magnitude = (WGS84_A + L1[0] - distance[i]) / (L1[0] + L2[0])
+        width, duration = '-', '-'
+    alt, az = local_altaz(sun[:, None] - site_xyz(lat, lon), lat, lon)
+
+    t = ts.tt_jd(geo['tt'][i])
+    year, month, day = t.ut1_calendar()[:3]
+    hour, minute, second = t.tt_calendar()[3:]
+    luna = k - 1
+    saros = 139 + ((luna - 299) * pow(135, -1, 223) + 111) % 223 - 111
+    sigma = round(0.8 * ((year - 1820) / 100) ** 2)
+    return [f"{year:04}-{months[month]}-{day:02}", f"{hour:02}:{minute:02}:{int(second):02}",
+            str(round(float(t.delta_t))), str(sigma), str(luna), str(saros), eclipse_type, '-', f"{gamma:.4f}",
+            f"{magnitude:.4f}", f"{abs(round(lat))}{'N' if lat >= 0 else 'S'}",
+            f"{abs(round(lon))}{'E' if lon >= 0 else 'W'}", str(max(round(alt[0]), 0)), width, duration]
+
+
+def axis_distance(geo):
+    '''distance of the centre of the Earth from the shadow axis, and the point of the axis nearest it'''
+    u = geo['moon'] - geo['sun']
+    u /= np.linalg.norm(u, axis=0)
+    closest = geo['moon'] - np.sum(geo['moon'] * u, axis=0) * u
+    return np.linalg.norm(closest, axis=0), closest
+
+
+def shadow_radii(sun, moon, point):
+    '''
+    radii of the penumbra and of the umbra (negative) or antumbra (positive) in the plane through point
+    perpendicular to the shadow axis, Besselian L1 and L2 in km
+    '''
+    d = np.linalg.norm(moon - sun)
+    u = (moon - sun) / d
+    z = np.atleast_1d(np.dot(point - moon, u))
+    f1, f2 = math.asin((SUN_RADIUS_KM + MOON_RADIUS_KM) / d), math.asin((SUN_RADIUS_KM - MOON_RADIUS_KM) / d)
+    return (z * math.tan(f1) + MOON_RADIUS_KM / math.cos(f1),
+            z * math.tan(f2) - MOON_RADIUS_KM / math.cos(f2))
+
+
+def central_type(tt, surface_L2):
+    '''T, A or H, hybrid when the shadow is total at some points of the central line and annular at others'''
+    geo = analytic_positions(eclipse_window(tt, hours=3, step=60))
+    (lat, lon), found = shadow_axis_intercept(geo['sun'], geo['moon'])
+    kinds = {'T' if surface_L2 < 0 else 'A'}
+    for n in np.flatnonzero(found):
+        xyz = site_xyz(lat[n], lon[n])[:, 0]
+        kinds.add('T' if shadow_radii(geo['sun'][:, n], geo['moon'][:, n], xyz)[1][0] < 0 else 'A')
+    return kinds.pop() if len(kinds) == 1 else 'H'
+
+
+def canon_page(rows, century=2001):
+    '''the century page of the eclipsewise catalog'''
+    title = f"Solar Eclipses: {century:04} to {century + 99:04}"
+    head = ''.join(f"<th>{header}</th>" for header in CANON_HEADERS)
+    body = '\n'.join('<tr>' + ''.join(f"<td>{cell}</td>" for cell in row) + '</tr>' for row in rows)
+    return (f"<html><head><title>{title}</title></head><body><h1>{title}</h1>\n"
+            f"<table class=\"catalog\"><thead><tr>{head}</tr></thead><tbody>\n{body}\n</tbody></table>\n"
+            f"</body></html>\n")
+
+
+def jsex_table(rows, lat, lon, ele=0):
+    '''
+    innerHTML of the JSEX results table for one site and the eclipses of a canon page, the eclipses seen from
+    the site with their contacts in UT
+    '''
+    cells = [''.join(f"<th>{header}</th>" for header in JSEX_HEADERS)]
+    for row in rows:
+        tt = greatest_eclipse_tt({'date_ut1': row[0], 'ge_time_td': row[1], 'delta_t': int(row[2])})
+        if not eclipse_possible(analytic_positions(eclipse_window(tt, hours=4, step=600)), lat, lon, ele)[0]:
+            continue
+        geo = analytic_positions(eclipse_window(tt, hours=4))
+        c = local_contacts(geo, lat, lon, ele)
+        if c['type'][0] == '' or max(c['c1_sun_alt'][0], c['mid_sun_alt'][0], c['c4_sun_alt'][0]) < 0:
+            continue
+        if c['mid_sun_alt'][0] < 0:
+            continue  # JSEX lists the eclipse only when maximum is seen
+
+        alt = local_altaz(geo['sun'] - site_xyz(lat, lon, ele), lat, lon)[0]
+        c1, c1_alt = utc_hms(c['c1'][0]), str(round(c['c1_sun_alt'][0]))
+        if c['c1_sun_alt'][0] < 0:
+            sunrise = geo['tt'][np.flatnonzero((geo['tt'] > c['c1'][0]) & (alt >= 0))[0]]
+            c1, c1_alt = utc_hms(sunrise)[:5] + '(r)', '0(r)'
+        c4, c4_alt = utc_hms(c['c4'][0]), str(round(c['c4_sun_alt'][0]))
+        if c['c4_sun_alt'][0] < 0:
+            sunset = geo['tt'][np.flatnonzero((geo['tt'] < c['c4'][0]) & (alt >= 0))[-1]]
+            c4, c4_alt = utc_hms(sunset)[:5] + '(s)', '0(s)'
+        central = c['type'][0] in 'TA'
+        date = ts.tt_jd(c['mid'][0]).utc_strftime('%Y-%b-%d')
+        values = [date, c['type'][0], c1, c1_alt, utc_hms(c['c2'][0]) if central else '-', utc_hms(c['mid'][0]),
+                  str(round(c['mid_sun_alt'][0])), str(round(c['mid_sun_az'][0])),
+                  utc_hms(c['c3'][0]) if central else '-', c4, c4_alt, f"{c['magnitude'][0]:.3f}",
+                  f"{c['obscuration'][0]:.3f}", format_duration(c['duration'][0])[:5] + 's' if central else '-']
+        cells.append(''.join(f"<td>{value}</td>" for value in values))
+    return '<tbody>' + '\n'.join(f"<tr>{row}</tr>" for row in cells) + '</tbody>'
+
+
+def utc_hms(tt):
+    '''UTC time of day of a TT julian date, ex. 18:34:12'''
+    return ts.tt_jd(tt).utc_strftime('%H:%M:%S')
+
+
+def dms(value, positive, negative):
+    '''degrees and decimal minutes as eclipsewise writes them, ex. 25°17.3'N'''
+    minutes = round(abs(value) * 60, 1)
+    return f"{int(minutes // 60):02}°{minutes % 60:04.1f}'{positive if value >= 0 else negative}"
+
+
+def path_page(path_data, title):
+    '''the eclipsewise SEpath page of a path in the form of compute_eclipse_path'''
+    rows = []
+    for ut, row in path_data.items():
+        if row['northern'] is None:
+            continue
+        cells = [ut, dms(row['northern']['lat'], 'N', 'S'), dms(row['northern']['lon'], 'E', 'W'),
+                 dms(row['southern']['lat'], 'N', 'S'), dms(row['southern']['lon'], 'E', 'W'),
+                 dms(row['central']['lat'], 'N', 'S'), dms(row['central']['lon'], 'E', 'W'),
+                 f"{row['moon:sun ratio']:.4f}", f"{row['sun altitude']}°", f"{row['sun azimuth']}°",
+                 f"{row['path width km']} km", row['duration']]
+        rows.append('<tr>' + ''.join(f"<td>{cell}</td>" for cell in cells) + '</tr>')
+    head = ['<tr><th colspan="12">Path of the Umbral Shadow</th></tr>',
+            '<tr><th>Universal</th><th colspan="2">Northern Limit</th><th colspan="2">Southern Limit</th>'
+            '<th colspan="2">Central Line</th><th>M:S</th><th>Sun</th><th>Sun</th><th>Path</th><th>Central</th></tr>',
+            '<tr><th>Time</th><th>Latitude</th><th>Longitude</th><th>Latitude</th><th>Longitude</th><th>Latitude</th>'
+            '<th>Longitude</th><th>Ratio</th><th>Alt</th><th>Azm</th><th>Width</th><th>Duration</th></tr>',
+            '<tr><td colspan="12"></td></tr>']
+    return (f"<html><head><title>{title}</title></head><body><h1>{title}</h1>\n<table class=\"datatab\">\n"
+            + '\n'.join(head + rows) + '\n<tr><td colspan="12">Geodetic coordinates, WGS84</td></tr>\n'
+            + "</table>\n</body></html>\n")
+
+
+def position_angles(sun, moon, xyz, lat, lon):
+    '''
+    position angles of the Moon from the centre of the Sun, P from the north point of the disc and V from the
+    zenith, both measured towards the east, in degrees
+    '''
+    s = (sun - xyz) / np.linalg.norm(sun - xyz)
+    m = (moon - xyz) / np.linalg.norm(moon - xyz)
+    phi, lam = math.radians(lat), math.radians(lon)
+    angles = []
+    for pole in [np.array([0, 0, 1.0]), np.array([math.cos(phi) * math.cos(lam), math.cos(phi) * math.sin(lam),
+                                                  math.sin(phi)])]:
+        north = pole - np.dot(pole, s) * s
+        north /= np.linalg.norm(north)
+        east = np.cross(north, s)
+        angles.append(math.degrees(math.atan2(np.dot(m - s, east), np.dot(m - s, north))) % 360)
+    return angles
+
+
+def jubier_kml(eph, tt, lat, lon, ele=0):
+    '''the KML of Xavier Jubier's local circumstances service for one site'''
+    geo = geocentric_positions(eclipse_window(tt, hours=4), eph)
+    c = local_contacts(geo, lat, lon, ele)
+    if c['type'][0] == '':
+        return ('<?xml version="1.0" encoding="UTF-8"?><kml><Document><name><![CDATA[Eclipse]]></name><Placemark>'
+                '<description><![CDATA[NO&nbsp;SOLAR&nbsp;ECLIPSE]]></description></Placemark></Document></kml>')
+    xyz = site_xyz(lat, lon, ele)[:, 0]
+    kind = {'P': 'Partial', 'T': 'Total', 'A': 'Annular'}[c['type'][0]]
+    if c['type'][0] == 'P':
+        duration, depth = 'Partial eclipse', f"Obscuration : {c['obscuration'][0] * 100:.2f}%"
+    else:
+        duration = format_duration(c['duration'][0]).replace('m0', 'm').lstrip('0')
+        depth = f"Obscuration : {c['obscuration'][0] * 100:.2f}%"
+    events = {'c1': 'Start of partial eclipse (C1)', 'c2': f'Start of {kind.lower()} eclipse (C2)',
+              'mid': 'Maximum eclipse (MAX)', 'c3': f'End of {kind.lower()} eclipse (C3)',
+              'c4': 'End of partial eclipse (C4)'}
+    rows = []
+    for attr, event in events.items():
+        if np.isnan(c[attr][0]):
+            continue
+        t = ts.tt_jd(c[attr][0])
+        n = int(np.clip(np.rint((c[attr][0] - geo['tt'][0]) * 86400 / geo['step']), 0, len(geo['tt']) - 1))
+        p, v = position_angles(geo['sun'][:, n], geo['moon'][:, n], xyz, lat, lon)
+        rows.append(f"<tr><td>{event}</td><td>{t.utc_strftime('%Y/%m/%d')}</td><td>{t.utc_strftime('%H:%M:%S')}."
+                    f"{int(t.utc[5] % 1 * 10)}</td><td>{c[f'{attr}_sun_alt'][0]:.1f}&deg;</td>"
+                    f"<td>{c[f'{attr}_sun_az'][0]:.1f}&deg;</td><td>{round(p)}&deg;</td><td>{v / 30:.1f}</td>"
+                    f"<td></td></tr>")
+    return ('<?xml version="1.0" encoding="UTF-8"?><kml><Document><name><![CDATA[Eclipse]]></name><Placemark>'
+            f'<description><![CDATA[<table><tr><td>{kind} Solar Eclipse</td></tr></table>\n'
+            f'<table><tr><td>Lat.</td><td>:</td><td>{lat:.4f}º</td><td>Duration</td><td>{duration}</td></tr>\n'
+            f'<tr><td>Lng.</td><td>:</td><td>{lon:.4f}º</td><td></td><td></td></tr></table>\n'
+            f'<table><tr><td>{depth}</td><td></td><td></td><td></td>'
+            f"<td>Magnitude : {c['magnitude'][0]:.4f}<br>Moon/Sun size ratio : {c['ratio'][0]:.4f}</td></tr></table>\n"
+            '<table><tr><th>Event</th><th>Date</th><th>Time (UT)</th><th>Alt</th><th>Azi</th><th>P</th><th>V</th>'
+            '<th>LC</th></tr>\n' + '\n'.join(rows) + '\n</table> ]]></description></Placemark></Document></kml>')
+
+
+def write_pages(century=ECLIPSE['century']):
+    '''writes the canon, JSEX, path and KML fixtures into benchmarks/fixtures'''
+    rows = canon_rows(century)
+    pages = {'canon': canon_page(rows, century),
+             'jsex': jsex_table(rows, SITE['lat'], SITE['lon'], SITE['ele'])}
+    entry = next({'date_ut1': row[0], 'ge_time_td': row[1], 'delta_t': int(row[2])} for row in rows
+                 if row[0] == ECLIPSE['name'].lstrip('+').replace('-04-', '-Apr-'))
+    eph = fixture('ephemeris')
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)  # compute_eclipse_path caches the path under caches/paths
+        try:
+            path_data = compute_eclipse_path(ECLIPSE['name'], ECLIPSE['type'], canondata=entry, eph=eph, force=True)
+        finally:
+            os.chdir(cwd)
+    pages['path'] = path_page(path_data, 'Total Solar Eclipse of 2024 Apr 08')
+    pages['kml'] = jubier_kml(eph, greatest_eclipse_tt(entry), SITE['lat'], SITE['lon'], SITE['ele'])
+    for label, s in pages.items():
+        fp = open(os.path.join(FIXTURES, FIXTURE_FILES[label]), 'w', encoding='utf-8')
+        fp.write(s)
+        fp.close()
+    return {label: len(s) for label, s in pages.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args(argv)
+    for label, size in write_pages().items():
+        print(f"{FIXTURE_FILES[label]}, {size} bytes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+'''
+closed-form positions of the Sun and Moon, Meeus, Astronomical Algorithms (2nd ed.) chapters 22, 25 and 47,
+vectorized over NumPy
+
+good to roughly 10" for the Moon and 30" for the Sun, which puts contacts within a minute or two of their JPL
+times, plenty to find where they are so that the JPL kernel is only evaluated around them
+'''
+import numpy as np
+
+from circumstances.skyfieldcalcs import eclipse_window, geocentric_positions, grid_step, local_contacts, \
+    local_geometry, site_xyz
+from circumstances.utils import greatest_eclipse_tt, load_ephemeris, ts
+
+AU_KM = 149597870.7
+
+# Meeus table 47.A, periodic terms of the Moon's longitude (1e-6 degrees) and distance (1e-3 km)
+# multiples of D, M, M', F then sigma l, sigma r
+MOON_LR_TERMS = np.array([
+    [0, 0, 1, 0, 6288774, -20905355], [2, 0, -1, 0, 1274027, -3699111], [2, 0, 0, 0, 658314, -2955968],
+    [0, 0, 2, 0, 213618, -569925], [0, 1, 0, 0, -185116, 48888], [0, 0, 0, 2, -114332, -3149],
+    [2, 0, -2, 0, 58793, 246158], [2, -1, -1, 0, 57066, -152138], [2, 0, 1, 0, 53322, -170733],
+    [2, -1, 0, 0, 45758, -204586], [0, 1, -1, 0, -40923, -129620], [1, 0, 0, 0, -34720, 108743],
+    [0, 1, 1, 0, -30383, 104755], [2, 0, 0, -2, 15327, 10321], [0, 0, 1, 2, -12528, 0],
+    [0, 0, 1, -2, 10980, 79661], [4, 0, -1, 0, 10675, -34782], [0, 0, 3, 0, 10034, -23210],
+    [4, 0, -2, 0, 8548, -21636], [2, 1, -1, 0, -7888, 24208], [2, 1, 0, 0, -6766, 30824],
+    [1, 0, -1, 0, -5163, -8379], [1, 1, 0, 0, 4987, -16675], [2, -1, 1, 0, 4036, -12831],
+    [2, 0, 2, 0, 3994, -10445], [4, 0, 0, 0, 3861, -11650], [2, 0, -3, 0, 3665, 14403],
+    [0, 1, -2, 0, -2689, -7003], [2, 0, -1, 2, -2602, 0], [2, -1, -2, 0, 2390, 10056],
+    [1, 0, 1, 0, -2348, 6322], [2, -2, 0, 0, 2236, -9884], [0, 1, 2, 0, -2120, 5751],
+    [0, 2, 0, 0, -2069, 0], [2, -2, -1, 0, 2048, -4950], [2, 0, 1, -2, -1773, 4130],
+    [2, 0, 0, 2, -1595, 0], [4, -1, -1, 0, 1215, -3958], [0, 0, 2, 2, -1110, 0],
+    [3, 0, -1, 0, -892, 3258], [2, 1, 1, 0, -810, 2616], [4, -1, -2, 0, 759, -1897],
+    [0, 2, -1, 0, -713, -2117], [2, 2, -1, 0, -700, 2354], [2, 1, -2, 0, 691, 0],
+    [2, -1, 0, -2, 596, 0], [4, 0, 1, 0, 549, -1423], [0, 0, 4, 0, 537, -1117],
+    [4, -1, 0, 0, 520, -1571], [1, 0, -2, 0, -487, -1739], [2, 1, 0, -2, -399, 0],
+    [0, 0, 2, -2, -381, -4421], [1, 1, 1, 0, 351, 0], [3, 0, -2, 0, -340, 0],
+    [4, 0, -3, 0, 330, 0], [2, -1, 2, 0, 327, 0], [0, 2, 1, 0, -323, 1165],
+    [1, 1, -1, 0, 299, 0], [2, 0, 3, 0, 294, 0], [2, 0, -1, -2, 0, 8752]], dtype=float)
+
+# Meeus table 47.B, periodic terms of the Moon's latitude (1e-6 degrees), multiples of D, M, M', F then sigma b
+MOON_B_TERMS = np.array([
+    [0, 0, 0, 1, 5128122], [0, 0, 1, 1, 280602], [0, 0, 1, -1, 277693], [2, 0, 0, -1, 173237],
+    [2, 0, -1, 1, 55413], [2, 0, -1, -1, 46271], [2, 0, 0, 1, 32573], [0, 0, 2, 1, 17198],
+    [2, 0, 1, -1, 9266], [0, 0, 2, -1, 8822], [2, -1, 0, -1, 8216], [2, 0, -2, -1, 4324],
+    [2, 0, 1, 1, 4200], [2, 1, 0, -1, -3359], [2, -1, -1, 1, 2463], [2, -1, 0, 1, 2211],
+    [2, -1, -1, -1, 2065], [0, 1, -1, -1, -1870], [4, 0, -1, -1, 1828], [0, 1, 0, 1, -1794],
+    [0, 0, 0, 3, -1749], [0, 1, -1, 1, -1565], [1, 0, 0, 1, -1491], [0, 1, 1, 1, -1475],
+    [0, 1, 1, -1, -1410], [0, 1, 0, -1, -1344], [1, 0, 0, -1, -1335], [0, 0, 3, 1, 1107],
+    [4, 0, 0, -1, 1021], [4, 0, -1, 1, 833], [0, 0, 1, -3, 777], [4, 0, -2, 1, 671],
+    [2, 0, 0, -3, 607], [2, 0, 2, -1, 596], [2, -1, 1, -1, 491], [2, 0, -2, 1, -451],
+    [0, 0, 3, -1, 439], [2, 0, 2, 1, 422], [2, 0, -3, -1, 421], [2, 1, -1, 1, -366],
+    [2, 1, 0, 1, -351], [4, 0, 0, 1, 331], [2, -1, 1, 1, 315], [2, -2, 0, -1, 302],
+    [0, 0, 1, 3, -283], [2, 1, 1, -1, -229], [1, 1, 0, -1, 223], [1, 1, 0, 1, 223],
+    [0, 1, -2, -1, -220], [2, 1, -1, -1, -220], [1, 0, 1, 1, -185], [2, -1, -2, -1, 181],
+    [0, 1, 2, 1, -177], [4, 0, -2, -1, 176], [4, -1, -1, -1, 166], [1, 0, 1, -1, -164],
+    [4, 0, 1, -1, 132], [1, 0, -1, -1, -119], [4, -1, 0, -1, 115], [2, -2, 0, 1, 107]], dtype=float)
+
+
+def _centuries(tt):
+    return (np.asarray(tt, dtype=float) - 2451545.0) / 36525
+
+
+def nutation(T):
+    '''
+    nutation in longitude and obliquity, and the true obliquity of the ecliptic, Meeus chapter 22 (0.5" and 0.1")
+    :param T: julian centuries (TT) from J2000
+    :return: delta psi, delta epsilon, epsilon in degrees
+    '''
+    omega = np.radians(125.04452 - 1934.136261 * T)
+    L = np.radians(280.4665 + 36000.7698 * T)
+    Lm = np.radians(218.3165 + 481267.8813 * T)
+    dpsi = (-17.20 * np.sin(omega) - 1.32 * np.sin(2 * L) - 0.23 * np.sin(2 * Lm) + 0.21 * np.sin(2 * omega)) / 3600
+    deps = (9.20 * np.cos(omega) + 0.57 * np.cos(2 * L) + 0.10 * np.cos(2 * Lm) - 0.09 * np.cos(2 * omega)) / 3600
+    eps0 = 23.4392911111 + (-46.8150 * T - 0.00059 * T ** 2 + 0.001813 * T ** 3) / 3600
+    return dpsi, deps, eps0 + deps
+
+
+def sun_position(tt):
+    '''
+    apparent geocentric ecliptic longitude (true equinox of date) and distance of the Sun, Meeus chapter 25
+    :param tt: TT julian date(s)
+    :return: longitude in degrees, distance in km
+    '''
+    T = _centuries(tt)
+    L0 = 280.46646 + 36000.76983 * T + 0.0003032 * T ** 2
+    M = np.radians(357.52911 + 35999.05029 * T - 0.0001537 * T ** 2)
+    e = 0.016708634 - 0.000042037 * T - 0.0000001267 * T ** 2
+    C = ((1.914602 - 0.004817 * T - 0.000014 * T ** 2) * np.sin(M) + (0.019993 - 0.000101 * T) * np.sin(2 * M) +
+         0.000289 * np.sin(3 * M))
+    nu = M + np.radians(C)
+    R = 1.000001018 * (1 - e * e) / (1 + e * np.cos(nu))
+    dpsi, deps, eps = nutation(T)
+    longitude = L0 + C + dpsi - 20.4898 / 3600 / R  # nutation and aberration
+    return longitude % 360, R * AU_KM
+
+
+def moon_position(tt):
+    '''
+    apparent geocentric ecliptic longitude (true equinox of date), latitude and distance of the Moon, Meeus
+    chapter 47
+    :param tt: TT julian date(s)
+    :return: longitude and latitude in degrees, distance in km
+    '''
+    T = _centuries(tt)
+    Lp = 218.3164477 + 481267.88123421 * T - 0.0015786 * T ** 2 + T ** 3 / 538841 - T ** 4 / 65194000
+    D = 297.8501921 + 445267.1114034 * T - 0.0018819 * T ** 2 + T ** 3 / 545868 - T ** 4 / 113065000
+    M = 357.5291092 + 35999.0502909 * T - 0.0001536 * T ** 2 + T ** 3 / 24490000
+    Mp = 134.9633964 + 477198.8675055 * T + 0.0087414 * T ** 2 + T ** 3 / 69699 - T ** 4 / 14712000
+    F = 93.2720950 + 483202.0175233 * T - 0.0036539 * T ** 2 - T ** 3 / 3526000 + T ** 4 / 863310000
+    A1 = np.radians(119.75 + 131.849 * T)
+    A2 = np.radians(53.09 + 479264.290 * T)
+    A3 = np.radians(313.45 + 481266.484 * T)
+    E = 1 - 0.002516 * T - 0.0000074 * T ** 2
+    fundamentals = np.radians(np.array([D, M, Mp, F]))
+
+    # the terms involving M are scaled by the decreasing eccentricity of the Earth's orbit
+    args = MOON_LR_TERMS[:, :4] @ fundamentals.reshape(4, -1)
+    scale = E.reshape(1, -1) ** np.abs(MOON_LR_TERMS[:, 1:2])
+    sigma_l = (MOON_LR_TERMS[:, 4:5] * scale * np.sin(args)).sum(axis=0)
+    sigma_r = (MOON_LR_TERMS[:, 5:6] * scale * np.cos(args)).sum(axis=0)
+    args = MOON_B_TERMS[:, :4] @ fundamentals.reshape(4, -1)
+    scale = E.reshape(1, -1) ** np.abs(MOON_B_TERMS[:, 1:2])
+    sigma_b = (MOON_B_TERMS[:, 4:5] * scale * np.sin(args)).sum(axis=0)
+
+    Lp_r, F_r, Mp_r = np.radians(Lp), np.radians(F), np.radians(Mp)
+    sigma_l = sigma_l.reshape(np.shape(T)) + 3958 * np.sin(A1) + 1962 * np.sin(Lp_r - F_r) + 318 * np.sin(A2)
+    sigma_b = (sigma_b.reshape(np.shape(T)) - 2235 * np.sin(Lp_r) + 382 * np.sin(A3) + 175 * np.sin(A1 - F_r) +
+               175 * np.sin(A1 + F_r) + 127 * np.sin(Lp_r - Mp_r) - 115 * np.sin(Lp_r + Mp_r))
+    dpsi, deps, eps = nutation(T)
+    longitude = Lp + sigma_l / 1e6 + dpsi
+    return longitude % 360, sigma_b / 1e6, 385000.56 + sigma_r.reshape(np.shape(T)) / 1000
+
+
+def _ecliptic_to_terrestrial(longitude, latitude, distance, eps, gast):
+    '''
+    ecliptic of date to the Earth-fixed frame by way of the true equator and equinox of date, polar motion ignored
+    '''
+    lam, beta, eps, theta = [np.radians(x) for x in (longitude, latitude, eps, gast)]
+    x = distance * np.cos(beta) * np.cos(lam)
+    y = distance * np.cos(beta) * np.sin(lam)
+    z = distance * np.sin(beta)
+    y, z = y * np.cos(eps) - z * np.sin(eps), y * np.sin(eps) + z * np.cos(eps)
+    return np.array([x * np.cos(theta) + y * np.sin(theta), -x * np.sin(theta) + y * np.cos(theta), z])
+
+
+def analytic_positions(t):
+    '''
+    geocentric Sun and Moon in the Earth-fixed frame from the analytic theory, a drop in replacement for
+    skyfieldcalcs.geocentric_positions where a minute or so of error in the contacts is acceptable
+    :param t: skyfield Time array at a regular step
+    :return: dict with TT julian dates, step in seconds, and 3xN arrays of Sun and Moon positions in km
+    '''
+    tt = t.tt
+    T = _centuries(tt)
+    dpsi, deps, eps = nutation(T)
+    # apparent sidereal time from the mean, skyfield's gast would evaluate the full IAU 2000A nutation series
+    gast = t.gmst * 15 + dpsi * np.cos(np.radians(eps))
+    sun_lon, sun_dist = sun_position(tt)
+    moon_lon, moon_lat, moon_dist = moon_position(tt)
+    return {'tt': tt,
+            'step': grid_step(tt),
+            'sun': _ecliptic_to_terrestrial(sun_lon, 0, sun_dist, eps, gast),
+            'moon': _ecliptic_to_terrestrial(moon_lon, moon_lat, moon_dist, eps, gast)}
+
+
+def eclipse_span(geo, lat, lon, ele=0, tolerance=0.02):
+    '''
+    first and last times the Sun is (or is within tolerance of being) eclipsed, the tolerance covers the error of
+    the analytic theory so a grazing partial eclipse is not missed
+    :param geo: dict from analytic_positions or geocentric_positions
+    :param tolerance: degrees added to the sum of the radii
+    :return: arrays of TT julian dates of the first and last such samples, nan where there are none
+    '''
+    xyz = site_xyz(lat, lon, ele)
+    separation, sun_r, moon_r = local_geometry(geo['sun'][:, None, :], geo['moon'][:, None, :], xyz[:, :, None])
+    near = separation < sun_r + moon_r + tolerance
+    found = near.any(axis=1)
+    first = np.where(found, geo['tt'][near.argmax(axis=1)], np.nan)
+    last = np.where(found, geo['tt'][near.shape[1] - 1 - near[:, ::-1].argmax(axis=1)], np.nan)
+    return first, last
+
+
+def hybrid_contacts(ge, lat, lon, ele=0, eph=None, margin=600, window_hours=4, step=1, coarse=60):
+    '''
+    local circumstances of one observer where the contacts are found from the analytic theory and refined
+    with the JPL kernel, evaluated only within margin seconds of where the analytic theory puts them
+    :param ge: entry from get_canon_Espenak, or TT julian date of greatest eclipse
+    :param eph: ephemeris (default, load_ephemeris for the year of the eclipse)
+    :param margin: seconds either side of each analytic contact evaluated with the kernel
+    :param window_hours: hours either side of greatest eclipse scanned with the analytic theory
+    :param step: resolution of the refinement in seconds
+    :return: dict of arrays from local_contacts (one observer)
+    '''
+    tt = greatest_eclipse_tt(ge) if isinstance(ge, dict) else ge
+    if eph is None:
+        eph = load_ephemeris(ts.tt_jd(tt).tt_calendar()[0])
+    scan = analytic_positions(eclipse_window(tt, hours=window_hours, step=coarse))
+    first, last = eclipse_span(scan, lat, lon, ele)
+    if np.isnan(first[0]):
+        return local_contacts(scan, lat, lon, ele, coarse=coarse)  # not even close, nothing to refine
+    first, last = first[0] - coarse / 86400, last[0] + coarse / 86400  # the crossings are between samples
+    if (last - first) * 86400 <= 4 * margin:
+        # a short eclipse, one window covers all of it
+        geo = geocentric_positions(_span(first - margin / 86400, last + margin / 86400, step), eph)
+        return local_contacts(geo, lat, lon, ele, coarse=coarse)
+
+    # C1, maximum (with C2 and C3) and C4 each from their own window
+    approx = local_contacts(scan, lat, lon, ele, coarse=coarse)
+    mid = approx['mid'][0] if not np.isnan(approx['mid'][0]) else (first + last) / 2
+    windows = {'c1': (first - margin / 86400, first + margin / 86400),
+               'mid': (mid - (margin + 480) / 86400, mid + (margin + 480) / 86400),
+               'c4': (last - margin / 86400, last + margin / 86400)}
+    result = None
+    for contact, (start, end) in windows.items():
+        contacts = local_contacts(geocentric_positions(_span(start, end, step), eph), lat, lon, ele, coarse=coarse)
+        if contact == 'mid':
+            mid_contacts = contacts
+            continue
+        if result is None:
+            result = {attr: values.copy() for attr, values in contacts.items()}
+        result[contact] = contacts[contact]
+        result[f'{contact}_sun_alt'] = contacts[f'{contact}_sun_alt']
+        result[f'{contact}_sun_az'] = contacts[f'{contact}_sun_az']
+        if not (start < contacts[contact][0] < end):
+            # outside the theory's error, fall back to the kernel across the whole window
+            geo = geocentric_positions(eclipse_window(tt, hours=window_hours, step=step), eph)
+            return local_contacts(geo, lat, lon, ele, coarse=coarse)
+    for attr, values in mid_contacts.items():
+        if attr not in ['c1', 'c4', 'c1_sun_alt', 'c1_sun_az', 'c4_sun_alt', 'c4_sun_az']:
+            result[attr] = values
+    return result
+
+
+def _span(start, end, step):
+    '''skyfield times from start to end (TT julian dates) every step seconds'''
+    return ts.tt_jd(start, np.arange(0, (end - start) * 86400 + step, step) / 86400)
@@ -0,0 +1,210 @@
+'''
+batch localization of a list of sites on a process pool, with resumable output
+
+    python -m circumstances.batch markets.csv --output caches/markets.jsonl --workers 4 --years 2023 2024
+
+the input is CSV with a header, or JSONL, with name, lat, lon and optionally ele and tz columns. Sites that round
+to the same place (see places) with the same ele and tz are computed once, under the first name, with every name
+kept in names, a different ele or tz makes a different site.
+each result is appended to the JSONL output as soon as it arrives and the output doubles as the checkpoint, run
+the same command again after an interruption and sites already in it are skipped. Sites that fail are reported
+and left out, so they are retried on the next run. --parquet converts the results with circumstances.export.
+--offline (for workers with a cache bundle, see circumstances.bundle) reports sites that aren't cached as failed
+rather than fetching them
+'''
+import argparse
+import csv
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing.util import Finalize
+
+from skyfield.timelib import Time
+
+from circumstances.utils import set_offline
+
+_worker_driver = None  # selenium driver of this worker process, started on first use
+
+
+def read_sites(filename):
+    '''
+    :param filename: .csv with a header row, or .jsonl/.json with one object per line
+    :return: list of dictionaries with name, lat, lon and, when given, ele and tz
+    '''
+    fp = open(filename, newline='')
+    if filename.endswith('.csv'):
+        rows = list(csv.DictReader(fp))
+    else:
+        rows = [json.loads(line) for line in fp if line.strip()]
+    fp.close()
+    sites = []
+    for row in rows:
+        site = {'name': row['name'], 'lat': float(row['lat']), 'lon': float(row['lon'])}
+        for attr, kind in [('ele', float), ('tz', str)]:
+            if row.get(attr) not in (None, ''):
+                site[attr] = kind(row[attr])
+        sites.append(site)
+    return sites
+
+
+def site_key(lat, lon, ele=None, tz=None, places=2):
+    '''
+    the key solar_eclipse_local caches a site under, lat,lon,ele with the elevation left off when it is to be
+    looked up, and the timezone after a space when one is given
+    '''
+    key = f"{round(lat, places)},{round(lon, places)}"
+    if ele is not None:
+        key += f",{round(ele)}"
+    if tz is not None:
+        key += f" {tz}"
+    return key
+
+
+def dedupe_sites(sites, places=2):
+    '''
+    sites keyed by site_key, the first of any that collide (same place, ele and tz) is kept with the names of the
+    others added to names
+    '''
+    unique = {}
+    for site in sites:
+        key = site_key(site['lat'], site['lon'], site.get('ele'), site.get('tz'), places)
+        if key in unique:
+            unique[key]['names'].append(site['name'])
+            continue
+        unique[key] = dict(site, key=key, names=[site['name']])
+    return unique
+
+
+def load_checkpoint(output):
+    '''
+    keys of the sites already in the output, a partial line left by an interruption is cut off
+    '''
+    done = set()
+    if not os.path.exists(output):
+        return done
+    fp = open(output, 'r+b')
+    good = 0
+    for line in fp:
+        try:
+            done.add(json.loads(line)['key'])
+        except (ValueError, KeyError):
+            break
+        good += len(line)
+    fp.truncate(good)
+    fp.close()
+    return done
+
+
+def worker_driver(factory=None):
+    '''
+    the selenium driver of this worker process, started on first use and quit when the worker exits
+    pool workers leave through os._exit, which skips atexit, but multiprocessing runs its finalizers first
+    :param factory: function starting a driver (default, get_driver)
+    '''
+    global _worker_driver
+    if _worker_driver is None:
+        if factory is None:
+            from circumstances.utils import get_driver
+            factory = get_driver
+        _worker_driver = factory()
+        Finalize(_worker_driver, _worker_driver.quit, exitpriority=10)
+    return _worker_driver
+
+
+def localize_site(site, years, places=2):
+    '''
+    localize() for one site with the selenium driver of this worker
+    :return: dictionary for the output, inpath, nearpath, farpath and prevnextevents as from localize and the
+             flat rows circumstances.export converts
+    '''
+    from circumstances.circumstances import solar_eclipse_local
+    from circumstances.export import localize_rows
+    from circumstances.utils import is_offline
+    driver = None if is_offline() else worker_driver()  # offline, sites come from the cache or fail without one
+    local = solar_eclipse_local(site['name'], site['lat'], site['lon'], ele=site.get('ele'),
+                                timezone=site.get('tz'), places=places, driver=driver)
+    inpath, nearpath, farpath, prevnextevents = local.localize(years=years)
+    record = {'key': site['key'], 'name': site['name'], 'names': site['names'], 'lat': local.lat, 'lon': local.lon,
+              'ele': local.ele, 'tz': local.timezone, 'inpath': inpath, 'nearpath': nearpath, 'farpath': farpath,
+              'prevnextevents': prevnextevents}
+    record['rows'] = localize_rows(record)
+    return record
+
+
+def _json_default(value):
+    if isinstance(value, Time):
+        return value.tt
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def run_batch(sites, output, years=None, places=2, max_workers=None, task=localize_site):
+    '''
+    localizes sites on a process pool, appending a JSON line to output for each as it completes
+    :param sites: list from read_sites
+    :param output: JSONL file, also the checkpoint
+    :param years: passed to localize
+    :param task: function of (site, years, places) returning a JSON serializable dictionary with key
+    :return: counts of sites done, skipped as already in the output, failed and merged as duplicates
+    '''
+    unique = dedupe_sites(sites, places)
+    done = load_checkpoint(output)
+    todo = [site for key, site in unique.items() if key not in done]
+    report = {'done': 0, 'skipped': len(unique) - len(todo), 'failed': 0, 'merged': len(sites) - len(unique)}
+    if len(todo) == 0:
+        return report
+    if max_workers is None:
+        max_workers = os.cpu_count()
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    fp = open(output, 'a')
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            pending = {}
+            for site in todo:
+                if len(pending) >= 2 * max_workers:
+                    _collect(fp, pending, wait(pending, return_when=FIRST_COMPLETED).done, report)
+                pending[executor.submit(task, site, years, places)] = site
+            _collect(fp, pending, list(pending), report)
+    finally:
+        fp.close()
+    return report
+
+
+def _collect(fp, pending, finished, report):
+    for future in finished:
+        site = pending.pop(future)
+        try:
+            line = json.dumps(future.result(), default=_json_default)
+        except Exception as e:
+            print(f"error localizing {site['name']} ({site['key']}), {e}")
+            report['failed'] += 1
+            continue
+        fp.write(line + '\n')
+        fp.flush()
+        report['done'] += 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sites', help='CSV or JSONL of name, lat, lon and optionally ele and tz')
+    parser.add_argument('--output', required=True, help='JSONL results, resumed when it exists')
+    parser.add_argument('--years', type=int, nargs='+', default=[2023, 2024], help='passed to localize')
+    parser.add_argument('--places', type=int, default=2, help='decimal places sites are rounded to')
+    parser.add_argument('--workers', type=int, help='process pool size (default, number of CPUs)')
+    parser.add_argument('--parquet', help='also convert the results to this Parquet file (requires pyarrow)')
+    parser.add_argument('--offline', action='store_true',
+                        help='strict offline mode, fail on anything not cached instead of fetching it')
+    args = parser.parse_args(argv)
+    if args.offline:
+        set_offline()
+    report = run_batch(read_sites(args.sites), args.output, years=args.years, places=args.places,
+                       max_workers=args.workers)
+    if args.parquet:
+        from circumstances.export import jsonl_to_parquet
+        report['rows'] = jsonl_to_parquet(args.output, args.parquet)
+    print(json.dumps(report))
+
+
+if __name__ == '__main__':
+    main()
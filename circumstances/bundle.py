@@ -0,0 +1,424 @@
+'''
+portable bundle of the caches, for workers without network access
+
+    python -m circumstances.bundle export caches.zip --years 1900 2100
+    python -m circumstances.bundle import caches.zip        # on the worker
+    CIRCUMSTANCES_OFFLINE=1 python -m circumstances.batch sites.csv --output caches/sites.jsonl
+
+a bundle is a zip archive holding the canon pickles, parsed paths, per location results (caches/gsfc_local),
+eclipse snapshots, the requests_cache SQLite files and excerpts of the JPL kernels load_ephemeris picks for the
+years asked for, installed under their own names (ex. de421.2020-2030.bsp) with the years they cover recorded
+in excerpts.json so load_ephemeris falls back to them only for those years. manifest.json lists every member
+with its kind, size and SHA-256 and the version of the format, import_bundle refuses a bundle with a member that
+would land outside the caches or the ephemeris directory.
+members are stored uncompressed so a cache_bundle reads the index and any member straight from the memory
+mapped archive without unpacking the rest. In strict offline mode (see circumstances.utils.set_offline)
+anything missing from the caches raises offline_error rather than fetching it
+'''
+import argparse
+import datetime
+import hashlib
+import io
+import json
+import mmap
+import os
+import pathlib
+import pickle
+import shutil
+import sqlite3
+import struct
+import subprocess
+import sys
+import tempfile
+import zipfile
+
+import numpy as np
+
+from circumstances.utils import EPHEMERIS_DIR, EXCERPTS, KERNEL_YEARS, ephemeris_name, excerpt_name, \
+    installed_excerpts, write_atomic
+
+BUNDLE_VERSION = 1
+MANIFEST = 'manifest.json'
+CANON_FILES = ['espenak_solar_eclipse_canon.pickle', 'gsfc_eclipse_canon.pickle']
+KINDS = ['canon', 'path', 'local', 'snapshot', 'http', 'cache', 'ephemeris']
+# Earth-Moon barycenter, Sun, Moon and Earth segments are all skyfield needs for eclipse geometry
+EPHEMERIS_TARGETS = '3,10,301,399'
+
+
+class cache_bundle(object):
+    '''
+    read access to a bundle without unpacking it, each member is a slice of the memory mapped archive
+    release views and arrays from it before close
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.fp = open(filename, 'rb')
+        self.mm = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._read_index()
+        except Exception:
+            self.close()
+            raise
+        self.entries = {entry['name']: entry for entry in self.manifest['entries']}
+
+    def _read_index(self):
+        archive = zipfile.ZipFile(self.fp)
+        self.offsets = {}
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"{self.filename} member {info.filename} is compressed, not a cache bundle")
+            self.offsets[info.filename] = _data_offset(self.mm, info)
+        if MANIFEST not in self.offsets:
+            raise ValueError(f"{self.filename} has no {MANIFEST}, not a cache bundle")
+        self.manifest = json.loads(archive.read(MANIFEST))
+        if self.manifest.get('version', 0) > BUNDLE_VERSION:
+            raise ValueError(f"{self.filename} is bundle version {self.manifest['version']}, this reads up to "
+                             f"{BUNDLE_VERSION}")
+
+    def view(self, name):
+        '''
+        the bytes of a member, a memoryview of the archive
+        '''
+        entry = self.entries[name]
+        offset = self.offsets[name]
+        return memoryview(self.mm)[offset:offset + entry['size']]
+
+    def load_pickle(self, name):
+        '''
+        unpickles a member, ex. caches/espenak_solar_eclipse_canon.pickle
+        '''
+        with self.view(name) as view:
+            return pickle.loads(view)
+
+    def array(self, name):
+        '''
+        a .npy member as a read only array backed by the archive
+        '''
+        view = self.view(name)
+        fp = io.BytesIO(view[:65536])
+        version = np.lib.format.read_magic(fp)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(fp)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(fp)
+        values = np.frombuffer(view, dtype=dtype, count=int(np.prod(shape)), offset=fp.tell())
+        return values.reshape(shape, order='F' if fortran_order else 'C')
+
+    def snapshot(self, prefix):
+        '''
+        an eclipse_snapshot from the members written by eclipse_snapshot.save, ex. caches/snapshots/+2024-04-08
+        '''
+        from circumstances.snapshot import eclipse_snapshot
+        with self.view(f"{prefix}.json") as view:
+            meta = json.loads(bytes(view))
+        tt0 = meta.pop('tt0')
+        segment = meta.pop('segment')
+        meta.pop('shape', None)
+        return eclipse_snapshot(self.array(f"{prefix}.npy"), tt0, segment, meta=meta)
+
+    def verify(self):
+        '''
+        :return: names of the members whose size or SHA-256 doesn't match the manifest, empty when the bundle is
+                 intact
+        '''
+        bad = []
+        for name, entry in self.entries.items():
+            if name not in self.offsets:
+                bad.append(name)
+                continue
+            with self.view(name) as view:
+                if len(view) != entry['size'] or hashlib.sha256(view).hexdigest() != entry['sha256']:
+                    bad.append(name)
+        return bad
+
+    def close(self):
+        self.mm.close()
+        self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _data_offset(mm, info):
+    '''
+    where the data of a stored member begins, after its local file header
+    '''
+    signature, = struct.unpack_from('<I', mm, info.header_offset)
+    if signature != 0x04034b50:
+        raise ValueError(f"bad local header for {info.filename}")
+    name_length, extra_length = struct.unpack_from('<HH', mm, info.header_offset + 26)
+    return info.header_offset + 30 + name_length + extra_length
+
+
+def cache_kind(relpath):
+    '''
+    kind of a file under the caches directory, None for files that don't belong in a bundle
+    '''
+    parts = relpath.split(os.sep)
+    if parts[-1].startswith('.'):
+        return None  # temporary files of pickle_dump_atomic
+    if parts[0] == 'gsfc_local':
+        return 'local'
+    if parts[0] == 'paths':
+        return 'path'
+    if parts[0] == 'snapshots':
+        return 'snapshot' if relpath.endswith(('.npy', '.json')) else None
+    if relpath in CANON_FILES:
+        return 'canon'
+    if relpath.endswith(('.sqlite', '.sqllite')):
+        return 'http'
+    if relpath.endswith('.pickle'):
+        return 'cache'
+    return None
+
+
+def cache_files(caches='caches', kinds=None):
+    '''
+    :return: list of (path, member name, kind) of the files under caches to bundle
+    '''
+    files = []
+    for directory, subdirectories, filenames in os.walk(caches):
+        subdirectories.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(directory, filename)
+            relpath = os.path.relpath(path, caches)
+            kind = cache_kind(relpath)
+            if kind is None or (kinds is not None and kind not in kinds):
+                continue
+            files.append((path, 'caches/' + relpath.replace(os.sep, '/'), kind))
+    return files
+
+
+def sqlite_copy(filename, copy):
+    '''
+    consistent copy of a SQLite database, including what is still in its write ahead log
+    '''
+    source = sqlite3.connect(f"{pathlib.Path(filename).resolve().as_uri()}?mode=ro", uri=True)
+    destination = sqlite3.connect(copy)
+    try:
+        source.backup(destination)
+    finally:
+        destination.close()
+        source.close()
+
+
+def excerpt_years(kernel, years):
+    '''the years (first, last) of an excerpt of kernel for years, those of them the kernel covers'''
+    first, last = KERNEL_YEARS.get(kernel, years)
+    return max(first, years[0]), min(last, years[1])
+
+
+def ephemeris_excerpt(kernel, years, output, ephemeris_dir=EPHEMERIS_DIR):
+    '''
+    cuts the Sun, Moon and Earth segments for years (first, last) out of a JPL kernel with jplephem
+    :return: output, None when the kernel isn't in ephemeris_dir
+    '''
+    path = os.path.join(ephemeris_dir, kernel)
+    if not os.path.exists(path):
+        print(f"no {path}, {kernel} left out of the bundle")
+        return None
+    first, last = excerpt_years(kernel, years)
+    subprocess.run([sys.executable, '-m', 'jplephem', 'excerpt', '--targets', EPHEMERIS_TARGETS, str(first),
+                    str(last + 1), path, output], check=True, stdout=subprocess.DEVNULL)
+    return output
+
+
+def sha256_file(filename):
+    digest = hashlib.sha256()
+    fp = open(filename, 'rb')
+    for block in iter(lambda: fp.read(1 << 20), b''):
+        digest.update(block)
+    fp.close()
+    return digest.hexdigest()
+
+
+def export_bundle(filename, caches='caches', years=None, kinds=None, ephemeris_dir=EPHEMERIS_DIR):
+    '''
+    packs the caches, and excerpts of the kernels for years, into a bundle
+    :param years: (first, last) years the ephemeris is needed for, None leaves the ephemeris out
+    :param kinds: kinds of cache to include (default, all of KINDS)
+    :return: the manifest
+    '''
+    staging = tempfile.mkdtemp(prefix='bundle')
+    try:
+        files = []
+        for path, name, kind in cache_files(caches, kinds):
+            if kind == 'http':
+                copy = os.path.join(staging, f"{len(files)}.sqlite")
+                sqlite_copy(path, copy)
+                path = copy
+            files.append((path, name, kind, {}))
+        if years is not None and (kinds is None or 'ephemeris' in kinds):
+            for kernel in sorted({ephemeris_name(year) for year in range(years[0], years[1] + 1)}):
+                first, last = excerpt_years(kernel, years)
+                name = excerpt_name(kernel, first, last)
+                output = ephemeris_excerpt(kernel, years, os.path.join(staging, name), ephemeris_dir)
+                if output is not None:
+                    files.append((output, f"ephemeris/{name}", 'ephemeris',
+                                  {'kernel': kernel, 'years': [first, last]}))
+
+        entries = [dict({'name': name, 'kind': kind, 'size': os.path.getsize(path), 'sha256': sha256_file(path)},
+                        **extra) for path, name, kind, extra in files]
+        manifest = {'version': BUNDLE_VERSION, 'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                    'years': years, 'entries': entries}
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        partial = f"{filename}.partial"
+        archive = zipfile.ZipFile(partial, 'w', zipfile.ZIP_STORED, allowZip64=True)
+        archive.writestr(MANIFEST, json.dumps(manifest, indent=1))
+        for path, name, kind, extra in files:
+            archive.write(path, name)
+        archive.close()
+        os.replace(partial, filename)
+    finally:
+        shutil.rmtree(staging)
+    return manifest
+
+
+def import_bundle(filename, caches='caches', ephemeris_dir=EPHEMERIS_DIR, overwrite=True):
+    '''
+    installs a bundle, after checking every member against the manifest and that none would be written outside
+    caches and ephemeris_dir (unsafe_members), nothing is written if any fails
+    kernel excerpts are installed under their own names (excerpt_name) with their years recorded in EXCERPTS, for
+    load_ephemeris, an excerpt replaces one installed before only when it covers more years, and none is installed
+    where the full kernel is
+    :param overwrite: replace cache files that differ from the bundle's, otherwise keep them
+    :return: counts of files written, unchanged and kept
+    '''
+    report = {'written': 0, 'unchanged': 0, 'kept': 0}
+    with cache_bundle(filename) as bundle:
+        bad = bundle.verify()
+        if len(bad) > 0:
+            raise ValueError(f"{filename} is damaged, checksums don't match for {', '.join(bad)}, nothing imported")
+        unsafe = unsafe_members(bundle.entries, caches, ephemeris_dir)
+        if len(unsafe) > 0:
+            raise ValueError(f"{filename} has members that can't be installed safely, {', '.join(unsafe)}, "
+                             f"nothing imported")
+        for name, entry in bundle.entries.items():
+            top, relpath = name.split('/', 1)
+            if top == 'ephemeris':
+                report[_install_excerpt(bundle, name, entry, ephemeris_dir)] += 1
+                continue
+            path = os.path.join(caches, *relpath.split('/'))
+            if os.path.exists(path):
+                if sha256_file(path) == entry['sha256']:
+                    report['unchanged'] += 1
+                    continue
+                if not overwrite:
+                    report['kept'] += 1
+                    continue
+            with bundle.view(name) as view:
+                write_atomic(path, lambda fp: fp.write(view))
+            if entry['kind'] == 'http':
+                for suffix in ['-wal', '-shm']:  # left by the database that was replaced
+                    if os.path.exists(path + suffix):
+                        os.unlink(path + suffix)
+            report['written'] += 1
+        os.makedirs(caches, exist_ok=True)  # a bundle of kernel excerpts alone writes nothing there
+        fp = open(os.path.join(caches, 'bundle.json'), 'w')
+        json.dump(dict(bundle.manifest, source=os.path.abspath(filename), report=report), fp, indent=1)
+        fp.close()
+    return report
+
+
+def _install_excerpt(bundle, name, entry, ephemeris_dir):
+    '''
+    :return: 'written', 'unchanged' or 'kept'
+    '''
+    filename = name.split('/', 1)[1]
+    kernel = entry.get('kernel', filename)  # version 1 bundles named excerpts after the kernel
+    first, last = excerpt_years(kernel, entry['years'])
+    excerpts = installed_excerpts(ephemeris_dir)
+    current = excerpts.get(kernel)
+    if current is None and os.path.exists(os.path.join(ephemeris_dir, kernel)):
+        return 'kept'  # the full kernel
+    filename = excerpt_name(kernel, first, last)
+    if current is not None:
+        (start, end), path = current['years'], os.path.join(ephemeris_dir, current['file'])
+        if start <= first and last <= end and os.path.exists(path):
+            return 'unchanged' if current['file'] == filename and sha256_file(path) == entry['sha256'] else 'kept'
+        if last - first < end - start and os.path.exists(path):
+            return 'kept'
+    with bundle.view(name) as view:
+        write_atomic(os.path.join(ephemeris_dir, filename), lambda fp: fp.write(view))
+    excerpts[kernel] = {'file': filename, 'years': [first, last]}
+    write_atomic(os.path.join(ephemeris_dir, EXCERPTS), lambda fp: fp.write(json.dumps(excerpts, indent=1).encode()))
+    if current is not None and current['file'] != filename:
+        previous = os.path.join(ephemeris_dir, current['file'])
+        if os.path.exists(previous):
+            os.unlink(previous)
+    return 'written'
+
+
+def unsafe_members(entries, caches='caches', ephemeris_dir=EPHEMERIS_DIR):
+    '''
+    names of the members of a bundle import_bundle would not install: cache files that would land outside caches
+    (ex. caches/../../escaped.txt), excerpts of anything but a kernel of KERNEL_YEARS, and names under neither
+    :param entries: bundle.entries, name: manifest entry
+    :return: list of names, empty when every member is safe to install
+    '''
+    unsafe = []
+    for name, entry in entries.items():
+        top, slash, relpath = name.partition('/')
+        if top == 'ephemeris':
+            # the excerpt is written as excerpt_name(kernel, years), never under the member's name
+            kernel, years = entry.get('kernel', relpath), entry.get('years')
+            if kernel not in KERNEL_YEARS or not isinstance(years, list) or len(years) != 2 or \
+                    not all(type(year) is int for year in years):
+                unsafe.append(name)
+        elif top != 'caches' or not _inside(os.path.join(caches, *relpath.split('/')), caches):
+            unsafe.append(name)
+    return unsafe
+
+
+def _inside(path, directory):
+    '''True when path, links and .. resolved, is below directory'''
+    path, directory = os.path.realpath(path), os.path.realpath(directory)
+    return path != directory and os.path.commonpath([path, directory]) == directory
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export', help='pack the caches into a bundle')
+    export.add_argument('bundle')
+    export.add_argument('--years', type=int, nargs=2, metavar=('FIRST', 'LAST'),
+                        help='include kernel excerpts covering these years')
+    export.add_argument('--kinds', nargs='+', choices=KINDS, help='kinds of cache to include (default, all)')
+    install = commands.add_parser('import', help='check and unpack a bundle')
+    install.add_argument('bundle')
+    install.add_argument('--keep', action='store_true', help="keep cache files that differ from the bundle's")
+    for name in ['list', 'verify']:
+        commands.add_parser(name, help=f"{name} the members of a bundle").add_argument('bundle')
+    for command in commands.choices.values():
+        command.add_argument('--caches', default='caches', help='caches directory')
+        command.add_argument('--ephemeris-dir', default=EPHEMERIS_DIR, help='directory of the JPL kernels')
+    args = parser.parse_args(argv)
+
+    if args.command == 'export':
+        manifest = export_bundle(args.bundle, caches=args.caches, years=args.years, kinds=args.kinds,
+                                 ephemeris_dir=args.ephemeris_dir)
+        print(f"{args.bundle}, {len(manifest['entries'])} files")
+    elif args.command == 'import':
+        print(json.dumps(import_bundle(args.bundle, caches=args.caches, ephemeris_dir=args.ephemeris_dir,
+                                       overwrite=not args.keep)))
+    else:
+        with cache_bundle(args.bundle) as bundle:
+            if args.command == 'list':
+                print(f"version {bundle.manifest['version']}, created {bundle.manifest['created']}")
+                for entry in bundle.manifest['entries']:
+                    print(f"{entry['kind']:10}{entry['size']:>14}  {entry['name']}")
+            else:
+                bad = bundle.verify()
+                print(f"{len(bad)} damaged" + ''.join(f"\n{name}" for name in bad))
+                if len(bad) > 0:
+                    sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
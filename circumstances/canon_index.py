@@ -0,0 +1,196 @@
+'''
+secondary indexes over the Espenak canon, by saros series, type, year, gamma and where greatest eclipse falls
+
+    canon, otherdates = get_canon_Espenak()
+    index = get_canon_index()
+    for key in index.query(saros=139, eclipse_type='T', region='north_america'):
+        print(canon[key]['date_ut1'], canon[key]['ge_lat'], canon[key]['ge_lon'])
+    for key in index.saros_series(139, start='2024-Apr-08'):
+        ...
+
+the index holds canon keys (the UT1 date), queries intersect the candidates of each criterion starting from the
+smallest so none of them scans the canon. It is built once and kept in the canon pickle, a refresh of the canon
+drops it and the next get_canon_index builds it again
+'''
+import bisect
+import math
+import pickle
+
+from circumstances.circumstances import _canon_lock, canon_year, get_canon_Espenak
+from circumstances.utils import greatest_eclipse_tt, pickle_dump_atomic
+
+INDEX_VERSION = 1
+CANON_PICKLE = 'caches/espenak_solar_eclipse_canon.pickle'
+CELL = 10  # degrees, cells of the index of greatest eclipse positions
+# rough boxes, latitude from and to, longitude from and to (from east of to crosses the antimeridian)
+REGIONS = {'north_america': (7, 84, -170, -50), 'south_america': (-56, 13, -82, -34),
+           'europe': (35, 72, -25, 45), 'africa': (-35, 38, -18, 52), 'asia': (0, 78, 45, 180),
+           'oceania': (-48, 0, 110, -175), 'antarctica': (-90, -60, -180, 180), 'arctic': (66, 90, -180, 180)}
+
+
+class canon_index(object):
+    '''
+    indexes of the canon, keys in chronological order within each
+    '''
+
+    def __init__(self, results):
+        '''
+        :param results: canon from get_canon_Espenak
+        '''
+        self.version = INDEX_VERSION
+        self.size = len(results)
+        tt = {key: greatest_eclipse_tt(canondata) for key, canondata in results.items()}
+        self.order = sorted(results, key=tt.get)
+        self.rank = {key: n for n, key in enumerate(self.order)}
+        self.years = [canon_year(key) for key in self.order]  # ascending, parallel to order
+        self.by_saros = {}
+        self.by_luna = {}
+        self.by_type = {}  # full type, ex. Tm, and base type, ex. T
+        self.by_cell = {}  # (lat cell, lon cell): keys with greatest eclipse in it
+        self.positions = {}  # key: (lat, lon) of greatest eclipse
+        gammas = []
+        for key in self.order:
+            canondata = results[key]
+            if canondata.get('saros_no') is not None:
+                self.by_saros.setdefault(canondata['saros_no'], []).append(key)
+            if canondata.get('luna_no') is not None:
+                self.by_luna.setdefault(canondata['luna_no'], []).append(key)
+            eclipse_type = canondata.get('eclipse_type') or ''
+            for kind in {eclipse_type, eclipse_type[:1]}:
+                if kind:
+                    self.by_type.setdefault(kind, []).append(key)
+            if canondata.get('gamma') is not None:
+                gammas.append((canondata['gamma'], self.rank[key]))
+            lat, lon = degrees(canondata.get('ge_lat')), degrees(canondata.get('ge_lon'))
+            if lat is not None and lon is not None:
+                self.positions[key] = (lat, lon)
+                self.by_cell.setdefault(_cell(lat, lon), []).append(key)
+        gammas.sort()
+        self.gamma_values = [g for g, n in gammas]
+        self.gamma_keys = [self.order[n] for g, n in gammas]
+
+    def query(self, saros=None, eclipse_type=None, years=None, gamma=None, region=None, luna=None):
+        '''
+        keys of the eclipses that meet every criterion given, in chronological order
+        :param saros: saros series number
+        :param eclipse_type: base type (T, A, H or P) or full type, ex. Tm
+        :param years: (first, last), inclusive
+        :param gamma: (low, high), inclusive, use (-0.5, 0.5) for eclipses near the axis of the shadow
+        :param region: name in REGIONS or a box (lat from, lat to, lon from, lon to), for greatest eclipse
+        :param luna: lunation number
+        '''
+        candidates = []
+        if saros is not None:
+            candidates.append(self.by_saros.get(saros, []))
+        if luna is not None:
+            candidates.append(self.by_luna.get(luna, []))
+        if eclipse_type is not None:
+            candidates.append(self.by_type.get(eclipse_type, []))
+        if years is not None:
+            candidates.append(self.order[bisect.bisect_left(self.years, years[0]):
+                                         bisect.bisect_right(self.years, years[1])])
+        if gamma is not None:
+            candidates.append(self.gamma_keys[bisect.bisect_left(self.gamma_values, gamma[0]):
+                                              bisect.bisect_right(self.gamma_values, gamma[1])])
+        if region is not None:
+            candidates.append(self.region(region))
+        if len(candidates) == 0:
+            return list(self.order)
+        candidates.sort(key=len)
+        keys = set(candidates[0])
+        for other in candidates[1:]:
+            if len(keys) == 0:
+                break
+            keys.intersection_update(other)
+        return sorted(keys, key=self.rank.get)
+
+    def region(self, region):
+        '''
+        keys of the eclipses with greatest eclipse in a region, from the cells that overlap it
+        :param region: name in REGIONS or a box (lat from, lat to, lon from, lon to)
+        '''
+        lat0, lat1, lon0, lon1 = REGIONS[region] if isinstance(region, str) else region
+        spans = [(lon0, lon1)] if lon0 <= lon1 else [(lon0, 180), (-180, lon1)]
+        keys = []
+        for i in range(_cell(lat0, 0)[0], _cell(lat1, 0)[0] + 1):
+            for first, last in spans:
+                for j in range(_cell(0, first)[1], _cell(0, last)[1] + 1):
+                    for key in self.by_cell.get((i, j), []):
+                        lat, lon = self.positions[key]
+                        if lat0 <= lat <= lat1 and any(a <= lon <= b for a, b in spans):
+                            keys.append(key)
+        return sorted(set(keys), key=self.rank.get)
+
+    def saros_series(self, saros, start=None, reverse=False):
+        '''
+        walks a saros series in order
+        :param start: canon key to start from, inclusive (default, the first, or the last when reverse)
+        :param reverse: walk back in time
+        '''
+        series = self.by_saros.get(saros, [])
+        if start is None:
+            n = len(series) - 1 if reverse else 0
+        else:
+            ranks = [self.rank[key] for key in series]
+            if reverse:
+                n = bisect.bisect_right(ranks, self.rank[start]) - 1
+            else:
+                n = bisect.bisect_left(ranks, self.rank[start])
+        step = -1 if reverse else 1
+        while 0 <= n < len(series):
+            yield series[n]
+            n += step
+
+    def chronological(self, start=None, reverse=False):
+        '''
+        walks the canon in order from a key, inclusive
+        '''
+        n = self.rank[start] if start is not None else (len(self.order) - 1 if reverse else 0)
+        step = -1 if reverse else 1
+        while 0 <= n < len(self.order):
+            yield self.order[n]
+            n += step
+
+
+def degrees(value):
+    '''
+    signed degrees of a canon latitude or longitude, ex. 25N or 104W, None when there isn't one
+    '''
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    value = value.strip()
+    if len(value) == 0:
+        return None
+    try:
+        number = float(value[:-1])
+    except ValueError:
+        return None
+    if value[-1] in 'SW':
+        return -number
+    if value[-1] in 'NE':
+        return number
+    return None
+
+
+def _cell(lat, lon):
+    return math.floor(lat / CELL), math.floor(min(lon, 179.999) / CELL)
+
+
+def get_canon_index(filename_pickle=CANON_PICKLE):
+    '''
+    the index of the canon, built and added to the canon pickle when it isn't there or is out of date
+    '''
+    results, otherdates = get_canon_Espenak()
+    with _canon_lock:  # a refresh of the canon rewrites the pickle without the index
+        fp = open(filename_pickle, 'rb')
+        obj = pickle.load(fp)
+        fp.close()
+        index = obj.get('index')
+        if index is not None and index.version == INDEX_VERSION and index.size == len(obj['results']):
+            return index
+        index = canon_index(obj['results'])
+        obj['index'] = index
+        pickle_dump_atomic(obj, filename_pickle)
+    return index
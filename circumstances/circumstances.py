@@ -1,13 +1,19 @@
+import copy
 import datetime
+import hashlib
+import html
 import logging
 import pickle
+import re
+import threading
+import weakref
 from logging import Formatter
 from logging.handlers import RotatingFileHandler
 from zoneinfo import ZoneInfo
 
 import dateutil.parser
+import numpy as np
 import pandas as pd
-import requests_cache
 from bs4 import BeautifulSoup
 from geographiclib.geodesic import Geodesic
 from selenium.webdriver.common.by import By
@@ -16,10 +22,16 @@ from selenium.webdriver.support.ui import Select, WebDriverWait
 from skyfield.api import load
 from timezonefinder import TimezoneFinder
 # from utils import directional_DMS_coordinates, get_driver, months
-from circumstances.utils import directional_DMS_coordinates, get_driver, months
+from circumstances import metrics
+from circumstances.utils import cached_session, directional_DMS_coordinates, file_lock, get_driver, months, \
+    offline_error, pickle_dump_atomic, require_online, signed_iso, utc_iso_to_tt
 
 ts = load.timescale()
-tf = TimezoneFinder()  # reuse
+tf = TimezoneFinder()  # reuse, through timezone_at from threads
+_tf_lock = threading.Lock()  # TimezoneFinder reads its polygons from files as it goes
+_canon_lock = threading.Lock()
+_driver_locks = weakref.WeakKeyDictionary()  # driver: lock, see driver_lock, dropped with the driver
+_driver_locks_lock = threading.Lock()
 
 # https://github.com/skyfielders/python-skyfield/issues/445
 pd.set_option('display.max_columns', None)
@@ -39,33 +51,51 @@ pd.set_option('display.width', 1000)
 class solar_eclipse_local(object):
 
     def __init__(self, name, lat, lon, ele=None, timezone=None, places=2, driver=None,
-                 logginglevel=logging.INFO):
+                 logginglevel=logging.INFO, ele_tolerance=50):
+        '''
+        :param ele: elevation in meters (default, looked up from opentopodata)
+        :param ele_tolerance: meters, cached circumstances for the same site at an elevation this close are
+                              reused, corrected by the rate each contact time changes with elevation, instead of
+                              being fetched again
+        '''
         self.name = name
         self.lat = round(lat, places)
         self.lon = round(lon, places)
         self.ele = ele
+        self.ele_tolerance = ele_tolerance
         self.timezone = timezone
         self.key = None
         self.cachedir = './caches'
-        self.session = requests_cache.CachedSession(f"{self.cachedir}/http.sqllite")
+        self.cache_filename = f'caches/gsfc_local/{self.lat},{self.lon}.pickle'
         # self.logger = self._setup_logging('local', level=logginglevel)
         self.driver = driver
+        self._lock = threading.RLock()  # the driver and the cache file, when the instance is shared by threads
 
         if self.ele is None:
             self.ele = self._get_elevation(self.lat, self.lon)
 
         if self.timezone is None:
-            self.timezone = tf.timezone_at(lng=lon, lat=lat)
+            self.timezone = timezone_at(lat, lon)
             # self.logger.debug(f"found {self.name} in the {self.timezone} timezone")
 
-        self.key = f"{lat},{lon},{ele}"
+        self.key = f"{self.lat},{self.lon},{self.ele}"
+        self.legacy_key = f"{lat},{lon},{ele}"  # key of caches written before elevation was part of it
         # self.logger.info(f"instantiated {self.name} ({self.lat},{self.lon}), ele {self.ele}m in {self.timezone}")
 
+    @property
+    def session(self):
+        '''the calling thread's session for the HTTP cache'''
+        return cached_session(f"{self.cachedir}/http.sqllite")
+
     def _get_elevation(self, lat, lon):
         url = f'https://api.opentopodata.org/v1/test-dataset?locations={lat},{lon}'
         try:
-            r = self.session.get(url)
+            with metrics.stage('http', source='opentopodata'):
+                r = self.session.get(url)
+            metrics.http_response('opentopodata', r)
             # self.logger.debug(f"{lat},{lon},{r.from_cache},{r.status_code}")
+        except offline_error:
+            raise
         except Exception as e:
             print(f"error getting elevation for {lat},{lon},{e}")
         try:
@@ -92,17 +122,21 @@ class solar_eclipse_local(object):
         return logger
 
     def _get_cache_local(self, years=None):
-        filename_pickle = f'caches/gsfc_local/{self.lat},{self.lon}.pickle'
+        filename_pickle = self.cache_filename
         years_in_cache = []
         years_not_in_cache = []
 
         try:
-            fp = open(filename_pickle, 'rb')
-            data = pickle.load(fp)
-            fp.close()
+            with metrics.stage('pickle_read', source='gsfc_local'):
+                fp = open(filename_pickle, 'rb')
+                data = pickle.load(fp)
+                fp.close()
         except Exception as e:
             data = {}
             # self.logger.warning(f"{e}")
+        if self.key not in data and self.legacy_key in data and data[self.legacy_key]['ele'] == self.ele:
+            data[self.key] = data.pop(self.legacy_key)
+        metrics.counter('pickle_cache', source='gsfc_local', cache='hit' if self.key in data else 'miss')
         if self.key not in data:
             years_not_in_cache = years.copy()
         else:
@@ -124,37 +158,83 @@ class solar_eclipse_local(object):
         '''
         if years is None:
             years = list(range(-1401, 3000, 100))
+        with self._lock, file_lock(self.cache_filename):
+            return self._get_year(years)
+
+    def _get_year(self, years):
         data, years_in_cache, years_not_in_cache, filename_pickle = self._get_cache_local(years=years)
         # self.logger.debug(f"{years_in_cache} in cache for {self.name}")
         # self.logger.debug(f"{years_not_in_cache} not in cache for {self.name}")
+        if len(years_not_in_cache) > 0:
+            nearby = self._nearby_elevation(data, years_not_in_cache)
+            if nearby is not None:
+                metrics.counter('pickle_cache', source='gsfc_local', cache='nearby_elevation')
+                added = elevation_sensitivity(data[nearby], self.lat, self.lon)
+                adjusted = elevation_adjusted(data[nearby], self.ele)
+                own = data.get(self.key)
+                if own is not None and 'ele_source' not in own:
+                    # the site's own circumstances stand for the centuries they cover, and stay as they are
+                    adjusted = exact_preferred(own, adjusted)
+                else:
+                    data[self.key] = adjusted  # found under this site's key from now on, without the scan
+                if added or data[self.key] is adjusted:
+                    with metrics.stage('pickle_write', source='gsfc_local'):
+                        pickle_dump_atomic(data, filename_pickle)
+                return adjusted
 
         if len(years_not_in_cache) > 0:
             # self.logger.info(f"fetching {years_not_in_cache} for {self.name}")
             EW, NS, latd, latm, lats, lond, lonm, lons = directional_DMS_coordinates(self.lat, self.lon)
             url = 'https://eclipse.gsfc.nasa.gov/JSEX/JSEX-USA.html'
+            require_online(f"GSFC local circumstances of {self.name} ({self.key}) for {years_not_in_cache}")
             if self.driver is None:
                 self.driver = get_driver()
-            if self.key not in data.keys():
+            if self.key not in data.keys() or 'ele_source' in data[self.key]:
+                # an entry adjusted from another elevation is replaced rather than mixed with the rows fetched
+                # for this one, every year asked for is fetched
                 data[self.key] = {'city': self.name, 'lat': self.lat, 'lon': self.lon, 'ele': self.ele, 'eclipses': {},
                                   'by_year': {}, 'centuries_checked': []}
-
-            enter_coordinates(self.driver, self.name, latd, latm, lats, NS, lond, lonm, lons, EW)
-            for year in years_not_in_cache:
-                button_no = int((year / 100) + 15)
-                row = int(button_no / 5) + 2
-                col = (button_no % 5) + 1
-                # self.logger.debug(f"fetching {year}, button ({row},{col}) for {self.name}")
-                eclipses, by_year = click_century_buttons(self.driver, self.ele, row=row, column=col)
-                data[self.key]['eclipses'].update(eclipses)
-                data[self.key]['by_year'].update(by_year)
-                data[self.key]['centuries_checked'].append(int(year / 100))
-
-            fp = open(filename_pickle, 'wb')
-            pickle.dump(data, fp)
-            fp.close()
+                years_not_in_cache = years
+
+            with driver_lock(self.driver):  # the driver may be shared with other instances
+                with metrics.stage('selenium_input', step='coordinates'):
+                    enter_coordinates(self.driver, self.name, latd, latm, lats, NS, lond, lonm, lons, EW)
+                for year in years_not_in_cache:
+                    button_no = int((year / 100) + 15)
+                    row = int(button_no / 5) + 2
+                    col = (button_no % 5) + 1
+                    # self.logger.debug(f"fetching {year}, button ({row},{col}) for {self.name}")
+                    eclipses, by_year = click_century_buttons(self.driver, self.ele, row=row, column=col)
+                    data[self.key]['eclipses'].update(eclipses)
+                    data[self.key]['by_year'].update(by_year)
+                    data[self.key]['centuries_checked'].append(int(year / 100))
+
+            with metrics.stage('pickle_write', source='gsfc_local'):
+                pickle_dump_atomic(data, filename_pickle)
 
         return data[self.key]
 
+    def _nearby_elevation(self, data, years):
+        '''
+        key of the cached entry for this site at the closest elevation within ele_tolerance that covers the
+        centuries of all the years, None if there isn't one. Entries adjusted from another elevation are passed
+        over so adjustments don't compound
+        '''
+        centuries = {int(year / 100) for year in years}
+        best = None
+        for key, entry in data.items():
+            if entry.get('ele') is None or abs(entry['ele'] - self.ele) > self.ele_tolerance:
+                continue
+            if 'ele_source' in entry:
+                continue
+            if (entry['lat'], entry['lon']) != (self.lat, self.lon):
+                continue
+            if not centuries.issubset(entry['centuries_checked']):
+                continue
+            if best is None or abs(entry['ele'] - self.ele) < abs(data[best]['ele'] - self.ele):
+                best = key
+        return best
+
     def localize(self, years=[2023, 2024]):
         # name, lat, lon, tz, ele=0, driver=None, usecache=True, row=None, column=None):
         targetdates = {'A': '+2023-10-14', 'T': '+2024-04-08', 'H': '+2023-10-01', 'P': '+2023-10-01'}
@@ -238,6 +318,22 @@ class solar_eclipse_local(object):
         return s
 
 
+def timezone_at(lat, lon):
+    '''
+    timezone name at a location from the shared TimezoneFinder, safe to call from threads
+    '''
+    with _tf_lock:
+        return tf.timezone_at(lng=lon, lat=lat)
+
+
+def driver_lock(driver):
+    '''
+    lock for a selenium driver, which can only do one thing at a time
+    '''
+    with _driver_locks_lock:
+        return _driver_locks.setdefault(driver, threading.RLock())
+
+
 class solar_eclipse_canon(object):
     def __init__(self):
         pass
@@ -259,12 +355,13 @@ def click_century_buttons(driver, ele, row=None, column=None):
     by_year = {}
     for row in range(row_first, row_last + 1):
         for column in range(column_first, column_last + 1):
-            enter_elevation(column, driver, ele, row)  # this also clears the previous table
+            with metrics.stage('selenium_input', step='elevation'):
+                enter_elevation(column, driver, ele, row)  # this also clears the previous table
 
             # wait for table to appear
-            table = WebDriverWait(driver, 20).until(EC.presence_of_element_located((By.ID, 'el_resultstable')))
-
-            s = table.get_attribute('innerHTML')
+            with metrics.stage('selenium_wait', step='results_table'):
+                table = WebDriverWait(driver, 20).until(EC.presence_of_element_located((By.ID, 'el_resultstable')))
+                s = table.get_attribute('innerHTML')
             eclipse_data, year_data = process_gsfc_history_table(s)
             results.update(eclipse_data)
             by_year.update(year_data)
@@ -308,61 +405,145 @@ def enter_elevation(column, driver, ele, row):
 
 
 def get_canon_Espenak(year_start=-1499, year_end=3000, force=False):
+    '''
+    the Espenak canon from eclipsewise.com, one page per century, kept in caches/espenak_solar_eclipse_canon.pickle
+    :param force: refresh from eclipsewise, with conditional requests, only the centuries that changed are parsed
+                  again and merged into the canon (see refresh_canon_pages)
+    :return: canon keyed by date (UT1) and a dictionary of alternate dates to canon dates
+    '''
+    with _canon_lock:  # one thread fetches the canon while the others wait for the cache
+        return _get_canon_Espenak(year_start, year_end, force)
+
+
+def _get_canon_Espenak(year_start, year_end, force):
     filename_pickle = 'caches/espenak_solar_eclipse_canon.pickle'
     try:
-        fp = open(filename_pickle, 'rb')
-        obj = pickle.load(fp)
-        results = obj['results']
-        otherdates = obj['otherdates']
-        fp.close()
+        with metrics.stage('pickle_read', source='canon'):
+            fp = open(filename_pickle, 'rb')
+            obj = pickle.load(fp)
+            results = obj['results']
+            otherdates = obj['otherdates']
+            pages = obj.get('pages', {})
+            fp.close()
     except Exception as e:
         print(f'gsfc_eclipse_history cache read error | {e}')
         results = {}
         otherdates = {}
+        pages = {}
+    metrics.counter('pickle_cache', source='canon', cache='hit' if len(results) > 0 else 'miss')
     if len(results) > 0 and not force:
         return results, otherdates
 
-    s = requests_cache.CachedSession('caches/espenak_eclipse_cache.sqlite')
-    for year0 in range(year_start, year_end, 100):
-        r, url = get_canon_page(s, year0)
-        soup = BeautifulSoup(r.text, 'html.parser')
-        tables = soup.find_all('tbody')
-
-        for table in tables:
-            rows = table.find_all('tr')
-            for row in rows:
-                cells = row.find_all('td')
-                if len(cells) < 15:
-                    continue
-                thisdict = parse_espenak_row(cells)
-                atoms = thisdict['date_ut1'].split('-')
-                year_utc = int(atoms[-3])
-                month = months.index(atoms[-2])
-                day = int(atoms[-1])
-                if len(atoms) == 4:
-                    year_utc *= -1
-                    sign = '-'
-                else:
-                    sign = '+'
-
-                thisdict['id'] = f"{sign}{abs(year_utc):04}{month:02}{day:02}"
-                H, M, S = thisdict['ge_time_td'].split(':')
-                td = ts.utc(year_utc, month, day, int(H), int(M), int(S))
-                jpl = td.utc_jpl()
-                tdp1 = formatdate(td + 1)
-                tdm1 = formatdate(td - 1)
-                otherdates[formatdate(td)] = thisdict['date_ut1']  # account for Delta T and GE that occurs across
-                otherdates[tdm1] = thisdict['date_ut1']  # account for Delta T and GE that occurs across
-                otherdates[tdp1] = thisdict['date_ut1']  # the international dateline
-                thisdict['utc'] = td
-                results[thisdict['date_ut1']] = thisdict
-    s.close()
-    fp = open(filename_pickle, 'wb')
-    pickle.dump({'results': results, 'otherdates': otherdates}, fp)
-    fp.close()
+    s = cached_session('caches/espenak_eclipse_cache.sqlite')
+    urls = {year0: canon_page_url(year0) for year0 in range(year_start, year_end, 100)}
+    changed = refresh_canon_pages(s, urls, pages, 'eclipsewise', refresh=len(results) > 0)
+    for year0, text in changed.items():
+        # drop the century's eclipses and their alternate dates, then parse it again
+        dropped = {key for key in results if year0 <= canon_year(key) <= year0 + 99}
+        for key in dropped:
+            del results[key]
+        for date in [date for date, key in otherdates.items() if key in dropped]:
+            del otherdates[date]
+        parse_canon_page(text, results, otherdates)
+    with metrics.stage('pickle_write', source='canon'):
+        pickle_dump_atomic({'results': results, 'otherdates': otherdates, 'pages': pages}, filename_pickle)
     return results, otherdates
 
 
+def refresh_canon_pages(s, urls, pages, source, refresh=True):
+    '''
+    fetches the century pages of a catalog, with a conditional request (If-None-Match/If-Modified-Since) for the
+    pages already seen, and keeps their ETag, Last-Modified and content hash in pages
+    :param s: requests_cache session
+    :param urls: dictionary of first year of the century to url of its page
+    :param pages: metadata of the pages from a previous call, keyed the same as urls, updated in place
+    :param source: for metrics, ex. 'eclipsewise'
+    :param refresh: revalidate with the server, otherwise a cached response is used as is
+    :return: dictionary of first year of the century to html of the pages that are new or changed
+    '''
+    if refresh:
+        require_online(f"a refresh of the {source} canon")
+    changed = {}
+    for year0, url in urls.items():
+        page = pages.get(year0)
+        headers = {}
+        if refresh and page is not None:
+            if page.get('etag'):
+                headers['If-None-Match'] = page['etag']
+            if page.get('last_modified'):
+                headers['If-Modified-Since'] = page['last_modified']
+        with metrics.stage('http', source=source):
+            r = s.get(url, headers=headers, refresh=refresh)
+        metrics.http_response(source, r)
+        if r.status_code == 304:
+            status = 'unchanged'
+        elif r.status_code != 200:
+            print(f"error fetching {url}, {r.status_code} {r.reason}")
+            metrics.counter('canon_pages', source=source, page='error')
+            continue
+        else:
+            sha256 = hashlib.sha256(r.content).hexdigest()
+            if page is not None and page.get('sha256') == sha256:
+                status = 'unchanged'
+            else:
+                status = 'new' if page is None else 'changed'
+                changed[year0] = r.text
+                page = {'sha256': sha256}
+            page.update(etag=r.headers.get('ETag', page.get('etag')),
+                        last_modified=r.headers.get('Last-Modified', page.get('last_modified')))
+        page.update(url=url, checked=datetime.datetime.now(datetime.timezone.utc).isoformat())
+        pages[year0] = page
+        metrics.counter('canon_pages', source=source, page=status)
+    return changed
+
+
+def canon_year(date):
+    '''year of a canon date, ex. -0500-Jan-01 or 2024-Apr-08'''
+    atoms = date.split('-')
+    return -int(atoms[-3]) if len(atoms) == 4 else int(atoms[-3])
+
+
+@metrics.timed('parse', source='canon')
+def parse_canon_page(text, results, otherdates):
+    '''
+    adds the eclipses in one century page of the eclipsewise catalog to the canon
+    :param text: html of the page
+    :param results: canon dictionary keyed by date (UT1), updated in place
+    :param otherdates: dictionary of alternate dates to canon dates, updated in place
+    '''
+    soup = BeautifulSoup(text, 'html.parser')
+    tables = soup.find_all('tbody')
+
+    for table in tables:
+        rows = table.find_all('tr')
+        for row in rows:
+            cells = row.find_all('td')
+            if len(cells) < 15:
+                continue
+            thisdict = parse_espenak_row(cells)
+            atoms = thisdict['date_ut1'].split('-')
+            year_utc = int(atoms[-3])
+            month = months.index(atoms[-2])
+            day = int(atoms[-1])
+            if len(atoms) == 4:
+                year_utc *= -1
+                sign = '-'
+            else:
+                sign = '+'
+
+            thisdict['id'] = f"{sign}{abs(year_utc):04}{month:02}{day:02}"
+            H, M, S = thisdict['ge_time_td'].split(':')
+            td = ts.utc(year_utc, month, day, int(H), int(M), int(S))
+            jpl = td.utc_jpl()
+            tdp1 = formatdate(td + 1)
+            tdm1 = formatdate(td - 1)
+            otherdates[formatdate(td)] = thisdict['date_ut1']  # account for Delta T and GE that occurs across
+            otherdates[tdm1] = thisdict['date_ut1']  # account for Delta T and GE that occurs across
+            otherdates[tdp1] = thisdict['date_ut1']  # the international dateline
+            thisdict['utc'] = td
+            results[thisdict['date_ut1']] = thisdict
+
+
 def formatdate(newtd):
     try:
         yesterday_year = int(newtd.utc_strftime('%Y'))
@@ -377,14 +558,20 @@ def formatdate(newtd):
 
 
 def get_canon_page(s, year0):
+    url = canon_page_url(year0)
+    with metrics.stage('http', source='eclipsewise'):
+        r = s.get(url)
+    metrics.http_response('eclipsewise', r)
+    return r, url
+
+
+def canon_page_url(year0):
     neg_from = neg_to = ''
     if year0 < 0:
         neg_from = '-'
     if year0 + 99 < 0:
         neg_to = '-'
-    url = f'https://eclipsewise.com/solar/SEcatalog/SE{neg_from}{abs(year0):04}-{neg_to}{abs(year0 + 99):04}.html'
-    r = s.get(url)
-    return r, url
+    return f'https://eclipsewise.com/solar/SEcatalog/SE{neg_from}{abs(year0):04}-{neg_to}{abs(year0 + 99):04}.html'
 
 
 def dms2dd(s):
@@ -424,137 +611,187 @@ def parse_espenak_row(cells):
     return thisdict
 
 
-def get_canon_GSFC(year_start=-1499, year_end=3000):
+def get_canon_GSFC(year_start=-1499, year_end=3000, force=False):
+    '''
+    the GSFC five millennium catalog, kept in caches/gsfc_eclipse_canon.pickle
+    :param force: refresh from GSFC, only the centuries that changed are parsed again (see refresh_canon_pages)
+    :return: dictionary keyed by date, ex. +2024-Apr-08
+    '''
     # https://eclipse.gsfc.nasa.gov/SEcat5/SEcatalog.html
     # https://eclipse.gsfc.nasa.gov/JSEX/JSEX-USA.html
     filename_pickle = 'caches/gsfc_eclipse_canon.pickle'
     try:
         fp = open(filename_pickle, 'rb')
-        data = pickle.load(fp)
+        obj = pickle.load(fp)
         fp.close()
     except Exception as e:
-        s = requests_cache.CachedSession('caches/nasa_gsfc_eclipse_cache.sqlite')
-        data = {}
-        for year in range(year_start, year_end, 100):
-            if year == -99:
-                url = f'https://eclipse.gsfc.nasa.gov/SEcat5/SE{year:05}-{year + 99:04}.html'
-            elif year < 0:
-                url = f'https://eclipse.gsfc.nasa.gov/SEcat5/SE{year:05}-{year + 99:05}.html'
-            else:
-                url = f'https://eclipse.gsfc.nasa.gov/SEcat5/SE{year:04}-{year + 99:04}.html'
-            r = s.get(url)
-            soup = BeautifulSoup(r.text, 'html.parser')
-            pres = soup.find_all('pre')
-            for n in range(4, len(pres)):
-                #                       TD of
-                # Catalog  Calendar   Greatest          Luna Saros Ecl.               Ecl.            Sun Path  Central
-                # Number     Date      Eclipse    ΔT     Num  Num  Type QLE  Gamma    Mag.   Lat Long Alt Width   Dur.
-                #                                  s                                          °    °    °   km
-                #           1          2          3          4          5          6          7          8          9
-                # 0123456789*0123456789*0123456789*0123456789*0123456789*0123456789*0123456789*0123456789*0123456789*0
-                # 00001 -1999 Jun 12  03:14:51  46438 -49456    5   T   -n  -0.2701  1.0733   6N  33W  74  247  06m37s
-                lines = pres[n].text.split("\n")
-                for line in lines[7:]:
-                    if len(line) > 0:
-                        catno = line[:5].strip()
-                        year = line[5:11].strip()
-                        monthstr = line[11:15].strip()
-                        month = int(months.index(monthstr))
-                        day = line[15:18].strip()
-                        name = f"{int(year)}-{monthstr}-{day}"
-                        if int(year) >= 0:
-                            name = f"+{name}"
-                        eclipse_type = line[50:53].strip()
-                        lat = line[75:79].strip()
-                        if 'N' in lat:
-                            lat = int(lat[:-1])
-                        elif 'S' in lat:
-                            lat = int(lat[:-1]) * -1
-                        else:
-                            raise ValueError(f" latitude error with {lat}")
-                        lon = line[80:85].strip()
-                        if 'E' in lon:
-                            lon = int(lon[:-1])
-                        elif 'W' in lon:
-                            lon = int(lon[:-1]) * -1
-                        else:
-                            raise ValueError(f" longitude error with {lon}")
-
-                        data[name] = {'catno': catno, 'year': year, 'month': month, 'day': day,
-                                      'eclipse_type': eclipse_type,
-                                      'ge_lat': lat, 'ge_lon': lon}
-            fp = open(filename_pickle, 'wb')
-            pickle.dump(data, fp)
-            fp.close()
-        s.close()
-    fp = open(filename_pickle, 'wb')
-    pickle.dump(data, fp)
-    fp.close()
+        obj = {}
+    if 'pages' in obj:
+        data, pages = obj['results'], obj['pages']
+    else:  # written before the pages were kept, the catalog itself
+        data, pages = obj, {}
+    if len(data) > 0 and not force:
+        return data
+
+    s = cached_session('caches/nasa_gsfc_eclipse_cache.sqlite')
+    urls = {year0: gsfc_canon_url(year0) for year0 in range(year_start, year_end, 100)}
+    changed = refresh_canon_pages(s, urls, pages, 'gsfc', refresh=len(data) > 0)
+    for year0, text in changed.items():
+        for name in [name for name in data if year0 <= int(data[name]['year']) <= year0 + 99]:
+            del data[name]
+        parse_gsfc_canon_page(text, data)
+    pickle_dump_atomic({'results': data, 'pages': pages}, filename_pickle)
     return data
 
 
-def process_gsfc_history_table(s):
-    soup = BeautifulSoup(s, 'html.parser')
+def gsfc_canon_url(year):
+    if year == -99:
+        return f'https://eclipse.gsfc.nasa.gov/SEcat5/SE{year:05}-{year + 99:04}.html'
+    elif year < 0:
+        return f'https://eclipse.gsfc.nasa.gov/SEcat5/SE{year:05}-{year + 99:05}.html'
+    return f'https://eclipse.gsfc.nasa.gov/SEcat5/SE{year:04}-{year + 99:04}.html'
 
-    tables = soup.find_all('tr')
-    result = {}
-    by_year = {}
+
+@metrics.timed('parse', source='gsfc_canon')
+def parse_gsfc_canon_page(text, data):
+    '''
+    adds the eclipses in one century page of the GSFC catalog to data, updated in place
+    '''
+    soup = BeautifulSoup(text, 'html.parser')
+    pres = soup.find_all('pre')
+    for n in range(4, len(pres)):
+        #                       TD of
+        # Catalog  Calendar   Greatest          Luna Saros Ecl.               Ecl.            Sun Path  Central
+        # Number     Date      Eclipse    ΔT     Num  Num  Type QLE  Gamma    Mag.   Lat Long Alt Width   Dur.
+        #                                  s                                          °    °    °   km
+        #           1          2          3          4          5          6          7          8          9
+        # 0123456789*0123456789*0123456789*0123456789*0123456789*0123456789*0123456789*0123456789*0123456789*0
+        # 00001 -1999 Jun 12  03:14:51  46438 -49456    5   T   -n  -0.2701  1.0733   6N  33W  74  247  06m37s
+        lines = pres[n].text.split("\n")
+        for line in lines[7:]:
+            if len(line) > 0:
+                catno = line[:5].strip()
+                year = line[5:11].strip()
+                monthstr = line[11:15].strip()
+                month = int(months.index(monthstr))
+                day = line[15:18].strip()
+                name = f"{int(year)}-{monthstr}-{day}"
+                if int(year) >= 0:
+                    name = f"+{name}"
+                eclipse_type = line[50:53].strip()
+                lat = line[75:79].strip()
+                if 'N' in lat:
+                    lat = int(lat[:-1])
+                elif 'S' in lat:
+                    lat = int(lat[:-1]) * -1
+                else:
+                    raise ValueError(f" latitude error with {lat}")
+                lon = line[80:85].strip()
+                if 'E' in lon:
+                    lon = int(lon[:-1])
+                elif 'W' in lon:
+                    lon = int(lon[:-1]) * -1
+                else:
+                    raise ValueError(f" longitude error with {lon}")
+
+                data[name] = {'catno': catno, 'year': year, 'month': month, 'day': day,
+                              'eclipse_type': eclipse_type,
+                              'ge_lat': lat, 'ge_lon': lon}
+
+
+gsfc_row_re = re.compile(r'<tr[^>]*>(.*?)</tr>', re.S | re.I)
+gsfc_cell_re = re.compile(r'<td[^>]*>(.*?)</td>', re.S | re.I)
+gsfc_tag_re = re.compile(r'<[^>]+>')
+
+
+@metrics.timed('parse', source='gsfc')
+def process_gsfc_history_table(s):
+    '''
+    parses the innerHTML of the JSEX results table (el_resultstable), the page is serialized by the browser so
+    rows and cells are always closed and a couple of regular expressions are enough to pull the cell text.
+    all contact times in the table are built with a single call to ts.utc and formatted in bulk
+    :param s: innerHTML of the results table
+    :return: dictionary of eclipses keyed by date, dictionary of the same keyed by year then date
+    '''
     headers = ['date', 'eclipse type', 'c1_time', 'c1_sun_alt', 'c2_time', 'mid_time', 'mid_sun_alt', 'mid_sun_azi',
                'c3_time', 'c4_time', 'c4_sun_alt', 'mag', 'obs', 'duration']
-    for row in soup.find_all('tr'):
-        cells_data = row.find_all('td')
-        result_row = {}
-        if len(cells_data) > 0:
-            result_row, year, month, day = gsfc_local_history_row(cells_data, headers, result_row)
-
-            eclipse_at_sunriseset(result_row)
+    rows = []
+    contacts = []  # (row number, attr) for each contact time found in the table
+    hms = []  # year, month, day, hour, minute, second of each of those contacts
+    for rowhtml in gsfc_row_re.findall(s):
+        cells_data = [html.unescape(gsfc_tag_re.sub('', cell)) for cell in gsfc_cell_re.findall(rowhtml)]
+        if len(cells_data) == 0:
+            continue  # header row
+        result_row, year, month, day = gsfc_local_history_row(cells_data, headers, {})
+        eclipse_at_sunriseset(result_row)
+        for attr in ['c1', 'c2', 'mid', 'c3', 'c4']:
+            contact_time = gsfc_contact_time(attr, result_row)
+            if contact_time is None:
+                result_row[attr] = None
+            else:
+                contacts.append((len(rows), attr))
+                hms.append((year, month, day) + contact_time)
+        rows.append((result_row, year))
+
+    if len(hms) > 0:
+        year, month, day, H, M, S = zip(*hms)
+        tt = ts.utc(list(year), list(month), list(day), list(H), list(M), list(S))
+        utcisos = tt.utc_iso()
+        for n, (rowno, attr) in enumerate(contacts):
+            result_row, _ = rows[rowno]
+            gsfc_set_local_circ_fields(attr, result_row, tt[n], utcisos[n])
 
-            for attr in ['c1', 'c2', 'mid', 'c3', 'c4']:
-                gsfc_process_local_circ_fields(attr, day, month, result_row, year)
-            result[result_row['date']] = result_row
-            if year not in by_year:
-                by_year[year] = {}
-            by_year[year][result_row['date']] = result_row
+    result = {}
+    by_year = {}
+    for result_row, year in rows:
+        result[result_row['date']] = result_row
+        if year not in by_year:
+            by_year[year] = {}
+        by_year[year][result_row['date']] = result_row
 
     return result, by_year
 
 
-def gsfc_process_local_circ_fields(attr, day, month, result_row, year):
+def gsfc_contact_time(attr, result_row):
+    '''
+    hour, minute and second of a contact from a row of the JSEX table, or None when the contact does not occur
+    '''
     timeattr = f"{attr}_time"
     if result_row[timeattr] is None:
-        result_row[attr] = None
+        return None
+    if 'NaN:NaN' in result_row[timeattr]:
+        # compensate for error present on both Fred's and GSFC site.
+        result_row[timeattr] = result_row["mid_time"]
+    if '(' in result_row[timeattr]:
+        HMstr, _ = result_row[timeattr].split('(')
+        H, M = HMstr.split(':')
+        S = 0
     else:
-        if 'NaN:NaN' in result_row[f"{attr}_time"]:
-            # compensate for error present on both Fred's and GSFC site.
-            result_row[f"{attr}_time"] = result_row[f"mid_time"]
-        if '(' in result_row[f"{attr}_time"]:
-            HMstr, _ = result_row[f"{attr}_time"].split('(')
-            H, M = HMstr.split(':')
-            S = 0
-        else:
-            H, M, S = result_row[f"{attr}_time"].split(':')
-        try:
-            tt = ts.utc(year, month, day, int(H), int(M), int(S))
-        except:
-            kl=1
-        utciso = tt.utc_iso()
-        atoms = utciso.split('-')
-        newyear = int(atoms[-3])
-        if utciso.startswith('-'):
-            thesign = '-'
-        else:
-            thesign = '+'
+        H, M, S = result_row[timeattr].split(':')
+    return int(H), int(M), int(S)
+
+
+def gsfc_set_local_circ_fields(attr, result_row, tt, utciso):
+    utciso = signed_iso(utciso)
+    result_row[attr] = {'tt': tt, 'utc_iso': utciso}
 
-        utciso = f"{thesign}{newyear:04}-{'-'.join(atoms[-2:])}"
-        result_row[attr] = {'tt': tt, 'utc_iso': utciso}
+    if f'{attr}_sun_azi' in result_row:
+        sun_azi = result_row[f'{attr}_sun_azi'].replace('(r)', '').replace('(s)', '')
+        result_row[f'{attr}_sun_azi'] = result_row[attr]['sun_azi'] = int(sun_azi)
+    if f'{attr}_sun_alt' in result_row:
+        sun_alt = result_row[f'{attr}_sun_alt']
+        sun_alt = sun_alt.replace('(r)', '').replace('(s)', '')
+        result_row[f'{attr}_sun_alt'] = result_row[attr]['sun_alt'] = int(sun_alt)
 
-        if f'{attr}_sun_azi' in result_row:
-            sun_azi = result_row[f'{attr}_sun_alt'].replace('(r)', '').replace('(s)', '')
-            result_row[f'{attr}_sun_azi'] = result_row[attr]['sun_azi'] = int(sun_azi)
-        if f'{attr}_sun_alt' in result_row:
-            sun_alt = result_row[f'{attr}_sun_alt']
-            sun_alt = sun_alt.replace('(r)', '').replace('(s)', '')
-            result_row[f'{attr}_sun_alt'] = result_row[attr]['sun_alt'] = int(sun_alt)
+
+def gsfc_process_local_circ_fields(attr, day, month, result_row, year):
+    contact_time = gsfc_contact_time(attr, result_row)
+    if contact_time is None:
+        result_row[attr] = None
+    else:
+        H, M, S = contact_time
+        tt = ts.utc(year, month, day, H, M, S)
+        gsfc_set_local_circ_fields(attr, result_row, tt, tt.utc_iso())
 
 
 def eclipse_at_sunriseset(result_row):
@@ -568,11 +805,11 @@ def eclipse_at_sunriseset(result_row):
 
 def gsfc_local_history_row(cells_data, headers, result_row):
     data = []
-    for cell in cells_data:
-        if cell.text == '-':
+    for text in cells_data:
+        if text == '-':
             data.append(None)
         else:
-            data.append(cell.text)
+            data.append(text)
     if not data[0].startswith('-'):
         data[0] = '+' + data[0]
     data[0] = data[0].replace('2500-Feb-29', '2500-Feb-28')  # correct for error in GSFC leap year calculations
@@ -623,15 +860,104 @@ def process_local_circ_times(circ, label, localdata, lon, tz):
     return label
 
 
+def elevation_sensitivity(localdata, lat, lon, baseline=250):
+    '''
+    adds dt_dh, the rate in seconds per meter that each contact time changes with the elevation of the site, to
+    the contacts of cached local circumstances that don't have it, from the analytic Sun and Moon (the rate is a
+    geometric effect, the error of the theory doesn't matter)
+    :param localdata: entry from solar_eclipse_local.get_year, updated in place
+    :param baseline: meters above and below the elevation of the entry for the finite difference
+    :return: True when any rates were added
+    '''
+    # lazy imports, these modules import this one
+    from circumstances.analytic import analytic_positions
+    from circumstances.skyfieldcalcs import local_contacts
+    added = False
+    for date, eclipse in localdata['eclipses'].items():
+        circs = [circ for circ in ['c1', 'c2', 'mid', 'c3', 'c4'] if eclipse[circ] is not None]
+        if len(circs) == 0 or all('dt_dh' in eclipse[circ] for circ in circs):
+            continue
+        tt = [utc_iso_to_tt(eclipse[circ]['utc_iso']) for circ in circs]
+        t = ts.tt_jd(np.arange(min(tt) - 1800 / 86400, max(tt) + 1800 / 86400, 1 / 86400))
+        ele = localdata['ele'] + np.array([-baseline, baseline])
+        result = local_contacts(analytic_positions(t), np.array([lat, lat]), np.array([lon, lon]), ele)
+        for circ in circs:
+            rate = (result[circ][1] - result[circ][0]) * 86400 / (2 * baseline)
+            eclipse[circ]['dt_dh'] = 0.0 if np.isnan(rate) else float(rate)  # contact missed near the limits
+        added = True
+    return added
+
+
+def elevation_adjusted(localdata, ele):
+    '''
+    copy of cached local circumstances moved to another elevation with the rates from elevation_sensitivity,
+    only the contact times are adjusted, magnitude, obscuration and duration change by far less than they are
+    given to
+    :param localdata: entry from solar_eclipse_local.get_year
+    :param ele: elevation in meters
+    :return: dictionary in the form of localdata, with ele_source the elevation it was computed for
+    '''
+    dh = ele - localdata['ele']
+    adjusted = copy.deepcopy(localdata)
+    adjusted['ele'] = ele
+    adjusted['ele_source'] = localdata['ele']
+    for date, eclipse in adjusted['eclipses'].items():
+        for circ in ['c1', 'c2', 'mid', 'c3', 'c4']:
+            if eclipse[circ] is None or eclipse[circ].get('dt_dh', 0) == 0:
+                continue
+            t = ts.tt_jd(eclipse[circ]['tt'].tt + eclipse[circ]['dt_dh'] * dh / 86400)
+            eclipse[circ]['tt'] = t
+            eclipse[circ]['utc_iso'] = signed_iso(t.utc_iso())
+    return adjusted  # deepcopy keeps by_year pointing at the same rows as eclipses
+
+
+def exact_preferred(exact, adjusted):
+    '''
+    an entry adjusted from another elevation with the rows of the site's own entry for the centuries it covers
+    :param exact: entry from solar_eclipse_local.get_year fetched for the site's elevation
+    :param adjusted: entry from elevation_adjusted
+    :return: dictionary in the form of localdata, in date order, with ele_source from adjusted
+    '''
+    own = set(exact['centuries_checked'])
+    rows = [(date, row) for date, row in adjusted['eclipses'].items() if int(canon_year(date) / 100) not in own]
+    rows += [(date, row) for date, row in exact['eclipses'].items() if int(canon_year(date) / 100) in own]
+    rows.sort(key=lambda item: date_order(item[0]))
+    merged = dict(adjusted, eclipses={}, by_year={},
+                  centuries_checked=sorted(own | set(adjusted['centuries_checked'])))
+    for date, row in rows:
+        merged['eclipses'][date] = row
+        merged['by_year'].setdefault(canon_year(date), {})[date] = row
+    return merged
+
+
+def date_order(date):
+    '''sort key of a canon or JSEX date, ex. -0500-Jan-01 or +2024-Apr-08'''
+    atoms = date.split('-')
+    return canon_year(date), months.index(atoms[-2]), int(atoms[-1])
+
+
 def get_eclipse_path(name='+2023-10-14', eclipsetype='A'):
+    url = eclipse_path_url(name, eclipsetype)
+    s = cached_session('caches/espenak_eclipse_cache.sqlite')
+    with metrics.stage('http', source='eclipsewise'):
+        r = s.get(url)
+    metrics.http_response('eclipsewise', r)
+    return parse_eclipse_path(r.text)
+
+
+def eclipse_path_url(name, eclipsetype):
     dt = dateutil.parser.isoparse(name.replace('+', ''))
     cent = int(dt.year / 100)
     datestr = dt.strftime('%Y%b%d')
+    return f"https://eclipsewise.com/solar/SEpath/{cent}01-{cent + 1}00/SE{datestr}{eclipsetype}path.html"
+
 
-    url = f"https://eclipsewise.com/solar/SEpath/{cent}01-{cent + 1}00/SE{datestr}{eclipsetype}path.html"
-    s = requests_cache.CachedSession('caches/espenak_eclipse_cache.sqlite')
-    r = s.get(url)
-    soup = BeautifulSoup(r.text, 'html.parser')
+@metrics.timed('parse', source='eclipse_path')
+def parse_eclipse_path(text):
+    '''
+    rows of the path table on an eclipsewise SEpath page, keyed by UT
+    '''
+    soup = BeautifulSoup(text, 'html.parser')
     datatab = soup.find('table', {'class': 'datatab'})
     results = {}
     for row in datatab.find_all('tr')[4:-1]:
@@ -667,8 +993,23 @@ def degrees_to_cardinal(d):
     return dirs[ix % 16], dirs_long[ix % 16]
 
 
-def distance_to_path(lat, lon, name='+2023-10-14', eclipsetype='A'):
-    path_data = get_eclipse_path(name=name, eclipsetype=eclipsetype)
+def distance_to_path(lat, lon, name='+2023-10-14', eclipsetype='A', local=False, step=60, path_data=None):
+    '''
+    distance and direction from a location to the nearest point on the central line
+    :param local: compute the path from the ephemeris (compute_eclipse_path) rather than scrape eclipsewise
+    :param step: time resolution of the computed path in seconds
+    :param path_data: path already in hand, from get_eclipse_path or compute_eclipse_path
+    :return: path_data with distance_km, distance_mi and bearing added to each row, and the least distance in
+             miles, its bearing in degrees and as a compass point, all None when the path has no rows (a partial
+             eclipse has no central line)
+    '''
+    if path_data is not None:
+        pass
+    elif local:
+        from circumstances.path import compute_eclipse_path
+        path_data = compute_eclipse_path(name=name, eclipsetype=eclipsetype, step=step)
+    else:
+        path_data = get_eclipse_path(name=name, eclipsetype=eclipsetype)
     distances = []
     for k, row in path_data.items():
         r = Geodesic.WGS84.Inverse(lat, lon, row['central']['lat'], row['central']['lon'])
@@ -677,6 +1018,8 @@ def distance_to_path(lat, lon, name='+2023-10-14', eclipsetype='A'):
         row['bearing'] = r["azi1"]
 
         distances.append(row['distance_mi'])
+    if len(distances) == 0:
+        return path_data, None, None, None
     mindist = min(distances)
     for k, row in path_data.items():
         if row['distance_mi'] == mindist:
@@ -0,0 +1,141 @@
+'''
+local circumstances of historical eclipses under the uncertainty of delta T
+
+for early dates the uncertainty of delta T (TT - UT1) dominates where the shadow fell, the canon gives delta T
+and its standard error (delta_sigma_s) for every eclipse. A different delta T leaves the Sun and Moon where they
+are at a given TT and turns the Earth under them, by the Earth's rotation rate times the difference, so the
+circumstances at a site for a sample of delta T are those at the site moved in longitude on positions computed
+once. All the samples go through local_contacts as one array of sites
+
+    python -m circumstances.deltat -0584-May-28 38.5 34.0 --samples 5000
+
+    summary = deltat_circumstances(canon['-0584-May-28'], 38.5, 34.0, n=5000)
+    summary['probability']['central'], summary['contacts']['c2']['ut1_iso']
+'''
+import argparse
+import json
+
+import numpy as np
+from skyfield.api import GREGORIAN_START
+from skyfield.timelib import compute_calendar_date
+
+from circumstances.skyfieldcalcs import CONTACTS, PRECISION_TIERS, eclipse_positions, local_contacts
+from circumstances.utils import greatest_eclipse_tt, ts
+
+EARTH_ROTATION = 360.98562347 / 86400  # degrees the Earth turns per second of UT1
+
+
+def deltat_samples(canon_delta_t, sigma, n=2000, seed=None):
+    '''
+    normally distributed delta T, seconds
+    :param canon_delta_t: delta T of the canon
+    :param sigma: its standard error, 0 or None for none
+    '''
+    rng = np.random.default_rng(seed)
+    return canon_delta_t + (sigma or 0) * rng.standard_normal(n)
+
+
+def deltat_longitudes(lon, delta_t, model_delta_t):
+    '''
+    longitudes at which positions computed with model_delta_t give the circumstances at lon under each delta_t
+    '''
+    return (lon - EARTH_ROTATION * (np.asarray(delta_t) - model_delta_t) + 180) % 360 - 180
+
+
+def deltat_circumstances(ge, lat, lon, ele=0, n=2000, sigma=None, seed=None, engine='ephemeris',
+                         precision='standard', eph=None, geo=None, percentiles=(5, 50, 95), keep_samples=False):
+    '''
+    distributions of the local circumstances at a site over samples of delta T
+    :param ge: entry from get_canon_Espenak, its delta_t and delta_sigma_s are sampled
+    :param n: number of samples
+    :param sigma: seconds, standard error of delta T (default, the canon's delta_sigma_s)
+    :param seed: for the random draws
+    :param engine: 'ephemeris' or 'analytic', when geo is not given
+    :param geo: geocentric positions spanning the eclipse (default, from engine)
+    :param keep_samples: add the sampled delta T and per sample circumstances under draws
+    :return: dictionary of
+        delta_t: canon, sigma, model (the delta T the positions were computed with)
+        probability: fractions of samples with an eclipse, a central (total or annular) eclipse, total, annular
+        contacts: per contact the fraction of samples in which it occurs, percentiles of its time as UT1
+                  (Julian calendar before 1582 Oct 15) and its spread in seconds, None when it never occurs
+        duration, obscuration, magnitude: mean and percentiles, duration over the central samples
+    '''
+    tt = greatest_eclipse_tt(ge)
+    model = float(ts.tt_jd(tt).delta_t)
+    canon = ge.get('delta_t')
+    canon = model if canon is None else float(canon)
+    if sigma is None:
+        sigma = ge.get('delta_sigma_s') or 0
+    if geo is None:
+        geo = eclipse_positions(tt, engine=engine, precision=precision, eph=eph)
+    tier = PRECISION_TIERS[precision] if isinstance(precision, str) else precision
+
+    delta_t = deltat_samples(canon, sigma, n, seed)
+    result = local_contacts(geo, lat, deltat_longitudes(lon, delta_t, model), ele, coarse=tier['coarse'])
+
+    kinds = result['type']
+    summary = {'samples': n, 'delta_t': {'canon': canon, 'sigma': float(sigma), 'model': model},
+               'probability': {'eclipse': float(np.mean(kinds != '')),
+                               'central': float(np.mean((kinds == 'T') | (kinds == 'A'))),
+                               'total': float(np.mean(kinds == 'T')), 'annular': float(np.mean(kinds == 'A'))},
+               'contacts': {}}
+    ut1 = {}
+    for attr in CONTACTS:
+        ut1[attr] = result[attr] - delta_t / 86400
+        occurs = ~np.isnan(ut1[attr])
+        if not occurs.any():
+            summary['contacts'][attr] = None
+            continue
+        values = ut1[attr][occurs]
+        summary['contacts'][attr] = {'probability': float(occurs.mean()),
+                                     'ut1_iso': {p: ut1_iso(v) for p, v in zip(percentiles,
+                                                                              np.percentile(values, percentiles))},
+                                     'spread_s': float(np.std(values) * 86400)}
+    central = result['duration'] > 0
+    for attr, values in [('duration', result['duration'][central]),
+                         ('obscuration', result['obscuration'][kinds != '']),
+                         ('magnitude', result['magnitude'][kinds != ''])]:
+        summary[attr] = None if len(values) == 0 else {
+            'mean': float(values.mean()),
+            'percentiles': {p: float(v) for p, v in zip(percentiles, np.percentile(values, percentiles))}}
+    if keep_samples:
+        summary['draws'] = dict({'delta_t': delta_t, 'type': kinds, 'duration': result['duration'],
+                                   'obscuration': result['obscuration']}, **ut1)
+    return summary
+
+
+def ut1_iso(jd):
+    '''
+    signed ISO time stamp of a UT1 julian date, on the Julian calendar before 1582 Oct 15 as the canon and GSFC
+    give dates, the inverse of utc_iso_to_tt before 1972
+    '''
+    seconds = round((jd + 0.5) * 86400)
+    day, seconds = divmod(seconds, 86400)
+    year, month, day = compute_calendar_date(int(day), julian_before=GREGORIAN_START)
+    hour, seconds = divmod(seconds, 3600)
+    minute, second = divmod(seconds, 60)
+    sign = '-' if year < 0 else '+'
+    return f"{sign}{abs(year):04}-{month:02}-{day:02}T{hour:02}:{minute:02}:{second:02}Z"
+
+
+def main(argv=None):
+    from circumstances.circumstances import get_canon_Espenak
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('eclipse', help='canon date (UT1), ex. -0584-May-28')
+    parser.add_argument('lat', type=float)
+    parser.add_argument('lon', type=float)
+    parser.add_argument('--ele', type=float, default=0)
+    parser.add_argument('--samples', type=int, default=2000)
+    parser.add_argument('--sigma', type=float, help="seconds, standard error of delta T (default, the canon's)")
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--engine', default='ephemeris', choices=['ephemeris', 'analytic'])
+    args = parser.parse_args(argv)
+    canon, otherdates = get_canon_Espenak()
+    ge = canon[args.eclipse] if args.eclipse in canon else canon[otherdates[args.eclipse]]
+    summary = deltat_circumstances(ge, args.lat, args.lon, ele=args.ele, n=args.samples, sigma=args.sigma,
+                                   seed=args.seed, engine=args.engine)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+'''
+columnar export of localize() results, one row per site and eclipse, for loading into a warehouse
+
+    table = localize_table(records)                    # pyarrow Table
+    write_parquet(records, 'markets.parquet')
+    jsonl_to_parquet('markets.jsonl', 'markets.parquet')   # output of circumstances.batch, streamed
+
+a record is the dictionary circumstances.batch writes for a site, localize_record builds one from a
+solar_eclipse_local and the four dictionaries localize returns. Along with the nested dictionaries a record
+carries its rows, flat dictionaries of the columns of SCHEMA one per eclipse, made where the record is made, so
+the export hands them to Arrow in one call rather than walking the records. Contact times are UTC timestamps
+(dates before 1582 Oct 15 are on the Julian calendar, as GSFC gives them, and are converted to the instant they
+name) to the millisecond, along with TT julian dates and local wall clock times as text
+'''
+import json
+import re
+
+from skyfield.api import GREGORIAN_START
+from skyfield.timelib import julian_day
+
+from circumstances.skyfieldcalcs import CONTACTS
+
+CATEGORIES = ['inpath', 'nearpath', 'farpath']
+
+# column name and type, types are the names of pyarrow type factories
+SCHEMA = [('key', 'string'), ('name', 'string'), ('lat', 'float64'), ('lon', 'float64'), ('ele', 'float64'),
+          ('tz', 'string'), ('eclipse', 'string'), ('category', 'string'), ('base_type', 'string'),
+          ('eclipse_type', 'string')]
+for _c in CONTACTS:
+    SCHEMA += [(f'{_c}_utc', 'timestamp'), (f'{_c}_tt', 'float64'), (f'{_c}_local', 'string'),
+               (f'{_c}_local_tz', 'string'), (f'{_c}_sun_alt', 'float64'), (f'{_c}_sun_azi', 'float64')]
+SCHEMA += [('magnitude', 'float64'), ('obscuration', 'float64'), ('duration_s', 'float64'), ('notes', 'string'),
+           ('events', 'string'), ('mapurl', 'string')]
+
+iso_re = re.compile(r'([+-]?\d+)-(\d+)-(\d+)T(\d+):(\d+):(\d+(?:\.\d*)?)')
+duration_re = re.compile(r'(?:(\d+)h)?(?:(\d+)m)?(?:([\d.]+)s)?$')
+
+
+def localize_record(local, inpath, nearpath, farpath, prevnextevents):
+    '''
+    the record for a site, as circumstances.batch writes it, with its rows
+    :param local: solar_eclipse_local that localize was called on
+    '''
+    record = {'key': local.key, 'name': local.name, 'lat': local.lat, 'lon': local.lon, 'ele': local.ele,
+              'tz': local.timezone, 'inpath': inpath, 'nearpath': nearpath, 'farpath': farpath,
+              'prevnextevents': prevnextevents}
+    record['rows'] = localize_rows(record)
+    return record
+
+
+def localize_rows(record):
+    '''
+    the flat rows of a record, one per eclipse, each a dictionary of the columns in SCHEMA with None where a value
+    is missing and the UTC columns in milliseconds since 1970, made once where the record is made (batch workers
+    add them to every record they write) so the export is a single conversion
+    '''
+    events = _event_roles(record.get('prevnextevents') or {})
+    site = {attr: record.get(attr) for attr in ['key', 'name', 'lat', 'lon', 'ele', 'tz']}
+    rows = []
+    for category in CATEGORIES:
+        for base_type, eclipses in record[category].items():
+            for label, localdata in eclipses.items():
+                row = dict(site, eclipse=localdata['date'], category=category, base_type=base_type,
+                           eclipse_type=localdata.get('eclipse type'))
+                for c in CONTACTS:
+                    row.update(_contact_columns(c, localdata.get(c)))
+                row.update(magnitude=_float(localdata.get('mag')), obscuration=_float(localdata.get('obs')),
+                           duration_s=duration_seconds(localdata.get('duration')),
+                           notes='; '.join(localdata.get('notes', [])) or None,
+                           events=','.join(events.get(localdata['date'], [])) or None,
+                           mapurl=localdata.get('mapurl'))
+                rows.append(row)
+    return rows
+
+
+def record_rows(records):
+    '''
+    rows of records, those they carry (see localize_rows) or, for records written without them, made here
+    :param records: record or list of records
+    '''
+    if isinstance(records, dict):
+        records = [records]
+    rows = []
+    for record in records:
+        rows.extend(record['rows'] if 'rows' in record else localize_rows(record))
+    return rows
+
+
+def _contact_columns(c, contact):
+    if contact is None:
+        return {f'{c}_{suffix}': None for suffix in ['utc', 'tt', 'local', 'local_tz', 'sun_alt', 'sun_azi']}
+    tt = contact['tt']
+    return {f'{c}_utc': round(epoch_seconds(contact['utc_iso']) * 1000), f'{c}_tt': float(getattr(tt, 'tt', tt)),
+            f'{c}_local': contact.get('local_iso'), f'{c}_local_tz': contact.get('local_tz'),
+            f'{c}_sun_alt': _float(contact.get('sun_alt')), f'{c}_sun_azi': _float(contact.get('sun_azi'))}
+
+
+def _event_roles(prevnextevents):
+    '''eclipse date to the roles it plays in prevnextevents, ex. T.next_in_path'''
+    roles = {}
+    for kind, events in prevnextevents.items():
+        for role, localdata in events.items():
+            if localdata is not None:
+                roles.setdefault(localdata['date'], []).append(f"{kind}.{role}")
+    return roles
+
+
+def _float(value):
+    return None if value is None else float(value)
+
+
+def epoch_seconds(utciso):
+    '''
+    seconds since 1970-01-01T00:00:00Z of a signed ISO time stamp, on the Julian calendar before 1582 Oct 15
+    :return: int, or float when the time stamp has a fraction of a second
+    '''
+    m = iso_re.match(utciso)
+    if m is None:
+        raise ValueError(f"unable to parse time stamp {utciso}")
+    year, month, day, hour, minute = [int(x) for x in m.groups()[:5]]
+    second = float(m.group(6)) if '.' in m.group(6) else int(m.group(6))
+    jdn = julian_day(year, month, day, julian_before=GREGORIAN_START)
+    return (jdn - 2440588) * 86400 + hour * 3600 + minute * 60 + second
+
+
+def duration_seconds(duration):
+    '''seconds from a GSFC duration, ex. 03m30s, None when there is none'''
+    if duration is None:
+        return None
+    if isinstance(duration, (int, float)):
+        return float(duration)
+    m = duration_re.match(duration.strip())
+    if m is None or not any(m.groups()):
+        return None
+    h, mi, s = m.groups()
+    return int(h or 0) * 3600 + int(mi or 0) * 60 + float(s or 0)
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("the columnar export requires pyarrow, pip install pyarrow")
+    return pyarrow
+
+
+def arrow_schema():
+    pa = _pyarrow()
+    types = {'string': pa.string(), 'float64': pa.float64(), 'timestamp': pa.timestamp('ms', tz='UTC')}
+    return pa.schema([(name, types[kind]) for name, kind in SCHEMA])
+
+
+def localize_table(records):
+    '''
+    records as a pyarrow Table with the columns of SCHEMA, requires pyarrow
+    '''
+    pa = _pyarrow()
+    return pa.Table.from_pylist(record_rows(records), schema=arrow_schema())
+
+
+def write_parquet(records, filename, compression='zstd'):
+    '''
+    writes records to a Parquet file, requires pyarrow
+    '''
+    pa = _pyarrow()
+    pa.parquet.write_table(localize_table(records), filename, compression=compression)
+
+
+def jsonl_to_parquet(jsonl, filename, batch_size=500, compression='zstd'):
+    '''
+    converts the JSONL output of circumstances.batch to Parquet, batch_size sites at a time, so memory is bounded
+    however many sites there are
+    :return: number of rows written
+    '''
+    pa = _pyarrow()
+    writer = pa.parquet.ParquetWriter(filename, arrow_schema(), compression=compression)
+    rows = 0
+    batch = []
+    fp = open(jsonl)
+    try:
+        for line in fp:
+            if line.strip():
+                batch.append(json.loads(line))
+            if len(batch) >= batch_size:
+                rows += _write_batch(writer, batch)
+                batch = []
+        if len(batch) > 0:
+            rows += _write_batch(writer, batch)
+    finally:
+        fp.close()
+        writer.close()
+    return rows
+
+
+def _write_batch(writer, batch):
+    table = localize_table(batch)
+    writer.write_table(table)
+    return table.num_rows
@@ -0,0 +1,207 @@
+'''
+opt-in timers and counters around the slow stages of a run: HTTP, Selenium waits, parsing, ephemeris
+evaluation and pickle I/O
+
+    from circumstances import metrics
+    metrics.enable()
+    ...
+    metrics.snapshot()         # dict
+    metrics.prometheus_text()  # Prometheus text exposition format
+
+off by default (or set CIRCUMSTANCES_METRICS=1), when off stage() hands back a shared do-nothing context
+manager and counter() returns immediately, so the instrumented code pays one function call per stage.
+updates are made under a lock so threads can share the counters and timers
+'''
+import contextlib
+import cProfile
+import functools
+import io
+import os
+import pstats
+import threading
+import time
+from collections import defaultdict
+
+enabled = os.environ.get('CIRCUMSTANCES_METRICS', '') not in ('', '0')
+_counters = defaultdict(int)
+_timers = {}  # (name, labels): [count, total seconds, max seconds]
+_trace_hook = None
+_null = contextlib.nullcontext()
+_lock = threading.Lock()
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+def disable():
+    enable(False)
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _timers.clear()
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def counter(name, n=1, **labels):
+    '''
+    adds n to a counter, ex. counter('pickle_cache', source='gsfc_local', cache='hit')
+    '''
+    if enabled:
+        key = _key(name, labels)
+        with _lock:
+            _counters[key] += n
+
+
+def http_response(source, r):
+    '''
+    counts an HTTP response from a requests_cache session as a cache hit or miss
+    :param source: which site or session, ex. 'eclipsewise'
+    '''
+    if enabled:
+        key = _key('http_requests', {'source': source, 'cache': 'hit' if getattr(r, 'from_cache', False) else 'miss'})
+        with _lock:
+            _counters[key] += 1
+
+
+class _stage(object):
+    __slots__ = ('key', 'start')
+
+    def __init__(self, key):
+        self.key = key
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        with _lock:
+            timer = _timers.get(self.key)
+            if timer is None:
+                timer = _timers[self.key] = [0, 0.0, 0.0]
+            timer[0] += 1
+            timer[1] += elapsed
+            if elapsed > timer[2]:
+                timer[2] = elapsed
+        if _trace_hook is not None:
+            _trace_hook(self.key[0], dict(self.key[1]), self.start, elapsed, exc)
+        return False
+
+
+def stage(name, **labels):
+    '''
+    times the enclosed block, ex.
+        with metrics.stage('selenium_wait', step='results_table'):
+            ...
+    '''
+    if not enabled:
+        return _null
+    return _stage(_key(name, labels))
+
+
+def timed(name, **labels):
+    '''
+    decorator timing every call of a function as a stage
+    '''
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name, **labels):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def set_trace_hook(fn):
+    '''
+    calls fn(name, labels, start, elapsed, exception) as each stage finishes, for forwarding stages as spans
+    to a tracing system, None removes the hook
+    '''
+    global _trace_hook
+    _trace_hook = fn
+
+
+def _label_str(labels, quote=''):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}={quote}{v}{quote}' for k, v in labels) + '}'
+
+
+def _copy():
+    with _lock:
+        return dict(_counters), {key: tuple(timer) for key, timer in _timers.items()}
+
+
+def snapshot():
+    '''
+    current counters and timers
+    :return: dict with counters keyed by name{labels} and timers with count, total_s, mean_s and max_s
+    '''
+    counter_values, timer_values = _copy()
+    counters = {f'{name}{_label_str(labels)}': n for (name, labels), n in sorted(counter_values.items())}
+    timers = {}
+    for (name, labels), (count, total, longest) in sorted(timer_values.items()):
+        timers[f'{name}{_label_str(labels)}'] = {'count': count, 'total_s': total,
+                                                 'mean_s': total / count if count else 0.0, 'max_s': longest}
+    return {'enabled': enabled, 'counters': counters, 'timers': timers}
+
+
+def prometheus_text(prefix='circumstances'):
+    '''
+    counters and timers in the Prometheus text exposition format, timers as summaries in seconds
+    '''
+    counters, timers = _copy()
+    lines = []
+    names = sorted({name for name, labels in counters})
+    for name in names:
+        lines.append(f'# TYPE {prefix}_{name}_total counter')
+        for (n, labels), value in sorted(counters.items()):
+            if n == name:
+                lines.append(f'{prefix}_{name}_total{_label_str(labels, quote=chr(34))} {value}')
+    names = sorted({name for name, labels in timers})
+    for name in names:
+        lines.append(f'# TYPE {prefix}_{name}_seconds summary')
+        for (n, labels), (count, total, longest) in sorted(timers.items()):
+            if n == name:
+                label_str = _label_str(labels, quote=chr(34))
+                lines.append(f'{prefix}_{name}_seconds_count{label_str} {count}')
+                lines.append(f'{prefix}_{name}_seconds_sum{label_str} {total:.9f}')
+        lines.append(f'# TYPE {prefix}_{name}_seconds_max gauge')
+        for (n, labels), (count, total, longest) in sorted(timers.items()):
+            if n == name:
+                lines.append(f'{prefix}_{name}_seconds_max{_label_str(labels, quote=chr(34))} {longest:.9f}')
+    return '\n'.join(lines) + '\n'
+
+
+@contextlib.contextmanager
+def profile(filename=None, sort='cumulative', limit=30):
+    '''
+    runs the enclosed block under cProfile, ex.
+        with metrics.profile('localize.prof'):
+            uut.localize()
+    :param filename: write the raw stats here for snakeviz or pstats (default, print the top functions)
+    :param sort: pstats sort key
+    :param limit: number of functions to print
+    '''
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if filename is not None:
+            profiler.dump_stats(filename)
+        else:
+            s = io.StringIO()
+            pstats.Stats(profiler, stream=s).sort_stats(sort).print_stats(limit)
+            print(s.getvalue())
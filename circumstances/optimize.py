@@ -0,0 +1,191 @@
+'''
+the best place to see an eclipse within reach of home
+
+candidates are seeded on rings around home and along the central line where it passes within the radius, all of
+them go through local_contacts at once against geocentric positions computed once, then the best few are refined
+on grids that halve in size down to the tolerance, a few hundred sites in all rather than one circumstances call
+per candidate
+
+    python -m circumstances.optimize 2024-Apr-08 35.0 -98.0 --radius 250 --min-sun-alt 20
+
+    result = best_site(canon['2024-Apr-08'], 35.0, -98.0, radius_km=250)
+    result['best']['lat'], result['best']['lon'], result['best']['duration'], result['best']['distance_km']
+    result['profile']['offset_km'], result['profile']['duration']
+
+the best site has the longest central phase (totality or annularity), or the greatest obscuration when the path
+is out of reach, the profile is the duration and obscuration on the line across the path through the best site
+'''
+import argparse
+import json
+
+import numpy as np
+
+from circumstances.path import bearing, destination, great_circle_km, shadow_axis_intercept
+from circumstances.route import best_point, densify, rank_points
+from circumstances.skyfieldcalcs import PRECISION_TIERS, contacts_to_dict, eclipse_positions, local_contacts
+from circumstances.utils import greatest_eclipse_tt, json_safe
+
+
+def disc_points(lat, lon, radius_km, rings=8):
+    '''
+    home and rings of points around it out to radius_km, about radius_km / rings apart
+    :return: latitudes and longitudes, home first
+    '''
+    lats, lons = [np.atleast_1d(float(lat))], [np.atleast_1d(float(lon))]
+    for ring in range(1, rings + 1):
+        azimuth = np.arange(6 * ring) * 360 / (6 * ring)
+        ring_lat, ring_lon = destination(lat, lon, azimuth, radius_km * ring / rings)
+        lats.append(ring_lat)
+        lons.append(ring_lon)
+    return np.concatenate(lats), np.concatenate(lons)
+
+
+def central_line(geo, step=30, path_data=None):
+    '''
+    points of the central line in time order
+    :param geo: geocentric positions spanning the eclipse, the line is where the shadow axis meets the Earth
+    :param step: seconds between points taken from geo
+    :param path_data: path from get_eclipse_path or compute_eclipse_path, used instead of geo when given
+    :return: latitudes and longitudes, empty for a partial eclipse
+    '''
+    if path_data is not None:
+        rows = [row['central'] for row in path_data.values() if row.get('central')]
+        return np.array([row['lat'] for row in rows], dtype=float), np.array([row['lon'] for row in rows], dtype=float)
+    k = max(1, int(round(step / geo['step'])))
+    (lat, lon), found = shadow_axis_intercept(geo['sun'][:, ::k], geo['moon'][:, ::k])
+    return lat[found], lon[found]
+
+
+def best_site(ge, lat, lon, radius_km=100, ele=0, min_sun_alt=None, engine='ephemeris', precision='standard',
+              eph=None, geo=None, path_data=None, tolerance_km=0.1, rings=8, keep=3, profile_km=None,
+              profile_points=41):
+    '''
+    the site within radius_km of home with the longest central phase, or the greatest obscuration
+    :param ge: entry from get_canon_Espenak, or TT julian date of greatest eclipse
+    :param lat: latitude of home
+    :param lon: longitude of home
+    :param radius_km: how far from home to look, along great circles
+    :param ele: elevation in meters taken for every site
+    :param min_sun_alt: degrees, sites where the Sun is lower at maximum eclipse are passed over
+    :param geo: geocentric positions spanning the eclipse (default, from engine)
+    :param path_data: path from get_eclipse_path or compute_eclipse_path, central line points within reach (by
+                      distance_to_path) seed the search, otherwise the central line is found from geo
+    :param tolerance_km: size of the last refinement grid
+    :param rings: rings of seeds around home, seeds are about radius_km / rings apart
+    :param keep: candidates refined at each step
+    :param profile_km: half length of the profile across the path (default, radius_km)
+    :param profile_points: points in the profile
+    :return: dictionary of
+        best: contacts_to_dict of the best site with lat, lon, ele, distance_km and bearing from home, None when
+              the eclipse is not seen (with the Sun high enough) anywhere within reach
+        home: contacts_to_dict at home
+        profile: arrays of offset_km across the path from the best site (positive to the right of the shadow's
+                 track), lat, lon, duration, obscuration, type and within_radius
+        evaluations: number of sites computed
+    '''
+    tt = greatest_eclipse_tt(ge) if isinstance(ge, dict) else ge
+    tier = PRECISION_TIERS[precision] if isinstance(precision, str) else precision
+    if geo is None:
+        geo = eclipse_positions(tt, engine=engine, precision=precision, eph=eph)
+    spacing = radius_km / rings
+
+    seed_lat, seed_lon = disc_points(lat, lon, radius_km, rings=rings)
+    if path_data is not None:
+        from circumstances.circumstances import distance_to_path
+        path_data = {k: dict(row) for k, row in path_data.items()}  # distance_to_path adds to the rows
+        path_data, mindist, bearing_deg, bearing_dir = distance_to_path(lat, lon, path_data=path_data)
+        path_data = {k: row for k, row in path_data.items() if row['distance_km'] <= radius_km + spacing}
+    line_lat, line_lon = central_line(geo, path_data=path_data)
+    if len(line_lat) > 1:
+        line_lat, line_lon, line_ele, distance = densify(line_lat, line_lon, spacing_km=spacing / 2)
+        near = great_circle_km(lat, lon, line_lat, line_lon) <= radius_km
+        seed_lat = np.append(seed_lat, line_lat[near])
+        seed_lon = np.append(seed_lon, line_lon[near])
+
+    points = _evaluate(geo, seed_lat, seed_lon, ele, tier['coarse'])
+    evaluations = len(seed_lat)
+    home = contacts_to_dict(points, 0)
+    ranked = rank_points(points, min_sun_alt=min_sun_alt)
+    if len(ranked) == 0:
+        return {'best': None, 'home': home, 'profile': None, 'evaluations': evaluations}
+
+    # coarse to fine, a 5x5 grid half the seed spacing apart around each of the best, halving until the tolerance
+    size = spacing
+    offsets = np.array([-1, -0.5, 0, 0.5, 1])
+    east, north = [x.ravel() for x in np.meshgrid(offsets, offsets)]
+    while size > tolerance_km:
+        best_lat, best_lon = points['lat'][ranked[:keep]], points['lon'][ranked[:keep]]
+        grid_lat, grid_lon = destination(best_lat[:, None], best_lon[:, None],
+                                         np.degrees(np.arctan2(east, north))[None, :],
+                                         (size * np.hypot(east, north))[None, :])
+        grid_lat, grid_lon = _within(lat, lon, grid_lat.ravel(), grid_lon.ravel(), radius_km)
+        points = _evaluate(geo, grid_lat, grid_lon, ele, tier['coarse'])
+        evaluations += len(grid_lat)
+        ranked = rank_points(points, min_sun_alt=min_sun_alt)
+        size /= 2
+
+    best = best_point(points, min_sun_alt=min_sun_alt)
+    del best['index']
+    best['ele'] = float(ele)
+    best['distance_km'] = float(great_circle_km(lat, lon, best['lat'], best['lon']))
+    best['bearing'] = float(bearing(lat, lon, best['lat'], best['lon']) % 360)
+
+    # across the path, perpendicular to the central line where it passes nearest the best site
+    if best['duration'] > 0 and len(line_lat) > 1:
+        n = int(np.argmin(great_circle_km(best['lat'], best['lon'], line_lat, line_lon)))
+        n = min(n, len(line_lat) - 2)
+        azimuth = bearing(line_lat[n], line_lon[n], line_lat[n + 1], line_lon[n + 1]) + 90
+    elif best['distance_km'] > 0:
+        azimuth = best['bearing']
+    else:
+        azimuth = 0.0
+    offset = np.linspace(-1, 1, profile_points) * (radius_km if profile_km is None else profile_km)
+    profile_lat, profile_lon = destination(best['lat'], best['lon'], azimuth, offset)
+    result = _evaluate(geo, profile_lat, profile_lon, ele, tier['coarse'])
+    evaluations += profile_points
+    profile = {'offset_km': offset, 'lat': profile_lat, 'lon': profile_lon, 'duration': result['duration'],
+               'obscuration': result['obscuration'], 'type': result['type'],
+               'within_radius': great_circle_km(lat, lon, profile_lat, profile_lon) <= radius_km}
+    return {'best': best, 'home': home, 'profile': profile, 'evaluations': evaluations}
+
+
+def _evaluate(geo, lat, lon, ele, coarse):
+    points = local_contacts(geo, lat, lon, ele, coarse=coarse)
+    points['lat'] = np.atleast_1d(lat)
+    points['lon'] = np.atleast_1d(lon)
+    return points
+
+
+def _within(lat, lon, lats, lons, radius_km):
+    '''
+    points beyond radius_km of lat/lon moved in to it along the great circle from lat/lon
+    '''
+    beyond = great_circle_km(lat, lon, lats, lons) > radius_km
+    if beyond.any():
+        lats, lons = lats.copy(), lons.copy()
+        lats[beyond], lons[beyond] = destination(lat, lon, bearing(lat, lon, lats[beyond], lons[beyond]), radius_km)
+    return lats, lons
+
+
+def main(argv=None):
+    from circumstances.circumstances import get_canon_Espenak
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('eclipse', help='canon date (UT1), ex. 2024-Apr-08')
+    parser.add_argument('lat', type=float)
+    parser.add_argument('lon', type=float)
+    parser.add_argument('--radius', type=float, default=100, help='km from home')
+    parser.add_argument('--ele', type=float, default=0)
+    parser.add_argument('--min-sun-alt', type=float)
+    parser.add_argument('--engine', default='ephemeris', choices=['ephemeris', 'analytic'])
+    args = parser.parse_args(argv)
+    canon, otherdates = get_canon_Espenak()
+    ge = canon[args.eclipse] if args.eclipse in canon else canon[otherdates[args.eclipse]]
+    result = best_site(ge, args.lat, args.lon, radius_km=args.radius, ele=args.ele, min_sun_alt=args.min_sun_alt,
+                       engine=args.engine)
+    if result['profile'] is not None:
+        result['profile'] = {k: v.tolist() for k, v in result['profile'].items()}
+    print(json.dumps(json_safe(result), indent=2))
+
+
+if __name__ == '__main__':
+    main()
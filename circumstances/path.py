@@ -0,0 +1,229 @@
+import pickle
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from geographiclib.geodesic import Geodesic
+
+from circumstances import metrics
+from circumstances.circumstances import get_canon_Espenak
+from circumstances.skyfieldcalcs import eclipse_window, geocentric_positions, local_altaz, local_contacts, \
+    local_geometry, site_xyz
+from circumstances.utils import greatest_eclipse_tt, load_ephemeris, months, pickle_dump_atomic, ts
+
+WGS84_A = 6378.137
+WGS84_F = 1 / 298.257223563
+WGS84_E2 = WGS84_F * (2 - WGS84_F)
+MEAN_EARTH_RADIUS_KM = 6371.0088
+
+
+def compute_eclipse_path(name='+2023-10-14', eclipsetype='A', step=60, canondata=None, eph=None, force=False):
+    '''
+    computes the path of a central eclipse from the JPL ephemeris at any time resolution, in the same form as
+    get_eclipse_path scrapes from eclipsewise
+    the central line is where the shadow axis meets the WGS84 ellipsoid, the limits are where the edge of the
+    umbra (antumbra) crosses the perpendicular to the track at that instant, and the duration is that of the
+    central phase on the central line
+    :param name: date of the eclipse, [+-]YYYY-MM-DD
+    :param eclipsetype: T, A or H, used to name the cache file
+    :param step: time between rows in seconds
+    :param canondata: entry from get_canon_Espenak, looked up from name when not provided
+    :param eph: ephemeris (default, load_ephemeris for the year of the eclipse)
+    :param force: recompute even if the path is cached
+    :return: dictionary of rows keyed by UT (HH:MM, or HH:MM:SS when step is not whole minutes), empty when the
+             shadow axis misses the Earth
+    '''
+    filename_pickle = f'caches/paths/{name}{eclipsetype}_{step}.pickle'
+    if not force:
+        try:
+            with metrics.stage('pickle_read', source='paths'):
+                fp = open(filename_pickle, 'rb')
+                results = pickle.load(fp)
+                fp.close()
+            metrics.counter('pickle_cache', source='paths', cache='hit')
+            return results
+        except Exception as e:
+            metrics.counter('pickle_cache', source='paths', cache='miss')
+    if canondata is None:
+        canondata = find_canon_entry(name)
+    tt = greatest_eclipse_tt(canondata)
+    if eph is None:
+        eph = load_ephemeris(ts.tt_jd(tt).tt_calendar()[0])
+
+    # rows on whole multiples of step in UT, out to 4 hours either side of greatest eclipse
+    ge = ts.tt_jd(tt)
+    year, month, day, hour, minute, second = ge.utc
+    seconds = hour * 3600 + minute * 60 + second
+    rowseconds = np.arange(np.ceil((seconds - 4 * 3600) / step) * step, seconds + 4 * 3600, step)
+    t = ts.utc(int(year), int(month), int(day), 0, 0, rowseconds)
+    geo = geocentric_positions(t, eph)
+
+    central, found = shadow_axis_intercept(geo['sun'], geo['moon'])
+    results = {}
+    if not found.any():
+        # the axis misses the Earth (a partial eclipse), cached like any other path so it isn't recomputed
+        with metrics.stage('pickle_write', source='paths'):
+            pickle_dump_atomic(results, filename_pickle)
+        return results
+    rows = np.flatnonzero(found)
+    lat, lon = central[0][rows], central[1][rows]
+    sun, moon = geo['sun'][:, rows], geo['moon'][:, rows]
+
+    northern, southern = path_limits(sun, moon, lat, lon)
+    separation, sun_r, moon_r = local_geometry(sun, moon, site_xyz(lat, lon))
+    alt, az = local_altaz(sun - site_xyz(lat, lon), lat, lon)
+    contacts = local_contacts(geocentric_positions(eclipse_window(tt, hours=4.5), eph), lat, lon)
+    labels = t[rows].utc_strftime('%H:%M' if step % 60 == 0 else '%H:%M:%S')
+
+    for n, label in enumerate(labels):
+        row = {'northern': None, 'southern': None,
+               'central': {'lat': round(lat[n], 2), 'lon': round(lon[n], 2)},
+               'moon:sun ratio': round(moon_r[n] / sun_r[n], 4),
+               'sun altitude': int(round(alt[n])),
+               'sun azimuth': int(round(az[n])),
+               'path width km': None,
+               'path width mi': None,
+               'duration': format_duration(contacts['duration'][n])}
+        if not np.isnan(northern[0][n]) and not np.isnan(southern[0][n]):
+            row['northern'] = {'lat': round(northern[0][n], 2), 'lon': round(northern[1][n], 2)}
+            row['southern'] = {'lat': round(southern[0][n], 2), 'lon': round(southern[1][n], 2)}
+            r = Geodesic.WGS84.Inverse(northern[0][n], northern[1][n], southern[0][n], southern[1][n])
+            row['path width km'] = round(r['s12'] / 1000)
+            row['path width mi'] = round(row['path width km'] * 0.621371)
+        results[label] = row
+
+    with metrics.stage('pickle_write', source='paths'):
+        pickle_dump_atomic(results, filename_pickle)
+    return results
+
+
+def compute_canon_paths(year_start=1901, year_end=2100, step=60, max_workers=None):
+    '''
+    computes and caches the paths of every central eclipse in the canon between two years on a process pool
+    :return: dictionary of paths keyed by name and eclipse type, ex. +2024-04-08T
+    '''
+    canon, otherdates = get_canon_Espenak()
+    jobs = {}
+    for key, canondata in canon.items():
+        year = int(canondata['id'][:5])
+        if year < year_start or year > year_end or canondata['eclipse_type'][0] not in 'TAH':
+            continue
+        eclipseid = canondata['id']
+        name = f"{eclipseid[:5]}-{eclipseid[5:7]}-{eclipseid[7:9]}"
+        jobs[f"{name}{canondata['eclipse_type'][0]}"] = (name, canondata['eclipse_type'][0], step, canondata)
+    results = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(compute_eclipse_path, *args): label for label, args in jobs.items()}
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                print(f"error computing path of {futures[future]}, {e}")
+    return results
+
+
+def find_canon_entry(name):
+    '''
+    the canon entry for an eclipse on a date of the form [+-]YYYY-MM-DD
+    '''
+    canon, otherdates = get_canon_Espenak()
+    sign = '-' if name.startswith('-') else '+'
+    year, month, day = name.lstrip('+-').split('-')
+    datestr = f"{sign}{int(year):04}-{months[int(month)]}-{int(day):02}"
+    if datestr not in otherdates:
+        raise ValueError(f"no eclipse on {name} in the canon")
+    return canon[otherdates[datestr]]
+
+
+def shadow_axis_intercept(sun, moon):
+    '''
+    geodetic latitude and longitude where the axis of the Moon's shadow meets the WGS84 ellipsoid
+    :param sun: 3xN geocentric ITRS positions in km
+    :param moon: 3xN geocentric ITRS positions in km
+    :return: (lat, lon) arrays in degrees (nan where the axis misses the Earth), boolean array of hits
+    '''
+    d = moon - sun
+    d /= np.linalg.norm(d, axis=0)
+    scale = np.array([1, 1, 1 / (1 - WGS84_F)])[:, None]  # stretch z so the ellipsoid becomes a sphere
+    m = moon * scale
+    ds = d * scale
+    a = np.sum(ds * ds, axis=0)
+    b = np.sum(m * ds, axis=0)
+    c = np.sum(m * m, axis=0) - WGS84_A ** 2
+    disc = b * b - a * c
+    found = disc >= 0
+    lam = (-b - np.sqrt(np.where(found, disc, 0))) / a
+    p = moon + lam * d
+    lat = np.degrees(np.arctan2(p[2], (1 - WGS84_E2) * np.hypot(p[0], p[1])))
+    lon = np.degrees(np.arctan2(p[1], p[0]))
+    lat[~found] = np.nan
+    lon[~found] = np.nan
+    return (lat, lon), found
+
+
+def path_limits(sun, moon, lat, lon, max_km=1500, resolution_km=2):
+    '''
+    northern and southern limits of the umbra along the perpendicular to the track through each central point
+    :return: (lat, lon) of the northern and southern limits, nan where the edge was not found
+    '''
+    heading = np.empty(len(lat))
+    if len(lat) > 1:
+        heading[:-1] = bearing(lat[:-1], lon[:-1], lat[1:], lon[1:])
+        heading[-1] = bearing(lat[-2], lon[-2], lat[-1], lon[-1])
+    else:
+        heading[:] = 90
+    distances = np.arange(0, max_km + resolution_km, resolution_km)
+    limits = []
+    for side in [-90, 90]:
+        plat, plon = destination(lat[:, None], lon[:, None], (heading + side)[:, None], distances[None, :])
+        xyz = site_xyz(plat.ravel(), plon.ravel()).reshape(3, len(lat), len(distances))
+        separation, sun_r, moon_r = local_geometry(sun[:, :, None], moon[:, :, None], xyz)
+        g = separation - np.abs(sun_r - moon_r)
+        outside = g >= 0
+        j = np.where(outside.any(axis=1), outside.argmax(axis=1), 0)
+        rows = np.arange(len(lat))
+        valid = (j > 0) & (g[:, 0] < 0)
+        frac = np.where(valid, g[rows, j - 1] / np.where(valid, g[rows, j - 1] - g[rows, j], 1), 0)
+        edge = (j - 1 + frac) * resolution_km
+        elat, elon = destination(lat, lon, heading + side, edge)
+        elat[~valid] = np.nan
+        elon[~valid] = np.nan
+        limits.append((elat, elon))
+    (lat1, lon1), (lat2, lon2) = limits
+    north_first = (lat1 >= lat2) | np.isnan(lat2)
+    northern = (np.where(north_first, lat1, lat2), np.where(north_first, lon1, lon2))
+    southern = (np.where(north_first, lat2, lat1), np.where(north_first, lon2, lon1))
+    return northern, southern
+
+
+def bearing(lat1, lon1, lat2, lon2):
+    '''initial great circle bearing in degrees'''
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    dlam = np.radians(lon2 - lon1)
+    return np.degrees(np.arctan2(np.sin(dlam) * np.cos(phi2),
+                                 np.cos(phi1) * np.sin(phi2) - np.sin(phi1) * np.cos(phi2) * np.cos(dlam)))
+
+
+def great_circle_km(lat1, lon1, lat2, lon2):
+    '''great circle distance in km on the mean sphere, the companion of bearing and destination'''
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    a = np.sin((phi2 - phi1) / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(np.radians(lon2 - lon1) / 2) ** 2
+    return 2 * MEAN_EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def destination(lat, lon, azimuth, km):
+    '''point reached travelling km along a great circle from lat/lon at azimuth (degrees)'''
+    phi = np.radians(lat)
+    theta = np.radians(azimuth)
+    delta = np.asarray(km) / MEAN_EARTH_RADIUS_KM
+    phi2 = np.arcsin(np.sin(phi) * np.cos(delta) + np.cos(phi) * np.sin(delta) * np.cos(theta))
+    lam2 = np.radians(lon) + np.arctan2(np.sin(theta) * np.sin(delta) * np.cos(phi),
+                                        np.cos(delta) - np.sin(phi) * np.sin(phi2))
+    return np.degrees(phi2), (np.degrees(lam2) + 540) % 360 - 180
+
+
+def format_duration(seconds):
+    '''central duration as eclipsewise formats it, ex. 04m28.1s'''
+    if np.isnan(seconds) or seconds <= 0:
+        return '-'
+    minutes, seconds = divmod(seconds, 60)
+    return f"{int(minutes):02}m{seconds:04.1f}s"
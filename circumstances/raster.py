@@ -0,0 +1,159 @@
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from circumstances.skyfieldcalcs import ECLIPSE_TYPE_CODES, eclipse_possible, eclipse_window, geocentric_positions, \
+    local_contacts
+from circumstances.utils import greatest_eclipse_tt, load_ephemeris, ts
+
+RASTER_BANDS = ['obscuration', 'magnitude', 'type', 'duration', 'mid', 'mid_sun_alt']
+
+_worker_geo = None  # geocentric positions for the eclipse, computed once per worker process
+_worker_coarse = None  # the same every 10 minutes, for the visibility pre-filter
+
+
+def eclipse_raster(ge, lat_range=(24, 50), lon_range=(-125, -66), resolution=0.1, ele=0, chunk_size=2000,
+                   max_workers=None, window_hours=4, coarse=60, snapshot=None, engine='ephemeris'):
+    '''
+    maximum obscuration, local eclipse type and C2-C3 duration for every cell of a lat/lon grid
+    the grid is split into chunks of cells farmed out to a process pool, each worker computes the geocentric
+    Sun and Moon positions for the eclipse once and evaluates its chunks against them, so memory is bounded by
+    chunk_size regardless of the size of the grid
+
+    plots directly with matplotlib or basemap, for example
+        r = eclipse_raster(canondata)
+        m.pcolormesh(r['lons'], r['lats'], r['obscuration'], latlon=True)
+
+    :param ge: entry from get_canon_Espenak, or TT julian date of greatest eclipse
+    :param lat_range: (south, north) latitudes of the grid in degrees
+    :param lon_range: (west, east) longitudes of the grid in degrees
+    :param resolution: cell size in degrees
+    :param ele: elevation in meters for every cell
+    :param chunk_size: cells per work unit
+    :param max_workers: process pool size (default, number of CPUs)
+    :param window_hours: hours either side of greatest eclipse to search
+    :param coarse: contact bracketing step in seconds
+    :param snapshot: prefix of a saved snapshot of the eclipse (circumstances.snapshot), workers memory map it
+                     instead of loading the ephemeris
+    :param engine: 'ephemeris' for JPL positions, 'analytic' for the analytic theory (no kernel needed)
+    :return: dict of 2D arrays, one per band in RASTER_BANDS, north up, plus lats, lons and the geotransform
+    '''
+    if isinstance(ge, dict):
+        tt = greatest_eclipse_tt(ge)
+    else:
+        tt = ge
+    lats = lat_range[1] - resolution * (np.arange(round((lat_range[1] - lat_range[0]) / resolution)) + 0.5)
+    lons = lon_range[0] + resolution * (np.arange(round((lon_range[1] - lon_range[0]) / resolution)) + 0.5)
+    grid_lon, grid_lat = np.meshgrid(lons, lats)
+    grid_lat = grid_lat.ravel()
+    grid_lon = grid_lon.ravel()
+
+    bands = {band: np.full(grid_lat.shape, np.nan) for band in RASTER_BANDS}
+    chunks = [(start, min(start + chunk_size, len(grid_lat))) for start in range(0, len(grid_lat), chunk_size)]
+    if max_workers is None:
+        max_workers = os.cpu_count()
+    max_pending = 2 * max_workers  # keep a bounded number of chunks in flight
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_raster_worker_init,
+                             initargs=(tt, window_hours, snapshot, engine)) as executor:
+        pending = {}
+        for start, end in chunks:
+            if len(pending) >= max_pending:
+                _collect_chunks(bands, pending, wait(pending, return_when=FIRST_COMPLETED).done)
+            future = executor.submit(_raster_chunk, grid_lat[start:end], grid_lon[start:end], ele, coarse)
+            pending[future] = start
+        _collect_chunks(bands, pending, list(pending))
+
+    raster = {band: values.reshape(len(lats), len(lons)) for band, values in bands.items()}
+    raster['lats'] = lats
+    raster['lons'] = lons
+    raster['tt'] = tt
+    # GDAL ordering: west edge, cell width, row rotation, north edge, column rotation, cell height
+    raster['geotransform'] = (lon_range[0], resolution, 0.0, lat_range[1], 0.0, -resolution)
+    return raster
+
+
+def _collect_chunks(bands, pending, done):
+    for future in done:
+        start = pending.pop(future)
+        for band, values in future.result().items():
+            bands[band][start:start + len(values)] = values
+
+
+def _raster_worker_init(tt, window_hours, snapshot=None, engine='ephemeris'):
+    global _worker_geo, _worker_coarse
+    if snapshot is not None:
+        from circumstances.snapshot import load_snapshot
+        eph = load_snapshot(snapshot)
+    elif engine == 'analytic':
+        from circumstances.sweep import analytic_source
+        eph = analytic_source()
+    else:
+        eph = load_ephemeris(ts.tt_jd(tt).tt_calendar()[0])
+    _worker_geo = geocentric_positions(eclipse_window(tt, hours=window_hours), eph)
+    _worker_coarse = geocentric_positions(eclipse_window(tt, hours=window_hours, step=600), eph)
+
+
+def _raster_chunk(lat, lon, ele, coarse):
+    chunk = {band: np.full(len(lat), np.nan) for band in RASTER_BANDS}
+    chunk['type'][:] = ECLIPSE_TYPE_CODES['']
+    chunk['duration'][:] = 0
+    possible = eclipse_possible(_worker_coarse, lat, lon, ele, require_sun_up=False)
+    if possible.any():
+        result = local_contacts(_worker_geo, lat[possible], lon[possible], ele=ele, coarse=coarse)
+        for band in RASTER_BANDS:
+            if band == 'type':
+                chunk[band][possible] = [ECLIPSE_TYPE_CODES[t] for t in result['type']]
+            else:
+                chunk[band][possible] = result[band]
+    return chunk
+
+
+def save_raster_npy(raster, prefix):
+    '''
+    writes each band to {prefix}_{band}.npy with the grid and geotransform in {prefix}.json
+    '''
+    for band in RASTER_BANDS:
+        np.save(f"{prefix}_{band}.npy", raster[band])
+    meta = {'bands': RASTER_BANDS,
+            'tt': raster['tt'],
+            'lats': raster['lats'].tolist(),
+            'lons': raster['lons'].tolist(),
+            'geotransform': raster['geotransform'],
+            'type_codes': ECLIPSE_TYPE_CODES}
+    fp = open(f"{prefix}.json", 'w')
+    json.dump(meta, fp)
+    fp.close()
+
+
+def load_raster_npy(prefix, mmap_mode='r'):
+    fp = open(f"{prefix}.json")
+    meta = json.load(fp)
+    fp.close()
+    raster = {band: np.load(f"{prefix}_{band}.npy", mmap_mode=mmap_mode) for band in meta['bands']}
+    raster['lats'] = np.array(meta['lats'])
+    raster['lons'] = np.array(meta['lons'])
+    raster['tt'] = meta['tt']
+    raster['geotransform'] = tuple(meta['geotransform'])
+    return raster
+
+
+def save_raster_geotiff(raster, filename, bands=None):
+    '''
+    writes bands to a multi-band GeoTIFF in WGS84 lat/lon, requires rasterio
+    '''
+    try:
+        import rasterio
+        from rasterio.transform import Affine
+    except ImportError:
+        raise ImportError("save_raster_geotiff requires rasterio, pip install rasterio")
+    if bands is None:
+        bands = RASTER_BANDS
+    transform = Affine.from_gdal(*raster['geotransform'])
+    height, width = raster[bands[0]].shape
+    with rasterio.open(filename, 'w', driver='GTiff', height=height, width=width, count=len(bands),
+                       dtype='float64', crs='EPSG:4326', transform=transform, nodata=np.nan) as dst:
+        for n, band in enumerate(bands, start=1):
+            dst.write(np.asarray(raster[band], dtype='float64'), n)
+            dst.set_band_description(n, band)
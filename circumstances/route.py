@@ -0,0 +1,243 @@
+'''
+local circumstances along a route, for chase trips by road and for flights
+
+a route is a polyline of waypoints, densified along great circles to sample points every spacing_km, and all the
+sample points go through local_contacts as one array of sites against geocentric positions computed once
+
+    python -m circumstances.route 2024-Apr-08 route.csv --spacing 0.5
+
+    result = route_circumstances(canon['2024-Apr-08'], [(29.4, -100.9), (32.78, -96.8), (36.2, -94.1)])
+    result['best']['lat'], result['best']['duration'], result['points']['duration']
+
+a track has a time for every waypoint, for an observer on the move (a flight, a ship), the observer is placed on
+the track at every sample time of the geocentric positions so the circumstances are those seen from the moving
+position, before the first and after the last time stamp the observer waits at the end of the track
+
+    result = track_circumstances(canon['2024-Apr-08'], [('2024-04-08T17:30:00Z', 25.0, -108.0, 11000),
+                                                        ('2024-04-08T19:00:00Z', 33.0, -95.0, 11000)])
+    result['duration'], result['c2']['lat'], result['central_intervals']
+'''
+import argparse
+import json
+
+import numpy as np
+import pandas as pd
+
+from circumstances.path import bearing, destination, great_circle_km
+from circumstances.skyfieldcalcs import CONTACTS, PRECISION_TIERS, contacts_to_dict, eclipse_positions, \
+    local_altaz, local_contacts, local_geometry, obscuration, site_xyz
+from circumstances.utils import greatest_eclipse_tt, signed_utc_iso, ts, utc_iso_to_tt
+
+
+
+def densify(lats, lons, spacing_km=1.0, eles=0):
+    '''
+    sample points along a polyline every spacing_km or less, along great circles between waypoints, the
+    waypoints themselves are always sample points
+    :param eles: elevation(s) in meters of the waypoints, interpolated along each leg
+    :return: latitudes, longitudes, elevations and distances in km from the start of the route
+    '''
+    lats, lons, eles = [np.asarray(x, dtype=float) for x in np.broadcast_arrays(np.atleast_1d(lats),
+                                                                                np.atleast_1d(lons),
+                                                                                np.atleast_1d(eles))]
+    legs = great_circle_km(lats[:-1], lons[:-1], lats[1:], lons[1:])
+    counts = np.maximum(np.ceil(legs / spacing_km).astype(int), 1)
+    leg = np.repeat(np.arange(len(legs)), counts)  # leg of every sample point but the last waypoint
+    fraction = np.arange(len(leg)) - np.repeat(np.cumsum(counts) - counts, counts)
+    fraction = fraction / counts[leg]
+    azimuth = bearing(lats[leg], lons[leg], lats[leg + 1], lons[leg + 1])
+    lat, lon = destination(lats[leg], lons[leg], azimuth, fraction * legs[leg])
+    ele = eles[leg] + fraction * (eles[leg + 1] - eles[leg])
+    distance = np.concatenate([[0], np.cumsum(legs)])[leg] + fraction * legs[leg]
+    return (np.append(lat, lats[-1]), np.append(lon, lons[-1]), np.append(ele, eles[-1]),
+            np.append(distance, legs.sum()))
+
+
+def route_circumstances(ge, waypoints, spacing_km=1.0, ele=0, engine='ephemeris', precision='standard', eph=None,
+                        geo=None, min_sun_alt=None):
+    '''
+    local circumstances at points along a route, in one pass of local_contacts
+    :param ge: entry from get_canon_Espenak, or TT julian date of greatest eclipse
+    :param waypoints: sequence of (lat, lon) or (lat, lon, ele)
+    :param spacing_km: greatest distance between sample points
+    :param ele: elevation in meters of waypoints without one
+    :param geo: geocentric positions spanning the eclipse (default, from engine)
+    :param min_sun_alt: degrees, points where the Sun is lower at maximum eclipse can't be the best point
+    :return: dictionary of
+        points: arrays of lat, lon, ele, distance_km along the route and the local_contacts of every point
+        best: the point with the longest central phase, or the greatest obscuration when no point on the route is
+              in the path, as contacts_to_dict with lat, lon, ele, distance_km and index (into points) added,
+              None when the eclipse is not seen anywhere on the route
+    '''
+    tt = greatest_eclipse_tt(ge) if isinstance(ge, dict) else ge
+    tier = PRECISION_TIERS[precision] if isinstance(precision, str) else precision
+    waypoints = [tuple(w) + (ele,) * (3 - len(w)) for w in waypoints]
+    lats, lons, eles = [np.array(x, dtype=float) for x in zip(*waypoints)]
+    lat, lon, ele, distance = densify(lats, lons, spacing_km=spacing_km, eles=eles)
+    if geo is None:
+        geo = eclipse_positions(tt, engine=engine, precision=precision, eph=eph)
+    points = local_contacts(geo, lat, lon, ele, coarse=tier['coarse'])
+    points.update({'lat': lat, 'lon': lon, 'ele': ele, 'distance_km': distance})
+    return {'points': points, 'best': best_point(points, min_sun_alt=min_sun_alt)}
+
+
+def best_point(points, min_sun_alt=None):
+    '''
+    the point of local_contacts arrays with the longest central phase, then the greatest obscuration
+    :param points: dict of arrays from local_contacts, with lat, lon and, when present, ele and distance_km
+    :param min_sun_alt: degrees, points where the Sun is lower at maximum eclipse are passed over
+    :return: contacts_to_dict of the point with index and its position, None when none sees the eclipse
+    '''
+    ranked = rank_points(points, min_sun_alt=min_sun_alt)
+    if len(ranked) == 0:
+        return None
+    n = ranked[0]
+    best = contacts_to_dict(points, n)
+    best['index'] = int(n)
+    for attr in ['lat', 'lon', 'ele', 'distance_km']:
+        if attr in points:
+            best[attr] = float(points[attr][n])
+    return best
+
+
+def rank_points(points, min_sun_alt=None):
+    '''
+    indexes of the points of local_contacts arrays that see the eclipse, best first, by the duration of the
+    central phase then obscuration
+    :param min_sun_alt: degrees, points where the Sun is lower at maximum eclipse are left out
+    '''
+    seen = points['type'] != ''
+    if min_sun_alt is not None:
+        seen &= points['mid_sun_alt'] >= min_sun_alt
+    candidates = np.flatnonzero(seen)
+    return candidates[np.lexsort((-points['obscuration'][candidates], -points['duration'][candidates]))]
+
+
+def track_position(tt, times, lats, lons, eles=0):
+    '''
+    position of an observer following a track, along great circles between waypoints at constant speed
+    :param tt: TT julian dates to place the observer at
+    :param times: TT julian dates of the waypoints, ascending
+    :return: latitudes, longitudes and elevations at tt, the ends of the track outside its times
+    '''
+    times, lats, lons, eles = [np.asarray(x, dtype=float) for x in np.broadcast_arrays(times, lats, lons, eles)]
+    tt = np.clip(np.asarray(tt, dtype=float), times[0], times[-1])
+    leg = np.clip(np.searchsorted(times, tt, side='right') - 1, 0, len(times) - 2)
+    span = times[leg + 1] - times[leg]
+    fraction = np.where(span > 0, (tt - times[leg]) / np.where(span > 0, span, 1), 0)
+    azimuth = bearing(lats[leg], lons[leg], lats[leg + 1], lons[leg + 1])
+    legs = great_circle_km(lats[leg], lons[leg], lats[leg + 1], lons[leg + 1])
+    lat, lon = destination(lats[leg], lons[leg], azimuth, fraction * legs)
+    return lat, lon, eles[leg] + fraction * (eles[leg + 1] - eles[leg])
+
+
+def track_circumstances(ge, track, ele=0, engine='ephemeris', precision='standard', eph=None, geo=None):
+    '''
+    circumstances seen by an observer moving along a time-stamped track
+    :param ge: entry from get_canon_Espenak, or TT julian date of greatest eclipse
+    :param track: sequence of (time, lat, lon) or (time, lat, lon, ele), times as TT julian dates or UTC ISO time
+                  stamps, ascending
+    :param ele: elevation in meters of waypoints without one
+    :param geo: geocentric positions spanning the eclipse (default, from engine)
+    :return: dictionary as contacts_to_dict, contacts with the lat, lon and ele of the observer at the time,
+             duration is the total time in the central phase and central_intervals the (C2, C3) TT julian dates of
+             each time the observer is in it, None when the eclipse is not seen from the track
+    '''
+    tt = greatest_eclipse_tt(ge) if isinstance(ge, dict) else ge
+    track = [tuple(w) + (ele,) * (4 - len(w)) for w in track]
+    times = np.array([utc_iso_to_tt(w[0]) if isinstance(w[0], str) else w[0] for w in track], dtype=float)
+    if np.any(np.diff(times) < 0):
+        raise ValueError("track times must be ascending")
+    lats, lons, eles = [np.array(x, dtype=float) for x in list(zip(*track))[1:]]
+    if geo is None:
+        geo = eclipse_positions(tt, engine=engine, precision=precision, eph=eph)
+
+    lat, lon, ele = track_position(geo['tt'], times, lats, lons, eles)
+    xyz = site_xyz(lat, lon, ele)
+    separation, sun_r, moon_r = local_geometry(geo['sun'], geo['moon'], xyz)  # moving observer, (3,T) with (3,T)
+    partial = _intervals(geo['tt'], separation - (sun_r + moon_r))
+    if len(partial) == 0:
+        return None
+    central = _intervals(geo['tt'], separation - np.abs(sun_r - moon_r))
+    j = int(np.argmin(separation))
+    mid = geo['tt'][j]
+    if 0 < j < len(separation) - 1:
+        y0, y1, y2 = separation[j - 1:j + 2]
+        curvature = y0 - 2 * y1 + y2
+        if curvature > 0:
+            mid += 0.5 * (y0 - y2) / curvature * geo['step'] / 86400
+    sr, mr = sun_r[j], moon_r[j]
+    circumstances = {'type': ('T' if mr > sr else 'A') if central else 'P',
+                     'obscuration': float(obscuration(separation[j], sr, mr)),
+                     'magnitude': float((sr + mr - separation[j]) / (2 * sr)),
+                     'ratio': float(mr / sr),
+                     'duration': float(sum(c3 - c2 for c2, c3 in central) * 86400),
+                     'central_intervals': central}
+    contacts = {'c1': partial[0][0], 'c2': central[0][0] if central else None, 'mid': mid,
+                'c3': central[-1][1] if central else None, 'c4': partial[-1][1]}
+    for attr in CONTACTS:
+        when = contacts[attr]
+        if when is None:
+            circumstances[attr] = None
+            continue
+        at_lat, at_lon, at_ele = track_position(when, times, lats, lons, eles)
+        n = int(np.clip(np.rint((when - geo['tt'][0]) * 86400 / geo['step']), 0, len(geo['tt']) - 1))
+        alt, az = local_altaz(geo['sun'][:, n] - site_xyz(at_lat, at_lon, at_ele)[:, 0], at_lat, at_lon)
+        circumstances[attr] = {'tt': float(when), 'utc_iso': signed_utc_iso(ts.tt_jd(when)),
+                               'sun_alt': float(alt), 'sun_az': float(az),
+                               'lat': float(at_lat), 'lon': float(at_lon), 'ele': float(at_ele)}
+    return circumstances
+
+
+def _intervals(tt, g):
+    '''
+    (start, end) TT julian dates of the spans where g < 0, ends interpolated between samples
+    '''
+    inside = np.concatenate([[False], g < 0, [False]])
+    edges = np.flatnonzero(np.diff(inside.astype(int)))
+    intervals = []
+    for start, end in zip(edges[::2], edges[1::2]):  # samples start..end-1 are inside
+        t0 = tt[start] if start == 0 else _zero(tt, g, start - 1)
+        t1 = tt[end - 1] if end == len(g) else _zero(tt, g, end - 1)
+        intervals.append((float(t0), float(t1)))
+    return intervals
+
+
+def _zero(tt, g, n):
+    return tt[n] + (tt[n + 1] - tt[n]) * g[n] / (g[n] - g[n + 1])
+
+
+def read_route(filename):
+    '''
+    waypoints from a CSV file with lat, lon and optionally ele columns, and a time column (UTC ISO or TT julian
+    date) for a track
+    :return: list of waypoints, True when it is a track
+    '''
+    df = pd.read_csv(filename)
+    columns = (['time'] if 'time' in df.columns else []) + ['lat', 'lon'] + (['ele'] if 'ele' in df.columns else [])
+    return [tuple(row) for row in df[columns].itertuples(index=False)], 'time' in df.columns
+
+
+def main(argv=None):
+    from circumstances.circumstances import get_canon_Espenak
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('eclipse', help='canon date (UT1), ex. 2024-Apr-08')
+    parser.add_argument('route', help='CSV file of lat, lon, [ele] waypoints, with a time column for a track')
+    parser.add_argument('--spacing', type=float, default=1.0, help='km between sample points of a route')
+    parser.add_argument('--ele', type=float, default=0)
+    parser.add_argument('--min-sun-alt', type=float)
+    parser.add_argument('--engine', default='ephemeris', choices=['ephemeris', 'analytic'])
+    args = parser.parse_args(argv)
+    canon, otherdates = get_canon_Espenak()
+    ge = canon[args.eclipse] if args.eclipse in canon else canon[otherdates[args.eclipse]]
+    waypoints, is_track = read_route(args.route)
+    if is_track:
+        print(json.dumps(track_circumstances(ge, waypoints, ele=args.ele, engine=args.engine), indent=2))
+        return
+    result = route_circumstances(ge, waypoints, spacing_km=args.spacing, ele=args.ele, engine=args.engine,
+                                 min_sun_alt=args.min_sun_alt)
+    print(json.dumps(result['best'], indent=2))
+
+
+if __name__ == '__main__':
+    main()
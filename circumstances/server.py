@@ -0,0 +1,375 @@
+'''
+asyncio HTTP/JSON service for local circumstances, keeping the canon, ephemerides, timezone finder and the
+geocentric positions of recent eclipses warm in a pool of workers
+
+    python -m circumstances.server --port 8080 --workers 4
+
+    GET  /circumstances?lat=32.78&lon=-96.80&ele=150&eclipse=+2024-04-08
+    POST /batch          {"eclipse": "+2024-04-08", "sites": [{"lat": 32.78, "lon": -96.80, "ele": 150}, ...]}
+    GET  /next?lat=32.78&lon=-96.80&date=+2024-01-01&type=T
+    GET  /previous?lat=32.78&lon=-96.80&date=+2024-01-01
+    GET  /best_site?lat=35.0&lon=-98.0&eclipse=+2024-04-08&radius=250&min_sun_alt=20
+    GET  /health
+    GET  /metrics        Prometheus text from circumstances.metrics (of the server process, and the workers when
+                         they are threads)
+
+request bodies over --max-body bytes and batches of more than --max-batch sites are answered 413
+
+elevation defaults to 0 rather than being looked up, eclipses are given by canon id (+20240408) or date
+(+2024-04-08), and responses are the dictionaries of contacts_to_dict plus the timezone and local times
+'''
+import argparse
+import asyncio
+import functools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from circumstances import metrics
+from circumstances.skyfieldcalcs import CONTACTS, PRECISION_TIERS, contacts_to_dict, eclipse_possible, eclipse_window, \
+    geocentric_positions, local_contacts
+from circumstances.utils import greatest_eclipse_tt, json_safe, load_ephemeris, set_offline, ts, utc_iso_to_tt
+
+STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+          500: 'Internal Server Error'}
+MAX_BODY = 1 << 20  # bytes of a request body
+MAX_BATCH = 10000  # sites in one /batch
+
+_service = None  # circumstances_service of this worker process, or of the server process when workers are threads
+
+
+class circumstances_service(object):
+    '''
+    the state a worker keeps between requests and the computations behind each endpoint
+    '''
+
+    def __init__(self, canon=None, precision='standard', engine='ephemeris', snapshots='caches/snapshots',
+                 window_hours=4, geo_cache=16, search_limit=400):
+        '''
+        :param canon: dictionary from get_canon_Espenak (default, loaded from its cache)
+        :param precision: key of PRECISION_TIERS
+        :param engine: 'ephemeris' for JPL positions, 'analytic' for the analytic theory (no kernel needed)
+        :param snapshots: directory of saved snapshots (circumstances.snapshot), used in place of the ephemeris
+                          for eclipses that have one
+        :param geo_cache: eclipses whose geocentric positions are kept
+        :param search_limit: eclipses in the canon examined by next and previous before giving up
+        '''
+        if canon is None:
+            from circumstances.circumstances import get_canon_Espenak
+            canon, otherdates = get_canon_Espenak()
+        self.tier = PRECISION_TIERS[precision]
+        self.engine = engine
+        self.snapshots = snapshots
+        self.window_hours = window_hours
+        self.search_limit = search_limit
+        self.canon = {canondata['id']: canondata for canondata in canon.values()}
+        self.order = sorted(self.canon, key=lambda eclipseid: greatest_eclipse_tt(self.canon[eclipseid]))
+        self.tt = np.array([greatest_eclipse_tt(self.canon[eclipseid]) for eclipseid in self.order])
+        self.kernels = {}
+        self.geo = functools.lru_cache(maxsize=geo_cache)(self._geo)
+        self.coarse = functools.lru_cache(maxsize=1024)(self._coarse)
+
+    def eclipse(self, name):
+        '''
+        canon entry for an id (+20240408) or date (+2024-04-08, 2024-04-08)
+        '''
+        name = name.strip()
+        eclipseid = ('-' if name.startswith('-') else '+') + name.lstrip('+-').replace('-', '')
+        if eclipseid not in self.canon:
+            raise KeyError(f"no eclipse {name} in the canon")
+        return self.canon[eclipseid]
+
+    def _ephemeris(self, eclipseid, tt):
+        prefix = os.path.join(self.snapshots, f"{eclipseid[:5]}-{eclipseid[5:7]}-{eclipseid[7:9]}")
+        if os.path.exists(f"{prefix}.json"):
+            from circumstances.snapshot import load_snapshot
+            return load_snapshot(prefix)
+        year = ts.tt_jd(tt).tt_calendar()[0]
+        kernel = self.tier['kernel']
+        if (year, kernel) not in self.kernels:
+            self.kernels[(year, kernel)] = load_ephemeris(year, kernel=kernel)
+        return self.kernels[(year, kernel)]
+
+    def _geo(self, eclipseid):
+        tt = greatest_eclipse_tt(self.canon[eclipseid])
+        t = eclipse_window(tt, hours=self.window_hours, step=self.tier['step'])
+        if self.engine == 'analytic':
+            from circumstances.analytic import analytic_positions
+            return analytic_positions(t)
+        return geocentric_positions(t, self._ephemeris(eclipseid, tt), corrections=self.tier['corrections'])
+
+    def sites(self, name, lat, lon, ele=0):
+        '''
+        circumstances of one eclipse for sites given as sequences of lat, lon and ele
+        :return: list of dictionaries, one per site
+        '''
+        canondata = self.eclipse(name)
+        with metrics.stage('service', endpoint='sites'):
+            result = local_contacts(self.geo(canondata['id']), lat, lon, ele,
+                                    coarse=self.tier['coarse'])
+        lat, lon = np.broadcast_arrays(np.atleast_1d(lat), np.atleast_1d(lon))
+        return [self._localize(contacts_to_dict(result, n), canondata, lat[n], lon[n]) for n in range(len(lat))]
+
+    def search(self, lat, lon, ele=0, date=None, eclipsetype=None, direction=1):
+        '''
+        the next (direction 1) or previous (direction -1) eclipse seen from a site, of a local type when given
+        ('P', 'A' or 'T'), each candidate is screened against positions every 10 minutes before it is computed
+        :param date: signed ISO date to search from (default, now)
+        :return: dictionary as from sites, None when nothing is found within search_limit eclipses
+        '''
+        if date is None:
+            tt = ts.now().tt
+        else:
+            tt = utc_iso_to_tt(date if 'T' in date else f"{date}T00:00:00Z")
+        start = int(np.searchsorted(self.tt, tt))
+        candidates = range(start, min(start + self.search_limit, len(self.order))) if direction > 0 else \
+            range(start - 1, max(start - 1 - self.search_limit, -1), -1)
+        for index in candidates:
+            eclipsett = self.tt[index]
+            if not eclipse_possible(self.coarse(eclipsett), lat, lon, ele)[0]:
+                continue
+            found = self.sites(self.order[index], lat, lon, ele)[0]
+            if found['type'] and (eclipsetype is None or found['type'] == eclipsetype):
+                return found
+        return None
+
+    def best_site(self, name, lat, lon, ele=0, radius_km=100, min_sun_alt=None):
+        '''
+        the site within radius_km of a home site with the longest central phase, or greatest obscuration, from
+        circumstances.optimize
+        :return: dictionary of best (as from sites, None when the eclipse isn't seen within reach), home, profile (of
+                 lists) and evaluations
+        '''
+        from circumstances.optimize import best_site
+        canondata = self.eclipse(name)
+        with metrics.stage('service', endpoint='best_site'):
+            result = best_site(canondata, lat, lon, radius_km=radius_km, ele=ele, min_sun_alt=min_sun_alt,
+                               precision=self.tier, geo=self.geo(canondata['id']))
+        if result['best'] is not None:
+            result['best'] = self._localize(result['best'], canondata, result['best']['lat'], result['best']['lon'])
+        if result['profile'] is not None:
+            result['profile'] = {k: v.tolist() for k, v in result['profile'].items()}
+        return result
+
+    def _coarse(self, tt):
+        from circumstances.analytic import analytic_positions
+        t = eclipse_window(tt, hours=self.window_hours, step=600)
+        return analytic_positions(t)  # the pre-filter's margins are far wider than the error of the theory
+
+    def _localize(self, circumstances, canondata, lat, lon):
+        from circumstances.circumstances import process_local_circ_times, timezone_at
+        timezone = timezone_at(float(lat), float(lon))
+        circumstances.update({'eclipse': canondata['id'], 'eclipse_type': canondata['eclipse_type'],
+                              'lat': float(lat), 'lon': float(lon), 'timezone': timezone})
+        label = None
+        for circ in CONTACTS:
+            if circumstances[circ] is not None and timezone is not None:
+                label = process_local_circ_times(circ, label, circumstances, float(lon), timezone)
+        return circumstances
+
+
+def _service_init(kwargs):
+    global _service
+    _service = circumstances_service(**kwargs)
+
+
+def _call(method, *args, **kwargs):
+    return json_safe(getattr(_service, method)(*args, **kwargs))
+
+
+class circumstances_server(object):
+    '''
+    parses HTTP/1.1 requests on asyncio streams and hands the work to the executor
+    '''
+
+    def __init__(self, executor, max_body=MAX_BODY, max_batch=MAX_BATCH):
+        '''
+        :param max_body: largest request body in bytes, longer ones are refused unread
+        :param max_batch: most sites in one /batch
+        '''
+        self.executor = executor
+        self.max_body = max_body
+        self.max_batch = max_batch
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except request_too_large as e:
+                    # the body is left unread, so the connection can't carry another request
+                    self._write(writer, 413, {'error': str(e)}, 'application/json', False)
+                    await writer.drain()
+                    break
+                except ValueError as e:
+                    # a malformed request line or header, nothing after it on the connection can be trusted
+                    self._write(writer, 400, {'error': f"malformed request, {e}"}, 'application/json', False)
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                method, target, headers, body = request
+                with metrics.stage('service', endpoint='request'):
+                    status, payload, content_type = await self.route(method, target, body)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                self._write(writer, status, payload, content_type, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        method, target, version = line.decode('latin-1').split()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, value = line.decode('latin-1').split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0))
+        if length > self.max_body:
+            raise request_too_large(f"request body of {length} bytes, the limit is {self.max_body}")
+        body = await reader.readexactly(length) if length > 0 else b''
+        return method, target, headers, body
+
+    def _write(self, writer, status, payload, content_type, keep_alive):
+        if content_type == 'application/json':
+            payload = json.dumps(payload)
+        body = payload.encode('utf-8')
+        head = [f"HTTP/1.1 {status} {STATUS[status]}",
+                f"Content-Type: {content_type}",
+                f"Content-Length: {len(body)}",
+                f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+
+    async def route(self, method, target, body):
+        '''
+        :return: status, payload, content type
+        '''
+        url = urlsplit(target)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        loop = asyncio.get_running_loop()
+        try:
+            if url.path == '/health':
+                return 200, {'status': 'ok'}, 'application/json'
+            if url.path == '/metrics':
+                return 200, metrics.prometheus_text(), 'text/plain; version=0.0.4'
+            if url.path == '/circumstances' and method == 'GET':
+                lat, lon, ele = _site(query)
+                result = await loop.run_in_executor(self.executor, _call, 'sites', query['eclipse'], lat, lon, ele)
+                return 200, result[0], 'application/json'
+            if url.path == '/batch' and method == 'POST':
+                request = json.loads(body)
+                if len(request['sites']) > self.max_batch:
+                    error = f"{len(request['sites'])} sites in a batch, the limit is {self.max_batch}"
+                    return 413, {'error': error}, 'application/json'
+                lat, lon, ele = zip(*[_site(site) for site in request['sites']])
+                result = await loop.run_in_executor(self.executor, _call, 'sites', request['eclipse'], list(lat),
+                                                    list(lon), list(ele))
+                return 200, result, 'application/json'
+            if url.path in ['/next', '/previous'] and method == 'GET':
+                lat, lon, ele = _site(query)
+                direction = 1 if url.path == '/next' else -1
+                result = await loop.run_in_executor(self.executor, functools.partial(
+                    _call, 'search', lat, lon, ele, date=query.get('date'), eclipsetype=query.get('type'),
+                    direction=direction))
+                return 200, result, 'application/json'
+            if url.path == '/best_site' and method == 'GET':
+                lat, lon, ele = _site(query)
+                min_sun_alt = float(query['min_sun_alt']) if 'min_sun_alt' in query else None
+                result = await loop.run_in_executor(self.executor, functools.partial(
+                    _call, 'best_site', query['eclipse'], lat, lon, ele, radius_km=float(query.get('radius', 100)),
+                    min_sun_alt=min_sun_alt))
+                return 200, result, 'application/json'
+            if url.path in ['/circumstances', '/batch', '/next', '/previous', '/best_site']:
+                return 405, {'error': f"{method} not allowed on {url.path}"}, 'application/json'
+            return 404, {'error': f"no endpoint {url.path}"}, 'application/json'
+        except KeyError as e:
+            status = 404 if 'canon' in str(e) else 400
+            return status, {'error': str(e).strip('"\'')}, 'application/json'
+        except (ValueError, TypeError) as e:
+            return 400, {'error': str(e)}, 'application/json'
+        except Exception as e:
+            print(f"error serving {target}, {e}")
+            return 500, {'error': str(e)}, 'application/json'
+
+
+class request_too_large(ValueError):
+    '''
+    a request body over the server's max_body
+    '''
+
+
+def _site(params):
+    return float(params['lat']), float(params['lon']), float(params.get('ele', 0))
+
+
+def make_executor(workers=None, threads=False, **kwargs):
+    '''
+    worker pool with a warm circumstances_service in each worker
+    :param threads: use threads sharing one service in this process instead of processes
+    :param kwargs: passed to circumstances_service
+    '''
+    if threads:
+        _service_init(kwargs)
+        return ThreadPoolExecutor(max_workers=workers)
+    return ProcessPoolExecutor(max_workers=workers, initializer=_service_init, initargs=(kwargs,))
+
+
+async def serve(host='127.0.0.1', port=8080, executor=None, max_body=MAX_BODY, max_batch=MAX_BATCH, **kwargs):
+    '''
+    runs the service until cancelled
+    :param executor: worker pool from make_executor (default, one made with kwargs)
+    :param max_body: largest request body in bytes
+    :param max_batch: most sites in one /batch
+    '''
+    if executor is None:
+        executor = make_executor(**kwargs)
+    handler = circumstances_server(executor, max_body=max_body, max_batch=max_batch).handle
+    server = await asyncio.start_server(handler, host, port)
+    print(f"serving circumstances on {', '.join(str(s.getsockname()) for s in server.sockets)}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        executor.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, help='size of the worker pool (default, number of CPUs)')
+    parser.add_argument('--threads', action='store_true', help='workers are threads rather than processes')
+    parser.add_argument('--precision', default='standard', choices=list(PRECISION_TIERS))
+    parser.add_argument('--engine', default='ephemeris', choices=['ephemeris', 'analytic'])
+    parser.add_argument('--snapshots', default='caches/snapshots', help='directory of eclipse snapshots')
+    parser.add_argument('--max-body', type=int, default=MAX_BODY, help='largest request body in bytes')
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH, help='most sites in one /batch')
+    parser.add_argument('--metrics', action='store_true', help='collect circumstances.metrics for /metrics')
+    parser.add_argument('--offline', action='store_true',
+                        help='strict offline mode, fail on anything not cached instead of fetching it')
+    args = parser.parse_args(argv)
+    if args.offline:
+        set_offline()
+    if args.metrics:
+        metrics.enable()
+    try:
+        asyncio.run(serve(args.host, args.port, max_body=args.max_body, max_batch=args.max_batch, workers=args.workers,
+                          threads=args.threads, precision=args.precision, engine=args.engine, snapshots=args.snapshots))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,34 @@
+import math
+import threading
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+from numpy import arcsin
+from skyfield.api import Topos, wgs84
+from skyfield.framelib import itrs
+
+from circumstances import metrics
+from circumstances.utils import MOON_RADIUS_KM, SUN_RADIUS_KM, greatest_eclipse_tt, load_ephemeris, signed_utc_iso, \
+    ts
+
+ECLIPSE_TYPE_CODES = {'': 0, 'P': 1, 'A': 2, 'T': 3}
+# upper bounds used to keep the visibility pre-filter conservative between samples
+MAX_SEPARATION_RATE = 1.2 / 3600  # degrees per second, Moon relative to the Sun including the observer's rotation
+MAX_SUN_ALTITUDE_RATE = 15.1 / 3600  # degrees per second
+HORIZON_DEGREES = -0.833  # refraction and semi-diameter at sunrise and sunset
+CONTACTS = ['c1', 'c2', 'mid', 'c3', 'c4']
+# named trade-offs between speed and accuracy for local_circumstances
+#   step: fine grid in seconds, contacts are interpolated on it
+#   coarse: bracketing grid in seconds
+#   corrections: 'geometric' (no light-time or aberration), 'astrometric' (light-time) or 'apparent' (light-time,
+#                deflection and aberration)
+#   kernel: JPL kernel to prefer, None for the default for the year (see load_ephemeris)
+PRECISION_TIERS = {'fast': {'step': 10, 'coarse': 300, 'corrections': 'geometric', 'kernel': None},
+                   'standard': {'step': 1, 'coarse': 60, 'corrections': 'apparent', 'kernel': None},
+                   'precise': {'step': 0.25, 'coarse': 60, 'corrections': 'apparent', 'kernel': 'de440.bsp'}}
+
+
 
 def eclipse_fraction(s, body1, body2):
     '''
@@ -43,7 +74,7 @@ def alt_az_dist(df, body, label):
     df[f'{label}_dist'] = distance.km
 
 
-def circumstances(start, lat, lon, ele=100, end=None, tzstring=None, eph=None):
+def circumstances(start, lat, lon, ele=100, end=None, tzstring=None, eph=None, analytic_scan=False, margin=600):
     '''
     Calculates local circumstances of an eclipse returning datetimes (UTC) for partial
     eclipse contact points (c1 and c4), the moment of maxium eclipse, along with contact
@@ -57,6 +88,11 @@ def circumstances(start, lat, lon, ele=100, end=None, tzstring=None, eph=None):
     :param ele: elevation in meters (int)
     :param end: date and time to end search (datetime, default None)
     :param tzstring: converts UTC to local for all datetimes (optional, example 'US/Eastern')
+    :param analytic_scan: find roughly where C1 and C4 are with the analytic theory (circumstances.analytic) and
+                          only evaluate the ephemeris from margin seconds before C1 to margin seconds after C4,
+                          otherwise scan the 2 days at minute resolution with the ephemeris first (default).
+                          A day the theory rules out returns without loading a kernel
+    :param margin: seconds either side of the analytic C1 and C4 evaluated with the ephemeris
     :return: for each of the 5 circumstances, a pandas series is returned:
         a da
 
@@ -74,9 +110,21 @@ def circumstances(start, lat, lon, ele=100, end=None, tzstring=None, eph=None):
     hour = int(start.utc_strftime('%-H'))
     minute = int(start.utc_strftime('%-M'))
     second = int(start.utc_strftime('%-S'))
+    if end is None and analytic_scan:
+        from circumstances.analytic import analytic_positions, eclipse_span
+        scan = analytic_positions(ts.utc(year, month, day, 12, range(-1440, 1441)))
+        first, last = eclipse_span(scan, lat, lon, ele)
+        if np.isnan(first[0]):
+            return None, None, None, None, None
+        return circumstances(ts.tt_jd(first[0] - margin / 86400), lat, lon, ele=ele,
+                             end=ts.tt_jd(last[0] + margin / 86400), eph=eph)
     if eph is None:
         eph = load_ephemeris(year)
     if end is None:
+        # rule out the day cheaply before evaluating every minute of it
+        coarse = geocentric_positions(ts.utc(year, month, day, 12, range(-1440, 1441, 10)), eph)
+        if not eclipse_possible(coarse, lat, lon, ele, require_sun_up=False)[0]:
+            return None, None, None, None, None
         # all we have is a day, so let look across all minutes across a
         # 2 day span centered on noon UTC on the day passed
         time = ts.utc(year, month, day, 12, range(-1440, 1440))
@@ -87,6 +135,122 @@ def circumstances(start, lat, lon, ele=100, end=None, tzstring=None, eph=None):
         endsec = int(second + 60 + timespan_sec)  # 1 minute after C4
         time = ts.utc(year, month, day, hour, minute, range(startsec, endsec))
 
+    c1, c2, mid_eclipse, c3, c4 = _contact_rows(time, lat, lon, ele, eph)
+
+    if end is None and c1 is not None:
+        # repeat at second resolution from C1 to C4
+        c1, c2, mid_eclipse, c3, c4 = circumstances(c1.tt, lat, lon, ele=ele, end=c4.tt, eph=eph)  # refine at higher resolution
+    return c1, c2, mid_eclipse, c3, c4
+
+
+class progressive_result(object):
+    '''
+    contacts from progressive_circumstances, at minute resolution at first and then refined
+        contacts: c1, c2, mid, c3, c4 rows as from circumstances, None where a contact does not occur
+        precision: seconds, the resolution of the pass the contacts came from (None when there is no eclipse)
+        stage: 'none' when there is no eclipse, 'coarse' or 'refined'
+        elapsed: seconds from the call to when the contacts were ready
+        future: concurrent.futures.Future of the refined progressive_result while refinement is under way
+    '''
+
+    def __init__(self, contacts, precision, stage, started, future=None):
+        self.contacts = contacts
+        self.precision = precision
+        self.stage = stage
+        self.elapsed = perf_counter() - started
+        self.future = future
+
+    def refined(self, timeout=None):
+        '''
+        the refined result, waiting up to timeout seconds for it (default, as long as it takes)
+        '''
+        if self.future is None:
+            return self
+        return self.future.result(timeout=timeout)
+
+
+_refine_executor = None  # threads progressive_circumstances refines on, started on first use
+_refine_executor_lock = threading.Lock()
+
+
+def progressive_circumstances(start, lat, lon, ele=100, budget=0.05, eph=None, callback=None, margin=600,
+                              coarse_step=60, executor=None):
+    '''
+    circumstances for interactive use: contacts from a minute pass around the eclipse are ready first, the second
+    by second pass that circumstances() always makes is started on a thread, and whichever is ready when the
+    budget runs out is returned. When that is the minute pass, the refined contacts follow through the future on
+    the result, or the callback
+
+        r = progressive_circumstances(start, lat, lon, budget=0.05)
+        show(r.contacts, r.precision)
+        if r.stage == 'coarse':
+            show(r.refined().contacts, 1)
+
+    :param start: skyfield Time on the day of the eclipse, as for circumstances
+    :param budget: seconds to wait for the refined contacts before returning the minute pass
+    :param callback: called with the refined progressive_result when it is ready, whether or not that was
+                     within the budget, not called when there is no eclipse
+    :param margin: seconds either side of the analytic C1 and C4 covered by the minute pass
+    :param coarse_step: seconds between samples of the first pass
+    :param executor: where to refine (default, a shared thread pool)
+    :return: progressive_result
+    '''
+    from concurrent.futures import TimeoutError
+    from circumstances.analytic import analytic_positions, eclipse_span
+    started = perf_counter()
+    year, month, day = [int(x) for x in start.utc_strftime('%Y %m %d').split()]
+    scan = analytic_positions(ts.utc(year, month, day, 12, range(-1440, 1441)))
+    first, last = eclipse_span(scan, lat, lon, ele)
+    if np.isnan(first[0]):
+        return progressive_result((None, None, None, None, None), None, 'none', started)
+    if eph is None:
+        eph = load_ephemeris(year)
+    with metrics.stage('progressive', step='coarse'):
+        grid = ts.tt_jd(np.arange(first[0] - margin / 86400, last[0] + margin / 86400, coarse_step / 86400))
+        contacts = _contact_rows(grid, lat, lon, ele, eph)
+    if contacts[0] is None:
+        return progressive_result(contacts, None, 'none', started)
+
+    if executor is None:
+        executor = refine_executor()
+    future = executor.submit(_refine_contacts, contacts, lat, lon, ele, eph, started)
+    if callback is not None:
+        future.add_done_callback(lambda f: _deliver(f, callback))
+    try:
+        return future.result(timeout=max(budget - (perf_counter() - started), 0))
+    except TimeoutError:
+        return progressive_result(contacts, coarse_step, 'coarse', started, future=future)
+
+
+def refine_executor():
+    '''
+    the thread pool progressive_circumstances refines on, one per process however many threads ask for it first
+    '''
+    global _refine_executor
+    from concurrent.futures import ThreadPoolExecutor
+    with _refine_executor_lock:
+        if _refine_executor is None:
+            _refine_executor = ThreadPoolExecutor(max_workers=4)
+    return _refine_executor
+
+
+def _refine_contacts(contacts, lat, lon, ele, eph, started):
+    with metrics.stage('progressive', step='refine'):
+        refined = circumstances(contacts[0].tt, lat, lon, ele=ele, end=contacts[-1].tt, eph=eph)
+    return progressive_result(refined, 1, 'refined', started)
+
+
+def _deliver(future, callback):
+    try:
+        callback(future.result())
+    except Exception as e:
+        print(f"error delivering refined circumstances, {e}")
+
+
+def _contact_rows(time, lat, lon, ele, eph):
+    '''
+    topocentric separation and eclipse fraction at each time, reduced to the rows for each contact by contact_points
+    '''
     # build data frame from those times
     df = pd.DataFrame({
         'ordinal': time.toordinal(),  # needed really only for testing against other calculations
@@ -98,8 +262,9 @@ def circumstances(start, lat, lon, ele=100, end=None, tzstring=None, eph=None):
     place = eph['earth'] + Topos(lat, lon, elevation_m=ele)
 
     # get position of Moon and Sun at each time
-    moon = place.at(time).observe(eph['moon']).apparent()
-    sun = place.at(time).observe(eph['sun']).apparent()
+    with metrics.stage('ephemeris', step='topocentric'):
+        moon = place.at(time).observe(eph['moon']).apparent()
+        sun = place.at(time).observe(eph['sun']).apparent()
 
     # add a column for angular separation of the Moon and Sun
     df['separation'] = moon.separation_from(sun).degrees
@@ -116,10 +281,6 @@ def circumstances(start, lat, lon, ele=100, end=None, tzstring=None, eph=None):
 
     # now we can find when the partial (and if applicable total or annular) eclipses begin and end as well as the midpoint
     c1, c2, mid_eclipse, c3, c4 = contact_points(df)
-
-    if end is None and c1 is not None:
-        # repeat at second resolution from C1 to C4
-        c1, c2, mid_eclipse, c3, c4 = circumstances(c1.tt, lat, lon, end=c4.tt, eph=eph)  # refine at higher resolution
     return c1, c2, mid_eclipse, c3, c4
 
 
@@ -149,3 +310,353 @@ def contact_points(df):
 
     return c1, c2, mid_eclipse, c3, c4
 
+
+def obscuration(s, sun_r, moon_r):
+    '''
+    fraction of the area of the Sun's disk covered by the Moon, vectorized
+    :param s: separation in degrees
+    :param sun_r: apparent radius of the Sun in degrees
+    :param moon_r: apparent radius of the Moon in degrees
+    :return: array of obscuration (0-1)
+    '''
+    s, sun_r, moon_r = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in (s, sun_r, moon_r)])
+    result = np.zeros(s.shape)
+    central = s <= np.abs(sun_r - moon_r)
+    result[central] = np.minimum(sun_r[central], moon_r[central]) ** 2 / sun_r[central] ** 2
+    partial = (s < sun_r + moon_r) & ~central
+    s, R, r = s[partial], sun_r[partial], moon_r[partial]
+    lens = (r * r * np.arccos(np.clip((s * s + r * r - R * R) / (2 * s * r), -1, 1)) +
+            R * R * np.arccos(np.clip((s * s + R * R - r * r) / (2 * s * R), -1, 1)) -
+            0.5 * np.sqrt(np.maximum((-s + r + R) * (s + r - R) * (s - r + R) * (s + r + R), 0)))
+    result[partial] = lens / (math.pi * R * R)
+    return result
+
+
+def eclipse_window(tt, hours=4, step=1):
+    '''
+    skyfield times spanning a window centered on (usually greatest) eclipse
+    :param tt: TT julian date at the center of the window
+    :param hours: hours either side of tt
+    :param step: resolution in seconds
+    :return: skyfield Time array
+    '''
+    offsets = np.arange(-hours * 3600, hours * 3600 + step, step) / 86400
+    return ts.tt_jd(tt, offsets)
+
+
+def geocentric_positions(t, eph, corrections='apparent'):
+    '''
+    apparent geocentric positions of the Sun and Moon, rotated into the terrestrial (ITRS) frame so that
+    topocentric geometry for any number of observers is a subtraction
+    :param t: skyfield Time array at a regular step
+    :param eph: JPL ephemeris from load_ephemeris, or a snapshot (circumstances.snapshot) which evaluates them
+    :param corrections: 'apparent', 'astrometric' (light-time only) or 'geometric' (none), see PRECISION_TIERS
+    :return: dict with TT julian dates, step in seconds, and 3xN arrays of Sun and Moon positions in km
+    '''
+    if hasattr(eph, 'geocentric'):
+        with metrics.stage('ephemeris', step='snapshot'):
+            return eph.geocentric(t, corrections=corrections)
+    with metrics.stage('ephemeris', step='geocentric'):
+        tt = t.tt
+        geo = {'tt': tt, 'step': grid_step(tt)}
+        if corrections == 'geometric':
+            for body in ['sun', 'moon']:
+                geo[body] = (eph[body] - eph['earth']).at(t).frame_xyz(itrs).km
+            return geo
+        earth = eph['earth'].at(t)
+        for body in ['sun', 'moon']:
+            position = earth.observe(eph[body])
+            if corrections == 'apparent':
+                position = position.apparent()
+            elif corrections != 'astrometric':
+                raise ValueError(f"unsupported corrections {corrections}, expected apparent, astrometric or geometric")
+            geo[body] = position.frame_xyz(itrs).km
+        return geo
+
+
+def grid_step(tt):
+    '''
+    seconds between samples of a regular grid of TT julian dates, from the whole span since neighbouring julian
+    dates are only good to about 40 microseconds
+    '''
+    return round((tt[-1] - tt[0]) * 86400 / (len(tt) - 1), 6)
+
+
+def site_xyz(lat, lon, ele=0):
+    '''
+    ITRS position of one or more observers on the WGS84 ellipsoid
+    :return: 3xN array in km
+    '''
+    lat, lon, ele = np.broadcast_arrays(np.atleast_1d(lat), np.atleast_1d(lon), np.atleast_1d(ele))
+    return wgs84.latlon(lat.astype(float), lon.astype(float), elevation_m=ele.astype(float)).itrs_xyz.km
+
+
+def local_geometry(sun, moon, xyz):
+    '''
+    topocentric separation and apparent radii of the Sun and Moon, arrays broadcast against each other so
+    (3,1,T) bodies with (3,N,1) sites give (N,T) results, and (3,T) with (3,T) follows a moving observer
+    :param sun: geocentric ITRS Sun position(s) in km
+    :param moon: geocentric ITRS Moon position(s) in km
+    :param xyz: ITRS observer position(s) in km
+    :return: separation, Sun radius and Moon radius in degrees
+    '''
+    vs = sun - xyz
+    vm = moon - xyz
+    ds = np.sqrt(np.einsum('i...,i...->...', vs, vs))
+    dm = np.sqrt(np.einsum('i...,i...->...', vm, vm))
+    cross = np.sqrt((vs[1] * vm[2] - vs[2] * vm[1]) ** 2 +
+                    (vs[2] * vm[0] - vs[0] * vm[2]) ** 2 +
+                    (vs[0] * vm[1] - vs[1] * vm[0]) ** 2)
+    dot = np.einsum('i...,i...->...', vs, vm)
+    separation = np.degrees(np.arctan2(cross, dot))
+    return separation, np.degrees(arcsin(SUN_RADIUS_KM / ds)), np.degrees(arcsin(MOON_RADIUS_KM / dm))
+
+
+def local_altaz(vector, lat, lon):
+    '''
+    altitude and azimuth of a topocentric ITRS vector for observers at geodetic lat/lon (no refraction)
+    :param vector: 3xN array
+    :return: altitude and azimuth in degrees
+    '''
+    phi = np.radians(lat)
+    lam = np.radians(lon)
+    up = np.array([np.cos(phi) * np.cos(lam), np.cos(phi) * np.sin(lam), np.sin(phi)])
+    east = np.array([-np.sin(lam), np.cos(lam), np.zeros(np.shape(lam))])
+    north = np.array([-np.sin(phi) * np.cos(lam), -np.sin(phi) * np.sin(lam), np.cos(phi)])
+    u = np.einsum('i...,i...->...', vector, up)
+    e = np.einsum('i...,i...->...', vector, east)
+    n = np.einsum('i...,i...->...', vector, north)
+    alt = np.degrees(np.arctan2(u, np.sqrt(e * e + n * n)))
+    az = np.degrees(np.arctan2(e, n)) % 360
+    return alt, az
+
+
+def eclipse_possible(geo, lat, lon, ele=0, require_sun_up=True):
+    '''
+    conservative pre-filter ruling out observers who cannot see any part of an eclipse, from geocentric positions
+    sampled as coarsely as every 10 minutes. Between samples the separation of the Moon and Sun and the altitude of
+    the Sun can only change so fast, so an observer is rejected only if no sample comes within those bounds of
+    the penumbra (with the Sun above the horizon), never falsely rejected.
+    :param geo: dict from geocentric_positions spanning the eclipse
+    :param require_sun_up: also reject observers for whom the Sun is below the horizon throughout
+    :return: boolean array, False where the eclipse is certainly not visible
+    '''
+    lat, lon, ele = [np.asarray(x, dtype=float) for x in np.broadcast_arrays(np.atleast_1d(lat), np.atleast_1d(lon),
+                                                                             np.atleast_1d(ele))]
+    xyz = site_xyz(lat, lon, ele)
+    separation, sun_r, moon_r = local_geometry(geo['sun'][:, None, :], geo['moon'][:, None, :], xyz[:, :, None])
+    near = separation - sun_r - moon_r < MAX_SEPARATION_RATE * geo['step'] / 2
+    if require_sun_up:
+        alt, az = local_altaz(geo['sun'][:, None, :] - xyz[:, :, None], lat[:, None], lon[:, None])
+        dip = np.degrees(np.arccos(6371.0 / (6371.0 + np.maximum(ele, 0) / 1000)))
+        near &= alt > (HORIZON_DEGREES - dip)[:, None] - MAX_SUN_ALTITUDE_RATE * geo['step'] / 2
+    return near.any(axis=1)
+
+
+class visibility_filter(object):
+    '''
+    eclipse_possible with running counts, to sit in front of bulk sweeps and report how much work it saved
+    '''
+
+    def __init__(self, step=600, window_hours=4, require_sun_up=True):
+        self.step = step
+        self.window_hours = window_hours
+        self.require_sun_up = require_sun_up
+        self.checked = 0
+        self.rejected = 0
+
+    def geo(self, tt, eph):
+        '''coarse geocentric positions for the eclipse with greatest eclipse at TT julian date tt'''
+        return geocentric_positions(eclipse_window(tt, hours=self.window_hours, step=self.step), eph)
+
+    def check(self, geo, lat, lon, ele=0):
+        possible = eclipse_possible(geo, lat, lon, ele, require_sun_up=self.require_sun_up)
+        self.checked += len(possible)
+        self.rejected += int((~possible).sum())
+        return possible
+
+    @property
+    def rejection_rate(self):
+        if self.checked == 0:
+            return 0.0
+        return self.rejected / self.checked
+
+    def report(self):
+        return {'checked': self.checked, 'rejected': self.rejected, 'rejection_rate': self.rejection_rate}
+
+
+def local_contacts(geo, lat, lon, ele=0, coarse=60):
+    '''
+    vectorized local circumstances for many observers from one set of geocentric positions, contacts are
+    bracketed on a coarse grid then interpolated on the fine grid of geo
+    :param geo: dict from geocentric_positions spanning the eclipse
+    :param lat: latitude(s) in degrees
+    :param lon: longitude(s) in degrees
+    :param ele: elevation(s) in meters
+    :param coarse: bracketing step in seconds
+    :return: dict of arrays, one element per observer:
+        c1, c2, mid, c3, c4: TT julian dates (nan when the contact does not occur)
+        {contact}_sun_alt, {contact}_sun_az: position of the Sun at each contact
+        obscuration, magnitude, ratio (Moon/Sun apparent size) and separation at maximum eclipse
+        type: 'P', 'A', 'T' or '' when there is no eclipse
+        duration: seconds from c2 to c3, 0 outside the path
+    '''
+    lat, lon, ele = [np.asarray(x, dtype=float) for x in np.broadcast_arrays(np.atleast_1d(lat), np.atleast_1d(lon),
+                                                                             np.atleast_1d(ele))]
+    xyz = site_xyz(lat, lon, ele)
+    n = xyz.shape[1]
+    T = geo['sun'].shape[1]
+    k = max(1, int(round(coarse / geo['step'])))
+    ci = np.arange(0, T, k)
+    result = {attr: np.full(n, np.nan) for attr in ['c1', 'c2', 'mid', 'c3', 'c4', 'obscuration', 'magnitude',
+                                                      'ratio', 'separation']}
+    result['type'] = np.full(n, '', dtype='<U1')
+    result['duration'] = np.zeros(n)
+    for attr in CONTACTS:
+        result[f'{attr}_sun_alt'] = np.full(n, np.nan)
+        result[f'{attr}_sun_az'] = np.full(n, np.nan)
+
+    separation, sun_r, moon_r = local_geometry(geo['sun'][:, None, ci], geo['moon'][:, None, ci], xyz[:, :, None])
+    partial = separation < sun_r + moon_r
+    eclipsed = np.flatnonzero(partial.any(axis=1))
+    if len(eclipsed) == 0:
+        return result
+    partial = partial[eclipsed]
+    xyz = xyz[:, eclipsed]
+    first = partial.argmax(axis=1)
+    last = partial.shape[1] - 1 - partial[:, ::-1].argmax(axis=1)
+    c1 = _crossing(geo, xyz, ci[np.maximum(first - 1, 0)], k, _penumbral_limit, ingress=True)
+    c4 = _crossing(geo, xyz, ci[last], k, _penumbral_limit, ingress=False)
+
+    # maximum eclipse, the least separation, parabolic interpolation about the least fine sample
+    coarse_min = np.where(partial, separation[eclipsed], np.inf).argmin(axis=1)
+    idx = np.clip(ci[coarse_min][:, None] + np.arange(-k, k + 1), 0, T - 1)
+    sep, sr, mr = local_geometry(geo['sun'][:, idx], geo['moon'][:, idx], xyz[:, :, None])
+    j = np.clip(sep.argmin(axis=1), 1, idx.shape[1] - 2)
+    rows = np.arange(len(eclipsed))
+    y0, y1, y2 = sep[rows, j - 1], sep[rows, j], sep[rows, j + 1]
+    curvature = y0 - 2 * y1 + y2
+    offset = np.where(curvature > 0, 0.5 * (y0 - y2) / np.where(curvature > 0, curvature, 1), 0)
+    mid = idx[rows, j] + np.clip(offset, -1, 1)
+    sep_max = np.maximum(y1 - 0.25 * (y0 - y2) * offset, 0)
+    sr, mr = sr[rows, j], mr[rows, j]
+
+    result['c1'][eclipsed] = _fine_tt(geo, c1)
+    result['c4'][eclipsed] = _fine_tt(geo, c4)
+    result['mid'][eclipsed] = _fine_tt(geo, mid)
+    result['separation'][eclipsed] = sep_max
+    result['obscuration'][eclipsed] = obscuration(sep_max, sr, mr)
+    result['magnitude'][eclipsed] = (sr + mr - sep_max) / (2 * sr)
+    result['ratio'][eclipsed] = mr / sr
+    result['type'][eclipsed] = 'P'
+
+    central = np.flatnonzero(sep_max < np.abs(sr - mr))
+    if len(central) > 0:
+        # the central phase lasts at most 12m30s, bracket it within 8 minutes of maximum eclipse
+        w = int(math.ceil(480 / geo['step']))
+        start = np.floor(mid[central]).astype(int)
+        c2 = _crossing(geo, xyz[:, central], start - w, w, _umbral_limit, ingress=True)
+        c3 = _crossing(geo, xyz[:, central], start, w, _umbral_limit, ingress=False)
+        sites = eclipsed[central]
+        result['c2'][sites] = _fine_tt(geo, c2)
+        result['c3'][sites] = _fine_tt(geo, c3)
+        result['duration'][sites] = (c3 - c2) * geo['step']
+        result['type'][sites] = np.where(mr[central] > sr[central], 'T', 'A')
+
+    for attr in CONTACTS:
+        found = eclipsed[~np.isnan(result[attr][eclipsed])]
+        if len(found) == 0:
+            continue
+        fine = np.clip(np.rint((result[attr][found] - geo['tt'][0]) * 86400 / geo['step']).astype(int), 0, T - 1)
+        sites = site_xyz(lat[found], lon[found], ele[found])
+        alt, az = local_altaz(geo['sun'][:, fine] - sites, lat[found], lon[found])
+        result[f'{attr}_sun_alt'][found] = alt
+        result[f'{attr}_sun_az'][found] = az
+    return result
+
+
+def local_circumstances(ge, lat, lon, ele=0, precision='standard', eph=None, window_hours=4):
+    '''
+    local circumstances of one eclipse for one or more observers at a named precision tier
+    :param ge: entry from get_canon_Espenak, or TT julian date of (or near) greatest eclipse
+    :param precision: key of PRECISION_TIERS, or a dict of the same form
+    :param eph: ephemeris (default, load_ephemeris for the year of the eclipse and the tier's kernel)
+    :return: dict of arrays from local_contacts
+    '''
+    tier = PRECISION_TIERS[precision] if isinstance(precision, str) else precision
+    tt = greatest_eclipse_tt(ge) if isinstance(ge, dict) else ge
+    geo = eclipse_positions(tt, precision=tier, eph=eph, window_hours=window_hours)
+    return local_contacts(geo, lat, lon, ele, coarse=tier['coarse'])
+
+
+def eclipse_positions(tt, engine='ephemeris', precision='standard', eph=None, window_hours=4):
+    '''
+    geocentric positions spanning an eclipse at a precision tier's step and corrections, as local_circumstances
+    uses them
+    :param tt: TT julian date of (or near) greatest eclipse
+    :param engine: 'ephemeris' for JPL positions, 'analytic' for the analytic theory (no kernel needed)
+    :param precision: key of PRECISION_TIERS, or a dict of the same form
+    :param eph: ephemeris (default, load_ephemeris for the year of the eclipse and the tier's kernel)
+    '''
+    tier = PRECISION_TIERS[precision] if isinstance(precision, str) else precision
+    t = eclipse_window(tt, hours=window_hours, step=tier['step'])
+    if engine == 'analytic':
+        from circumstances.analytic import analytic_positions
+        return analytic_positions(t)
+    if eph is None:
+        eph = load_ephemeris(ts.tt_jd(tt).tt_calendar()[0], kernel=tier['kernel'])
+    return geocentric_positions(t, eph, corrections=tier['corrections'])
+
+
+def contacts_to_dict(result, n=0):
+    '''
+    one observer's circumstances from local_contacts as a dictionary, contacts that do not occur are None
+    '''
+    circumstances = {'type': str(result['type'][n]),
+                     'obscuration': float(result['obscuration'][n]),
+                     'magnitude': float(result['magnitude'][n]),
+                     'ratio': float(result['ratio'][n]),
+                     'duration': float(result['duration'][n])}
+    for attr in CONTACTS:
+        if np.isnan(result[attr][n]):
+            circumstances[attr] = None
+            continue
+        circumstances[attr] = {'tt': float(result[attr][n]),
+                               'utc_iso': signed_utc_iso(ts.tt_jd(result[attr][n])),
+                               'sun_alt': float(result[f'{attr}_sun_alt'][n]),
+                               'sun_az': float(result[f'{attr}_sun_az'][n])}
+    return circumstances
+
+
+def _crossing(geo, xyz, start, k, limit, ingress=True):
+    '''
+    fractional fine index at which the separation crosses limit(sun_r, moon_r) within k samples of start
+    '''
+    T = geo['sun'].shape[1]
+    idx = np.clip(start[:, None] + np.arange(k + 1), 0, T - 1)
+    sep, sr, mr = local_geometry(geo['sun'][:, idx], geo['moon'][:, idx], xyz[:, :, None])
+    g = sep - limit(sr, mr)
+    inside = g < 0
+    rows = np.arange(len(start))
+    if ingress:
+        j = inside.argmax(axis=1)
+        before = np.maximum(j - 1, 0)
+        # only divide where the crossing was bracketed, elsewhere the two samples can coincide
+        frac = np.divide(g[rows, before], g[rows, before] - g[rows, j], out=np.zeros(len(rows)), where=j > 0)
+        return idx[rows, before] + frac
+    j = k - inside[:, ::-1].argmax(axis=1)
+    after = np.minimum(j + 1, k)
+    frac = np.divide(g[rows, j], g[rows, j] - g[rows, after], out=np.zeros(len(rows)), where=j < k)
+    return idx[rows, j] + frac
+
+
+def _penumbral_limit(sun_r, moon_r):
+    return sun_r + moon_r
+
+
+def _umbral_limit(sun_r, moon_r):
+    return np.abs(sun_r - moon_r)
+
+
+def _fine_tt(geo, fine):
+    return geo['tt'][0] + fine * geo['step'] / 86400
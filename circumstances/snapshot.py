@@ -0,0 +1,222 @@
+'''
+Chebyshev snapshots of the geocentric Sun and Moon over an eclipse window
+
+the apparent positions, already rotated into the terrestrial (ITRS) frame, are fitted segment by segment so
+evaluating them is a few multiply-adds per sample, a snapshot stands in for the ephemeris anywhere
+geocentric_positions is called, so workers need neither the kernel nor skyfield's observe chain
+
+    snap = build_snapshot(canondata)
+    snap.save('caches/snapshots/+2024-04-08')
+    ...
+    snap = load_snapshot('caches/snapshots/+2024-04-08')  # memory mapped
+    geo = geocentric_positions(eclipse_window(tt), snap)
+'''
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from circumstances.circumstances import get_canon_Espenak
+from circumstances.skyfieldcalcs import geocentric_positions, grid_step
+from circumstances.utils import greatest_eclipse_tt, load_ephemeris, ts
+
+BODIES = ['sun', 'moon']
+
+
+class eclipse_snapshot(object):
+    '''
+    piecewise Chebyshev fit of the geocentric ITRS positions of the Sun and Moon
+    coefficients has shape (bodies, segments, 3, degree + 1), segment i covers
+    tt0 + i * segment seconds to tt0 + (i + 1) * segment seconds
+    '''
+
+    def __init__(self, coefficients, tt0, segment, meta=None, shm=None):
+        self.coefficients = coefficients
+        self.tt0 = tt0
+        self.segment = segment
+        self.meta = meta if meta is not None else {}
+        self.shm = shm  # shared memory block holding the coefficients, when shared or attached
+        self.tt_end = tt0 + coefficients.shape[1] * segment / 86400
+
+    def evaluate(self, tt):
+        '''
+        positions at TT julian dates within the snapshot
+        :return: 3xN arrays of Sun and Moon positions in km
+        '''
+        tt = np.atleast_1d(np.asarray(tt, dtype=float))
+        seconds = (tt - self.tt0) * 86400
+        n = self.coefficients.shape[1]
+        if seconds.min() < -1e-3 or seconds.max() > n * self.segment + 1e-3:
+            raise ValueError(f"times outside the snapshot, {self.tt0} to {self.tt_end}")
+        seg = np.clip((seconds // self.segment).astype(int), 0, n - 1)
+        x = 2 * (seconds - seg * self.segment) / self.segment - 1
+        # Chebyshev polynomials T0..Tdegree at each sample, by the recurrence
+        degree = self.coefficients.shape[3] - 1
+        T = np.empty((degree + 1, len(x)))
+        T[0] = 1
+        if degree > 0:
+            T[1] = x
+        for j in range(2, degree + 1):
+            T[j] = 2 * x * T[j - 1] - T[j - 2]
+        return [np.einsum('kij,ji->ki', self.coefficients[b][seg].transpose(1, 0, 2), T) for b in range(len(BODIES))]
+
+    def geocentric(self, t, corrections='apparent'):
+        '''
+        the same dictionary as geocentric_positions, which calls this when passed a snapshot for the ephemeris
+        '''
+        built = self.meta.get('corrections', 'apparent')
+        if corrections != built:
+            raise ValueError(f"snapshot was built with {built} corrections, {corrections} requested")
+        tt = t.tt
+        sun, moon = self.evaluate(tt)
+        return {'tt': tt, 'step': grid_step(tt), 'sun': sun, 'moon': moon}
+
+    def save(self, prefix):
+        '''
+        writes the coefficients to {prefix}.npy and everything else to {prefix}.json
+        '''
+        directory = os.path.dirname(prefix)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        np.save(f"{prefix}.npy", np.ascontiguousarray(self.coefficients))
+        fp = open(f"{prefix}.json", 'w')
+        json.dump(dict(self.meta, tt0=self.tt0, segment=self.segment, shape=list(self.coefficients.shape)), fp)
+        fp.close()
+
+    def share(self):
+        '''
+        copies the coefficients into a shared memory block
+        :return: picklable handle for attach_snapshot, pass it to pool workers (the initializer is a good place)
+        '''
+        if self.shm is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=self.coefficients.nbytes)
+            shared = np.ndarray(self.coefficients.shape, dtype=self.coefficients.dtype, buffer=self.shm.buf)
+            shared[:] = self.coefficients
+            self.coefficients = shared
+        return {'name': self.shm.name, 'shape': self.coefficients.shape, 'dtype': str(self.coefficients.dtype),
+                'tt0': self.tt0, 'segment': self.segment, 'meta': self.meta}
+
+    def close(self, unlink=False):
+        '''
+        releases the shared memory block, the process that called share() should unlink it when the pool is done
+        '''
+        if self.shm is not None:
+            self.coefficients = np.array(self.coefficients)
+            self.shm.close()
+            if unlink:
+                self.shm.unlink()
+            self.shm = None
+
+
+def fit_snapshot(tt, sun, moon, tt0, segment, degree, meta=None):
+    '''
+    fits positions sampled at the Chebyshev nodes of each segment (see chebyshev_times)
+    :param tt: TT julian dates of the samples
+    :param sun: 3xN positions in km
+    :param moon: 3xN positions in km
+    '''
+    nodes = degree + 1
+    segments = len(tt) // nodes
+    x = np.cos(np.pi * (np.arange(nodes) + 0.5) / nodes)
+    coefficients = np.empty((len(BODIES), segments, 3, nodes))
+    for b, positions in enumerate([sun, moon]):
+        samples = positions.reshape(3, segments, nodes).transpose(2, 1, 0).reshape(nodes, -1)
+        fit = np.polynomial.chebyshev.chebfit(x, samples, degree)  # (nodes, segments * 3)
+        coefficients[b] = fit.reshape(nodes, segments, 3).transpose(1, 2, 0)
+    return eclipse_snapshot(coefficients, tt0, segment, meta=meta)
+
+
+def chebyshev_times(tt0, segments, segment, degree):
+    '''
+    TT julian dates of the Chebyshev nodes of each segment, segment by segment
+    '''
+    nodes = degree + 1
+    x = np.cos(np.pi * (np.arange(nodes) + 0.5) / nodes)
+    starts = np.arange(segments)[:, None] * segment
+    return tt0 + (starts + (x[None, :] + 1) * segment / 2).ravel() / 86400
+
+
+def build_snapshot(ge, eph=None, window_hours=4, segment=600, degree=10, corrections='apparent'):
+    '''
+    fits the apparent geocentric Sun and Moon over the window of an eclipse
+    with the defaults the fit is good to well under a milliarcsecond, far below the error of the ephemeris
+    :param ge: entry from get_canon_Espenak, or TT julian date of greatest eclipse
+    :param eph: ephemeris (default, load_ephemeris for the year of the eclipse)
+    :param window_hours: hours either side of greatest eclipse
+    :param segment: seconds per Chebyshev segment
+    :param degree: degree of the Chebyshev polynomials
+    :param corrections: passed to geocentric_positions
+    :return: eclipse_snapshot
+    '''
+    tt = greatest_eclipse_tt(ge) if isinstance(ge, dict) else ge
+    meta = {'corrections': corrections, 'degree': degree, 'tt_ge': tt}
+    if isinstance(ge, dict):
+        meta['id'] = ge['id']
+    if eph is None:
+        eph = load_ephemeris(ts.tt_jd(tt).tt_calendar()[0])
+    meta['kernel'] = os.path.basename(str(getattr(eph, 'filename', '')))
+    segments = int(np.ceil(2 * window_hours * 3600 / segment))
+    tt0 = tt - window_hours / 24
+    nodes = chebyshev_times(tt0, segments, segment, degree)
+    t = ts.tt_jd(nodes)
+    geo = geocentric_positions(t, eph, corrections=corrections)
+    return fit_snapshot(nodes, geo['sun'], geo['moon'], tt0, segment, degree, meta=meta)
+
+
+def load_snapshot(prefix, mmap_mode='r'):
+    '''
+    reads a snapshot written by eclipse_snapshot.save, memory mapped by default so workers share the pages
+    '''
+    fp = open(f"{prefix}.json")
+    meta = json.load(fp)
+    fp.close()
+    coefficients = np.load(f"{prefix}.npy", mmap_mode=mmap_mode)
+    tt0 = meta.pop('tt0')
+    segment = meta.pop('segment')
+    meta.pop('shape', None)
+    return eclipse_snapshot(coefficients, tt0, segment, meta=meta)
+
+
+def attach_snapshot(handle):
+    '''
+    a snapshot backed by the shared memory block of eclipse_snapshot.share, for use in pool workers
+    '''
+    shm = shared_memory.SharedMemory(name=handle['name'])
+    coefficients = np.ndarray(handle['shape'], dtype=handle['dtype'], buffer=shm.buf)
+    return eclipse_snapshot(coefficients, handle['tt0'], handle['segment'], meta=handle['meta'], shm=shm)
+
+
+def build_canon_snapshots(year_start=1901, year_end=2100, directory='caches/snapshots', max_workers=None, **kwargs):
+    '''
+    builds and saves a snapshot for every eclipse in the canon between two years on a process pool, named by
+    date, ex. caches/snapshots/+2024-04-08
+    :param kwargs: passed to build_snapshot
+    :return: list of the prefixes written
+    '''
+    canon, otherdates = get_canon_Espenak()
+    jobs = {}
+    for key, canondata in canon.items():
+        year = int(canondata['id'][:5])
+        if year < year_start or year > year_end:
+            continue
+        eclipseid = canondata['id']
+        prefix = os.path.join(directory, f"{eclipseid[:5]}-{eclipseid[5:7]}-{eclipseid[7:9]}")
+        if not os.path.exists(f"{prefix}.json"):
+            jobs[prefix] = canondata
+    written = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_build_and_save, canondata, prefix, kwargs): prefix
+                   for prefix, canondata in jobs.items()}
+        for future in as_completed(futures):
+            try:
+                future.result()
+                written.append(futures[future])
+            except Exception as e:
+                print(f"error building snapshot {futures[future]}, {e}")
+    return written
+
+
+def _build_and_save(canondata, prefix, kwargs):
+    build_snapshot(canondata, **kwargs).save(prefix)
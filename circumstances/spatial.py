@@ -0,0 +1,208 @@
+'''
+nearby-site interpolation of local circumstances
+
+contact times, magnitude and the position of the Sun vary smoothly over a few kilometers except where the type
+of eclipse changes (the path limits and the edge of the penumbra), a circumstance_grid computes exact
+circumstances at the corners and center of cells of an adaptive grid, and answers queries inside a cell by
+bilinear interpolation when the center agrees with the interpolation of the corners to within the error bound,
+cells that don't are split, down to max_level, beyond which the query is computed exactly
+'''
+import math
+import pickle
+import threading
+
+import numpy as np
+
+from circumstances import metrics
+from circumstances.skyfieldcalcs import CONTACTS, contacts_to_dict, eclipse_window, geocentric_positions, local_contacts
+from circumstances.utils import greatest_eclipse_tt, load_ephemeris, ts
+
+FRACTIONS = ['obscuration', 'magnitude', 'ratio']
+ANGLES = [f'{c}_sun_alt' for c in CONTACTS] + ['separation']
+AZIMUTHS = [f'{c}_sun_az' for c in CONTACTS]
+
+_grids = {}  # circumstance_grid per eclipse, for cached_local_circumstances
+_grids_lock = threading.Lock()
+
+
+class circumstance_grid(object):
+    '''
+    exact circumstances on an adaptive grid for one eclipse, and interpolation between them
+    '''
+
+    def __init__(self, ge, eph=None, cell=0.1, max_level=4, max_error=1.0, max_fraction_error=0.001,
+                 ele_tolerance=50, window_hours=4, coarse=60, geo=None):
+        '''
+        :param ge: entry from get_canon_Espenak, or TT julian date of greatest eclipse
+        :param eph: ephemeris or snapshot (default, load_ephemeris for the year of the eclipse)
+        :param cell: size of the coarsest cells in degrees
+        :param max_level: number of times a cell may be halved, 4 takes 0.1 degrees down to about 700 m
+        :param max_error: seconds, bound on the error of interpolated contact times and duration
+        :param max_fraction_error: bound on the error of interpolated obscuration, magnitude and ratio
+        :param ele_tolerance: meters, queries are answered at the nearest multiple of this elevation
+        :param geo: geocentric positions spanning the eclipse, computed from eph when not provided
+        '''
+        self.tt = greatest_eclipse_tt(ge) if isinstance(ge, dict) else ge
+        if geo is None:
+            if eph is None:
+                eph = load_ephemeris(ts.tt_jd(self.tt).tt_calendar()[0])
+            geo = geocentric_positions(eclipse_window(self.tt, hours=window_hours), eph)
+        self.geo = geo
+        self.coarse = coarse
+        self.cell = cell
+        self.max_level = max_level
+        self.max_error = max_error
+        self.max_fraction_error = max_fraction_error
+        self.ele_tolerance = ele_tolerance
+        self.unit = cell / 2 ** (max_level + 1)  # lattice holding every corner and center
+        self.points = {}  # (ele band, lat index, lon index): exact circumstances
+        self.cells = {}  # (ele band, level, i, j): error in seconds, None where the cell can't be interpolated
+        self.stats = {'interpolated': 0, 'exact': 0, 'points': 0}
+        self._lock = threading.RLock()  # cells are evaluated by one thread at a time
+
+    def query(self, lat, lon, ele=0):
+        '''
+        circumstances at a site, interpolated when the site is in a cell that passes the error bound
+        :return: dictionary in the form of contacts_to_dict plus interpolated (bool), error_estimate_s (seconds,
+                 how far the cell's center was from the mean of its corners, an estimate of the interpolation
+                 error rather than a bound, 0 when computed exactly) and level (of the cell used, None when exact)
+        '''
+        band = int(round(ele / self.ele_tolerance))
+        for level in range(self.max_level + 1):
+            span = 2 ** (self.max_level + 1 - level)
+            i = math.floor(lat / self.unit / span)
+            j = math.floor(lon / self.unit / span)
+            error = self._cell(band, level, i, j)
+            if error is None:
+                continue
+            u = lat / self.unit / span - i
+            v = lon / self.unit / span - j
+            corners = [self.points[(band, (i + di) * span, (j + dj) * span)] for di, dj in [(0, 0), (1, 0), (0, 1),
+                                                                                            (1, 1)]]
+            weights = [(1 - u) * (1 - v), u * (1 - v), (1 - u) * v, u * v]
+            self.stats['interpolated'] += 1
+            metrics.counter('spatial_cache', result='interpolated')
+            return dict(contacts_to_dict(_blend(corners, weights)), interpolated=True, error_estimate_s=error,
+                        level=level)
+        self.stats['exact'] += 1
+        metrics.counter('spatial_cache', result='exact')
+        result = local_contacts(self.geo, lat, lon, ele, coarse=self.coarse)
+        return dict(contacts_to_dict(result), interpolated=False, error_estimate_s=0.0, level=None)
+
+    def _cell(self, band, level, i, j):
+        '''
+        interpolation error of a cell in seconds, None when the cell straddles a change of eclipse type or fails
+        the error bounds, the corners and center are computed on first use
+        '''
+        key = (band, level, i, j)
+        if key in self.cells:
+            return self.cells[key]
+        with self._lock:
+            if key not in self.cells:
+                self.cells[key] = self._evaluate(band, level, i, j)
+        return self.cells[key]
+
+    def _evaluate(self, band, level, i, j):
+        span = 2 ** (self.max_level + 1 - level)
+        half = span // 2
+        keys = [(band, (i + di) * span, (j + dj) * span) for di, dj in [(0, 0), (1, 0), (0, 1), (1, 1)]]
+        keys.append((band, i * span + half, j * span + half))
+        self._compute([k for k in keys if k not in self.points])
+        corners = [self.points[k] for k in keys[:4]]
+        center = self.points[keys[4]]
+
+        error = _center_error(corners, center, self.max_fraction_error)
+        if error is not None and error > self.max_error:
+            error = None
+        return error
+
+    def _compute(self, keys):
+        if len(keys) == 0:
+            return
+        lat = np.array([k[1] for k in keys]) * self.unit
+        lon = np.array([k[2] for k in keys]) * self.unit
+        ele = np.array([k[0] for k in keys]) * self.ele_tolerance
+        result = local_contacts(self.geo, lat, lon, ele, coarse=self.coarse)
+        for n, key in enumerate(keys):
+            self.points[key] = {attr: values[n] for attr, values in result.items()}
+        self.stats['points'] += len(keys)
+
+    def save(self, filename):
+        '''
+        pickles the computed points and cells, not the geocentric positions
+        '''
+        with self._lock:
+            state = {k: v for k, v in self.__dict__.items() if k not in ['geo', '_lock']}
+            fp = open(filename, 'wb')
+            pickle.dump(state, fp)
+            fp.close()
+
+    def load(self, filename):
+        '''
+        adds the points and cells pickled by save, for a grid with the same settings
+        '''
+        fp = open(filename, 'rb')
+        state = pickle.load(fp)
+        fp.close()
+        for attr in ['tt', 'cell', 'max_level', 'ele_tolerance']:
+            if state[attr] != getattr(self, attr):
+                raise ValueError(f"saved grid has {attr} {state[attr]}, this grid {getattr(self, attr)}")
+        self.points.update(state['points'])
+        self.cells.update(state['cells'])
+
+
+def _center_error(corners, center, max_fraction_error):
+    '''
+    largest difference in seconds between the center and the mean of the corners, None when the type of eclipse
+    or the contacts that occur differ, or a fraction is off by more than max_fraction_error
+    '''
+    points = corners + [center]
+    if len({p['type'] for p in points}) > 1:
+        return None
+    error = 0.0
+    for attr in CONTACTS:
+        present = [not np.isnan(p[attr]) for p in points]
+        if any(present) and not all(present):
+            return None
+        if all(present):
+            error = max(error, abs(np.mean([p[attr] for p in corners]) - center[attr]) * 86400)
+    error = max(error, abs(np.mean([p['duration'] for p in corners]) - center['duration']))
+    for attr in FRACTIONS:
+        if center['type'] and abs(np.mean([p[attr] for p in corners]) - center[attr]) > max_fraction_error:
+            return None
+    return error
+
+
+def _blend(corners, weights):
+    '''
+    bilinear interpolation of single-site results, as one-element arrays for contacts_to_dict
+    '''
+    result = {'type': np.array([corners[0]['type']])}
+    for attr in CONTACTS + FRACTIONS + ANGLES + ['duration']:
+        values = np.array([c[attr] for c in corners], dtype=float)
+        if np.isnan(values).all():
+            result[attr] = np.array([np.nan])
+            continue
+        reference = values[0]
+        result[attr] = np.array([reference + np.dot(weights, values - reference)])
+    for attr in AZIMUTHS:
+        values = np.array([c[attr] for c in corners], dtype=float)
+        if np.isnan(values).all():
+            result[attr] = np.array([np.nan])
+            continue
+        reference = values[0]
+        offsets = (values - reference + 180) % 360 - 180  # across north
+        result[attr] = np.array([(reference + np.dot(weights, offsets)) % 360])
+    return result
+
+
+def cached_local_circumstances(ge, lat, lon, ele=0, eph=None, **kwargs):
+    '''
+    local circumstances from a circumstance_grid kept per eclipse for the life of the process
+    :param kwargs: passed to circumstance_grid when it is created
+    '''
+    tt = greatest_eclipse_tt(ge) if isinstance(ge, dict) else ge
+    with _grids_lock:
+        if tt not in _grids:
+            _grids[tt] = circumstance_grid(tt, eph=eph, **kwargs)
+    return _grids[tt].query(lat, lon, ele)
@@ -0,0 +1,101 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+from circumstances.skyfieldcalcs import eclipse_window, geocentric_positions, local_altaz, local_contacts, \
+    local_geometry, obscuration, site_xyz
+from circumstances.utils import greatest_eclipse_tt, load_ephemeris, signed_utc_iso, ts
+
+
+def obscuration_stream(lat, lon, ele=0, ge=None, start=None, end=None, step=1, chunk_seconds=600, eph=None):
+    '''
+    the obscuration curve at a location, in chunks so memory stays bounded however long the
+    eclipse or fine the step, for animations and light-curves
+    :param ge: entry from get_canon_Espenak, or TT julian date of greatest eclipse, used to find C1 and C4 when
+               start and end are not given (required then)
+    :param start: TT julian date to start at (default, C1)
+    :param end: TT julian date to end at (default, C4)
+    :param step: seconds between samples, may be less than 1
+    :param chunk_seconds: seconds of the curve per chunk
+    :param eph: ephemeris (default, load_ephemeris for the year of the eclipse)
+    :return: generator of DataFrames with utc_iso (as signed_utc_iso), tt, separation, obscuration, sun_alt, sun_az
+             and ratio (Moon/Sun apparent size) columns, nothing when the eclipse is not seen from the location
+    '''
+    if ge is None and (start is None or end is None):
+        raise ValueError("obscuration_stream needs ge to find C1 and C4 unless both start and end are given")
+    return _chunks(lat, lon, ele, ge, start, end, step, chunk_seconds, eph)
+
+
+def _chunks(lat, lon, ele, ge, start, end, step, chunk_seconds, eph):
+    if isinstance(ge, dict):
+        ge = greatest_eclipse_tt(ge)
+    if eph is None:
+        eph = load_ephemeris(ts.tt_jd(ge if ge is not None else start).tt_calendar()[0])
+    if start is None or end is None:
+        contacts = local_contacts(geocentric_positions(eclipse_window(ge, hours=4), eph), lat, lon, ele)
+        if np.isnan(contacts['c1'][0]):
+            return
+        if start is None:
+            start = contacts['c1'][0]
+        if end is None:
+            end = contacts['c4'][0]
+
+    xyz = site_xyz(lat, lon, ele)
+    places = len(f"{step:g}".partition('.')[2])  # decimal places of the time stamps
+    # julian dates near 2.46e6 resolve about 40 microseconds, so an end on the step isn't lost to rounding
+    total = int(math.floor((end - start) * 86400 / step + 1e-3)) + 1
+    per_chunk = max(1, int(chunk_seconds / step))
+    for first in range(0, total, per_chunk):
+        offsets = np.arange(first, min(first + per_chunk, total)) * step
+        t = ts.tt_jd(start, offsets / 86400)
+        if len(offsets) < 2:
+            t = ts.tt_jd(start, np.append(offsets, offsets[-1] + step) / 86400)  # geocentric_positions needs a step
+        geo = geocentric_positions(t, eph)
+        separation, sun_r, moon_r = local_geometry(geo['sun'], geo['moon'], xyz)
+        sun_alt, sun_az = local_altaz(geo['sun'] - xyz, lat, lon)
+        n = len(offsets)
+        yield pd.DataFrame({'utc_iso': signed_utc_iso(t, places=places)[:n],
+                            'tt': geo['tt'][:n],
+                            'separation': separation[:n],
+                            'obscuration': obscuration(separation, sun_r, moon_r)[:n],
+                            'sun_alt': sun_alt[:n],
+                            'sun_az': sun_az[:n],
+                            'ratio': (moon_r / sun_r)[:n]})
+
+
+def write_stream_csv(chunks, filename):
+    '''
+    appends chunks from obscuration_stream to a CSV file as they arrive
+    :return: number of rows written
+    '''
+    rows = 0
+    for chunk in chunks:
+        chunk.to_csv(filename, mode='w' if rows == 0 else 'a', header=rows == 0, index=False)
+        rows += len(chunk)
+    return rows
+
+
+def write_stream_parquet(chunks, filename):
+    '''
+    writes chunks from obscuration_stream to a Parquet file as they arrive, one row group per chunk, requires pyarrow
+    :return: number of rows written
+    '''
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("write_stream_parquet requires pyarrow, pip install pyarrow")
+    rows = 0
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(filename, table.schema)
+            writer.write_table(table)
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
@@ -0,0 +1,109 @@
+import numpy as np
+
+from circumstances.circumstances import get_canon_Espenak
+from circumstances.skyfieldcalcs import HORIZON_DEGREES, MAX_SEPARATION_RATE, contacts_to_dict, \
+    geocentric_positions, local_contacts, local_geometry, site_xyz
+from circumstances.utils import greatest_eclipse_tt, load_ephemeris, spanning_kernel, ts
+
+
+def century_years(century):
+    '''
+    first and last years of a century as century_sweep counts them, year // 100, so 20 is 2000-2099, 0 is 0-99
+    and -1 is -100 to -1 (astronomical years, 1 BC is 0)
+    '''
+    return century * 100, century * 100 + 99
+
+
+def century_sweep(lat, lon, ele=0, century=20, canon=None, eph=None, window_hours=4, coarse=60, step=1,
+                  engine='ephemeris'):
+    '''
+    local circumstances of every canon eclipse in a century for one observer
+    rather than a circumstances() call per eclipse, the windows around greatest eclipse of all ~240 eclipses are
+    stacked into one array of times and the Sun and Moon evaluated in a single call, first every 10 minutes to
+    drop eclipses that cannot reach the observer, then every minute, then at step seconds over just the eclipses
+    seen, with the results segmented back per eclipse to find the contacts
+    :param century: year // 100 of the eclipses, so 20 is 2000-2099 and -1 is -100 to -1, see century_years
+    :param canon: canon from get_canon_Espenak (default, loaded from the cache)
+    :param eph: ephemeris (default, a kernel covering the whole century, see spanning_kernel)
+    :param window_hours: hours either side of greatest eclipse to search
+    :param coarse: bracketing step in seconds
+    :param step: resolution of the contact times in seconds
+    :param engine: 'ephemeris' for JPL positions, 'analytic' for the analytic theory (no kernel needed)
+    :return: dictionary keyed by canon date of the eclipses with a partial phase at the location, each a
+             dictionary from contacts_to_dict plus visible (the Sun is up at some contact or maximum)
+    '''
+    if canon is None:
+        canon, otherdates = get_canon_Espenak()
+    first_year, last_year = century_years(century)
+    if eph is None and engine != 'analytic':
+        eph = load_ephemeris(first_year, kernel=spanning_kernel(first_year, last_year))
+    keys = [key for key, canondata in canon.items() if int(canondata['id'][:5]) // 100 == century]
+    if len(keys) == 0:
+        return {}
+    tts = np.array([greatest_eclipse_tt(canon[key]) for key in keys])
+    xyz = site_xyz(lat, lon, ele)
+
+    # every 10 minutes, then every coarse seconds over the eclipses that might reach the observer
+    if engine == 'analytic':
+        eph = analytic_source()
+    keep = _stacked_near(tts, xyz, eph, window_hours, 600)
+    keys, tts = [keys[n] for n in np.flatnonzero(keep)], tts[keep]
+    if len(keys) == 0:
+        return {}
+    offsets = np.arange(-window_hours * 3600, window_hours * 3600 + coarse, coarse)
+    keep, first, last = _stacked_partial(tts, xyz, eph, offsets)
+    keys, tts, first, last = [keys[n] for n in np.flatnonzero(keep)], tts[keep], first[keep], last[keep]
+    if len(keys) == 0:
+        return {}
+
+    # fine windows from a coarse step before the first partial sample to a coarse step after the last
+    windows = [np.arange(offsets[max(f - 1, 0)], offsets[min(l + 1, len(offsets) - 1)] + step, step) for f, l in
+               zip(first, last)]
+    lengths = [len(window) for window in windows]
+    t = ts.tt_jd(np.repeat(tts, lengths), np.concatenate(windows) / 86400)
+    geo = geocentric_positions(t, eph)
+    geo['step'] = step
+
+    results = {}
+    end = 0
+    for key, length in zip(keys, lengths):
+        start, end = end, end + length
+        segment = {'tt': geo['tt'][start:end], 'step': step, 'sun': geo['sun'][:, start:end],
+                   'moon': geo['moon'][:, start:end]}
+        circumstances = contacts_to_dict(local_contacts(segment, lat, lon, ele, coarse=coarse))
+        if circumstances['c1'] is None:
+            continue
+        circumstances['visible'] = any(circumstances[attr]['sun_alt'] > HORIZON_DEGREES
+                                       for attr in ['c1', 'mid', 'c4'])
+        results[key] = circumstances
+    return results
+
+
+class analytic_source(object):
+    '''
+    the analytic theory behind the interface geocentric_positions uses for snapshots, for the stacked times
+    '''
+
+    def geocentric(self, t, corrections='apparent'):
+        from circumstances.analytic import analytic_positions
+        return analytic_positions(t)
+
+
+def _stacked_geometry(tts, xyz, eph, offsets):
+    t = ts.tt_jd(np.repeat(tts, len(offsets)), np.tile(offsets, len(tts)) / 86400)
+    geo = geocentric_positions(t, eph)
+    separation, sun_r, moon_r = local_geometry(geo['sun'], geo['moon'], xyz)
+    return (separation - sun_r - moon_r).reshape(len(tts), len(offsets))
+
+
+def _stacked_near(tts, xyz, eph, window_hours, step):
+    offsets = np.arange(-window_hours * 3600, window_hours * 3600 + step, step)
+    g = _stacked_geometry(tts, xyz, eph, offsets)
+    return (g < MAX_SEPARATION_RATE * step / 2).any(axis=1)
+
+
+def _stacked_partial(tts, xyz, eph, offsets):
+    partial = _stacked_geometry(tts, xyz, eph, offsets) < 0
+    first = partial.argmax(axis=1)
+    last = partial.shape[1] - 1 - partial[:, ::-1].argmax(axis=1)
+    return partial.any(axis=1), first, last
@@ -1,10 +1,24 @@
+import datetime
+import json
+import math
+import os
+import pickle
+import re
+import tempfile
+import threading
+
+import numpy as np
 import pandas as pd
+import requests_cache
 from selenium import webdriver
-from skyfield.api import Loader, load
+from skyfield.api import GREGORIAN_START, Loader, load
+from skyfield.timelib import julian_day
 from selenium.webdriver.support.ui import Select, WebDriverWait
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
 
+from circumstances import metrics
+
 
 ts = load.timescale()
 
@@ -12,15 +26,143 @@ ts = load.timescale()
 pd.set_option('display.max_columns', None)
 pd.set_option('display.width', 1000)
 
+# thread safety: ts and loaded ephemerides are read only once built and safe to share between threads, HTTP
+# sessions are not, use cached_session for one per thread, and guard read-modify-write of a cache file with
+# file_lock and pickle_dump_atomic
+_sessions = threading.local()
+_file_locks = {}
+_file_locks_lock = threading.Lock()
+
+# strict offline mode, for workers without network access: cached responses, pickles and ephemeris files on disk
+# are used as usual but anything that would reach the network raises offline_error instead. It is kept in the
+# environment so pool workers inherit it
+OFFLINE_ENV = 'CIRCUMSTANCES_OFFLINE'
+EPHEMERIS_DIR = '/var/data'  # centralize local caching of ephemeris files
+# excerpts of kernels installed by circumstances.bundle, kernel: {'file', 'years'}, kept in EPHEMERIS_DIR
+EXCERPTS = 'excerpts.json'
+
 MOON_RADIUS_KM = 1737.4
 SUN_RADIUS_KM = 695700
 months = ['', 'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
 eclipse_abbrev = {'A': 'annular', 'T': 'total', 'H': 'hybrid', 'P': 'partial'}
+# years covered by each JPL kernel, inclusive
+KERNEL_YEARS = {'de421.bsp': (1900, 2052), 'de440.bsp': (1550, 2649), 'de406.bsp': (-2999, 2999)}
+
+
+class offline_error(RuntimeError):
+    '''
+    raised in strict offline mode where the network would otherwise be used
+    '''
+
+
+def set_offline(strict=True):
+    '''
+    turns strict offline mode on or off for this process and the processes it starts
+    '''
+    os.environ[OFFLINE_ENV] = '1' if strict else '0'
+
+
+def is_offline():
+    return os.environ.get(OFFLINE_ENV, '') not in ('', '0')
+
+
+def require_online(what):
+    '''
+    raises offline_error in strict offline mode
+    :param what: what needs the network, for the message
+    '''
+    if is_offline():
+        raise offline_error(f"{what} is not cached and strict offline mode is on ({OFFLINE_ENV}), import a cache "
+                            f"bundle that has it, see circumstances.bundle")
+
+
+class offline_session(requests_cache.CachedSession):
+    '''
+    requests_cache session that only answers from the cache, raising offline_error for anything not in it
+    '''
+
+    def send(self, request, **kwargs):
+        kwargs['only_if_cached'] = True
+        r = super().send(request, **kwargs)
+        if r.status_code == 504 and r.reason == 'Not Cached':  # the stand-in requests_cache returns
+            require_online(f"{request.method} {request.url}")
+        return r
+
+
+def cached_session(cache_name, **kwargs):
+    '''
+    requests_cache session of the calling thread for a cache, created on first use, requests sessions aren't
+    safe to share between threads, the sessions of different threads share the SQLite cache, opened with write
+    ahead logging so readers don't wait on a writer. In strict offline mode the session is an offline_session
+    :param cache_name: path of the SQLite cache, ex. caches/http.sqllite
+    :param kwargs: passed to CachedSession when the thread's session is created
+    '''
+    sessions = getattr(_sessions, 'by_name', None)
+    if sessions is None:
+        sessions = _sessions.by_name = {}
+    key = (os.path.abspath(cache_name), is_offline())
+    if key not in sessions:
+        session_class = offline_session if key[1] else requests_cache.CachedSession
+        sessions[key] = session_class(cache_name, wal=True, **kwargs)
+    return sessions[key]
+
+
+def file_lock(filename):
+    '''
+    reentrant lock for a cache file, hold it from reading the file to writing it back so threads of this process
+    don't lose each other's updates
+    '''
+    with _file_locks_lock:
+        return _file_locks.setdefault(os.path.abspath(filename), threading.RLock())
+
+
+def pickle_dump_atomic(obj, filename):
+    '''
+    pickles to a temporary file next to filename then renames it into place, so a reader in another thread or
+    process sees the old file or the new one, never part of one
+    '''
+    write_atomic(filename, lambda fp: pickle.dump(obj, fp))
+
+
+def write_atomic(filename, write):
+    '''
+    calls write with a binary file open on a temporary file next to filename, then renames it into place
+    :param write: function of the open file, ex. lambda fp: fp.write(data)
+    '''
+    directory = os.path.dirname(filename) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, temporary = tempfile.mkstemp(dir=directory, prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            write(fp)
+        os.replace(temporary, filename)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def load_ephemeris(year=2023, kernel=None):
+    '''
+    :param year: year the ephemeris is needed for
+    :param kernel: kernel to prefer, ex. 'de440.bsp', used when it covers year otherwise the default for the year
+    '''
+    load = Loader(EPHEMERIS_DIR)
+    de = ephemeris_file(year, kernel)
+    with metrics.stage('ephemeris_load', kernel=de):
+        eph = load(de)
+    m = eph['moon']
+    jkl = str(eph).split("\n")
+    return eph
 
 
-def load_ephemeris(year=2023):
-    load = Loader("/var/data")  # centralize local caching of ephemeris files
-    if 1899 < year < 2053:
+def ephemeris_name(year=2023, kernel=None):
+    '''
+    file name of the JPL kernel load_ephemeris uses for a year
+    '''
+    first, last = KERNEL_YEARS.get(kernel, (year, year))
+    if kernel is not None and first <= year <= last:
+        de = kernel
+    elif 1899 < year < 2053:
         de = 'de421.bsp'
     elif 1549 < year < 2650:
         # supplants DE430
@@ -35,10 +177,62 @@ def load_ephemeris(year=2023):
     else:
         raise ValueError(f"unable to find a JPL Lunar Ephemeride for the year {year}")
         # de='de422.bsp'
-    eph = load(de)
-    m = eph['moon']
-    jkl = str(eph).split("\n")
-    return eph
+    return de
+
+
+def ephemeris_file(year=2023, kernel=None, ephemeris_dir=None):
+    '''
+    file in the ephemeris directory load_ephemeris loads for a year, the kernel of ephemeris_name or, when it
+    isn't there, an installed excerpt of it covering the year. In strict offline mode raises offline_error when
+    neither is, before skyfield would download the kernel or fail on a year outside an excerpt
+    :param ephemeris_dir: default, EPHEMERIS_DIR
+    '''
+    directory = EPHEMERIS_DIR if ephemeris_dir is None else ephemeris_dir
+    de = ephemeris_name(year, kernel)
+    if os.path.exists(os.path.join(directory, de)):
+        return de
+    excerpt = installed_excerpts(directory).get(de)
+    if excerpt is None:
+        require_online(f"ephemeris {de}")
+        return de
+    first, last = excerpt['years']
+    if first <= year <= last and os.path.exists(os.path.join(directory, excerpt['file'])):
+        return excerpt['file']
+    require_online(f"ephemeris {de} for {year}, the installed excerpt {excerpt['file']} covers {first} to {last}")
+    return de
+
+
+def excerpt_name(kernel, first, last):
+    '''file name of an excerpt of a kernel for years first to last, ex. de421.2020-2030.bsp'''
+    stem, extension = os.path.splitext(kernel)
+    return f"{stem}.{first}-{last}{extension}"
+
+
+def installed_excerpts(ephemeris_dir=None):
+    '''
+    the excerpts of kernels installed from bundles, kernel: {'file', 'years'}
+    '''
+    filename = os.path.join(EPHEMERIS_DIR if ephemeris_dir is None else ephemeris_dir, EXCERPTS)
+    if not os.path.exists(filename):
+        return {}
+    fp = open(filename)
+    excerpts = json.load(fp)
+    fp.close()
+    return excerpts
+
+
+def spanning_kernel(first, last):
+    '''
+    file name of a JPL kernel covering every year from first to last, the default for the years when it is the
+    same at both ends, otherwise the first of KERNEL_YEARS (shortest first) that covers both
+    '''
+    names = {ephemeris_name(first), ephemeris_name(last)}
+    if len(names) == 1:
+        return names.pop()
+    for de, (start, end) in sorted(KERNEL_YEARS.items(), key=lambda item: item[1][1] - item[1][0]):
+        if start <= first and last <= end:
+            return de
+    raise ValueError(f"unable to find a JPL Lunar Ephemeride for the years {first} to {last}")
 
 
 def decdeg2dms(dd):
@@ -67,6 +261,7 @@ def check_non_zero(x):
 
 
 def get_driver():
+    require_online('a selenium driver for the GSFC JavaScript eclipse pages')
     driver = None
     # import os
     # os.system("ps -ef | grep -i Chrome | awk '{ print $2 }' | grep -v grep | xargs kill")
@@ -78,11 +273,12 @@ def get_driver():
     # options.add_argument("--no-sandbox")
     # options.add_argument(r"--user-data-dir=/Users/trice/Library/Application Support/Google/Chrome")
     # options.add_argument(r'--profile-directory=Profile 3')
-    driver = webdriver.Chrome(options=options)
-    url = 'https://eclipse.gsfc.nasa.gov/JSEX/JSEX-USA.html'
-    driver.get(url)
-    # <input type="text" name="loc_name" size="30" onchange="newloc()">
-    table = WebDriverWait(driver, 20).until(EC.presence_of_element_located((By.NAME, 'loc_name')))
+    with metrics.stage('selenium_wait', step='driver'):
+        driver = webdriver.Chrome(options=options)
+        url = 'https://eclipse.gsfc.nasa.gov/JSEX/JSEX-USA.html'
+        driver.get(url)
+        # <input type="text" name="loc_name" size="30" onchange="newloc()">
+        table = WebDriverWait(driver, 20).until(EC.presence_of_element_located((By.NAME, 'loc_name')))
     return driver
 
 
@@ -95,3 +291,78 @@ def localmeantime(utc, longitude):
     lmt = utc + datetime.timedelta(seconds=round(4 * 60 * longitude))
     lmt = lmt.replace(tzinfo=None)
     return lmt
+
+
+def greatest_eclipse_tt(canondata):
+    '''
+    TT julian date of greatest eclipse for an entry in the Espenak canon, the canon's dates are on the Julian
+    calendar before 1582 Oct 15
+    :param canondata: row from get_canon_Espenak
+    :return: float julian date (TT)
+    '''
+    atoms = canondata['date_ut1'].split('-')
+    year = int(atoms[-3])
+    if len(atoms) == 4:
+        year *= -1
+    month = months.index(atoms[-2])
+    day = int(atoms[-1])
+    H, M, S = canondata['ge_time_td'].split(':')
+    jdn = julian_day(year, month, day, julian_before=GREGORIAN_START)
+    tt = jdn - 0.5 + (int(H) * 3600 + int(M) * 60 + int(S)) / 86400
+    if canondata.get('delta_t') is not None:
+        # the date is UT1 and the time TD, delta T can push greatest eclipse across midnight in TD
+        ut1 = tt - canondata['delta_t'] / 86400
+        tt -= math.floor(ut1 + 0.5) - jdn
+    return tt
+
+
+def utc_iso_to_tt(utciso):
+    '''
+    TT julian date of a UTC ISO 8601 time stamp with an optional sign on the year, ex. +2024-04-08T18:36:24.3Z,
+    dates before 1582 Oct 15 are on the Julian calendar as Jubier, GSFC and the canon give them, and times
+    before 1972 (when leap seconds began) are taken as UT1
+    '''
+    m = re.match(r'([+-]?\d+)-(\d+)-(\d+)T(\d+):(\d+):([\d.]+)Z?$', utciso.strip())
+    if m is None:
+        raise ValueError(f"unable to parse time stamp {utciso}")
+    year, month, day, hour, minute = [int(x) for x in m.groups()[:5]]
+    # ts.utc is proleptic Gregorian, shift Julian calendar dates by the difference between the calendars
+    day += julian_day(year, month, day, julian_before=GREGORIAN_START) - julian_day(year, month, day)
+    if year < 1972:
+        return ts.ut1(year, month, day, hour, minute, float(m.group(6))).tt
+    return ts.utc(year, month, day, hour, minute, float(m.group(6))).tt
+
+
+def signed_utc_iso(t, places=0):
+    '''
+    utc_iso() of a skyfield time with an explicit sign and 4 digit year, as used throughout the local circumstances
+    :param t: skyfield Time, scalar or array
+    :param places: decimal places of the seconds
+    :return: string or list of strings, +YYYY-MM-DDTHH:MM:SSZ
+    '''
+    utcisos = t.utc_iso(places=places)
+    if isinstance(utcisos, str):
+        return signed_iso(utcisos)
+    return [signed_iso(utciso) for utciso in utcisos]
+
+
+def signed_iso(utciso):
+    atoms = utciso.split('-')
+    if utciso.startswith('-'):
+        thesign = '-'
+    else:
+        thesign = '+'
+    return f"{thesign}{int(atoms[-3]):04}-{'-'.join(atoms[-2:])}"
+
+
+def json_safe(value):
+    '''NaN to None, numpy scalars to python, for json.dumps'''
+    if isinstance(value, dict):
+        return {k: json_safe(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_safe(v) for v in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
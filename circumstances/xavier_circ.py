@@ -1,20 +1,26 @@
 import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pprint import pprint
 
-import requests_cache
-from bs4 import BeautifulSoup
+import lxml.html
 
-session = requests_cache.CachedSession(f"caches/xhttp.sqllite")
+from circumstances import metrics
+from circumstances.utils import cached_session
 
+SESSION_CACHE = 'caches/xhttp.sqllite'
+cdata_re = re.compile(r'<!\[CDATA\[(.*?)\s*\]\]>', re.S)
 
-def get_jubier_circumstances(angle=0, eclipse="+20231014", height=0, latstr="", lonstr="", DEBUG=False):
+
+def get_jubier_circumstances(angle=0, eclipse="+20231014", height=0, latstr="", lonstr="", DEBUG=False,
+                             session=None):
     '''
     :param angle: viewing angle of the observer normally populated by Google Earth
     :param eclipse: UTC date of the eclipse to calculate for of the form [+-]YYYYMMDD
     :param height: observer height in meters
     :param latstr:
     :param lonstr:
-    :param DEBUG:
+    :param DEBUG: read the KML from, and keep copies of it in, caches/foo.xml and caches/foo.html
+    :param session: requests session to fetch with (default, the calling thread's session for SESSION_CACHE)
     :return:
     '''
 
@@ -23,26 +29,63 @@ def get_jubier_circumstances(angle=0, eclipse="+20231014", height=0, latstr="",
         sa = fp.readlines()
         fp.close()
         s = ' '.join(sa)
+        fp = open('caches/foo.xml', 'w')
+        fp.writelines(s)
+        fp.close()
+        fp = open('caches/foo.html', 'w')
+        fp.writelines(s)
+        fp.close()
     else:
-        s = fetch_google_circ(eclipse, height, latstr, lonstr)
-    fp = open('caches/foo.xml', 'w')
-    fp.writelines(s)
-    fp.close()
+        s = fetch_google_circ(eclipse, height, latstr, lonstr, session=session)
+    try:
+        data = parse_jubier_kml(s)
+    except ValueError:
+        if DEBUG:
+            text_file = open("caches/googlecirc.html", "w")
+            text_file.write(s)
+            text_file.close()
+        raise
+    return data
+
+
+def get_jubier_circumstances_batch(queries, max_workers=8):
+    '''
+    fetches and parses local circumstances for many (eclipse, location) pairs concurrently, each worker thread
+    keeps its own session and connection to Xavier's site
+    :param queries: iterable of dicts of get_jubier_circumstances keyword arguments (eclipse, height, latstr, lonstr)
+    :param max_workers: number of concurrent requests to Xavier's site
+    :return: list of results in the same order as queries, None where there is no eclipse or the request failed
+    '''
+    queries = list(queries)
+    results = [None] * len(queries)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(get_jubier_circumstances, **query): n for n, query in enumerate(queries)}
+        for future in as_completed(futures):
+            n = futures[future]
+            try:
+                results[n] = future.result()
+            except Exception as e:
+                print(f"error getting Jubier circumstances for {queries[n]}, {e}")
+    return results
+
+
+@metrics.timed('parse', source='jubier')
+def parse_jubier_kml(s):
+    '''
+    parses the KML returned by Xavier's Google Earth circumstances service, the circumstance tables live in the
+    second CDATA block and are read in a single pass with lxml
+    :param s: KML text
+    :return: dictionary of local circumstances, None when there is no eclipse at the location
+    '''
     if 'NO&nbsp;SOLAR&nbsp;ECLIPSE' in s:
         return None
-    jkl = s.split('<![CDATA[')
-    html, _ = jkl[2].split(' ]]')
-    fp = open('caches/foo.html', 'w')
-    fp.writelines(s)
-    fp.close()
-    soup = BeautifulSoup(html, 'html.parser')
-
-    tables = soup.find_all('table')
+    cdata = cdata_re.findall(s)
+    if len(cdata) < 2:
+        raise ValueError("unexpected KML, circumstance tables not found")
+    root = lxml.html.fromstring(cdata[1])
+    tables = [[[cell_parts(td) for td in tr.iter('td')] for tr in table.iter('tr')] for table in root.iter('table')]
     if len(tables) < 4:
-        text_file = open("caches/googlecirc.html", "w")
-        text_file.write(s)
-        text_file.close()
-        raise
+        raise ValueError(f"unexpected KML, expected 4 circumstance tables found {len(tables)}")
 
     data = {}
     get_google_circ_parse_table_1(data, tables[1])
@@ -51,27 +94,39 @@ def get_jubier_circumstances(angle=0, eclipse="+20231014", height=0, latstr="",
     return data
 
 
+def cell_parts(td):
+    '''
+    text of a table cell split on its <br> tags, with any other markup flattened
+    '''
+    parts = [td.text or '']
+    for child in td:
+        if child.tag == 'br':
+            parts.append(child.tail or '')
+        else:
+            parts[-1] += child.text_content() + (child.tail or '')
+    return parts
+
+
 def get_google_circ_parse_table_3(iop, thistable):
-    year = None
-    rows = thistable.find_all('tr')
+    rows = thistable
     for eventshort in ['c1', 'c2', 'c3', 'c4']:
         iop[eventshort] = {'utc_datetime': None, 'ordinal': None}
     for row in rows[1:]:
-        cells = row.find_all('td')
-        event = cells[0].text
+        cells = [''.join(parts) for parts in row]
+        event = cells[0]
         x = re.search("\((\w+)", event)
         if x:
             eventshort = x.group(1).lower()
         else:
             eventshort = event
-        date = cells[1].text
-        time = cells[2].text
-        alt = cleanupvalues(cells[3].text)
-        azi = cleanupvalues(cells[4].text)
-        p = cleanupvalues(cells[5].text)
-        v = cleanupvalues(cells[6].text)
+        date = cells[1]
+        time = cells[2]
+        alt = cleanupvalues(cells[3])
+        azi = cleanupvalues(cells[4])
+        p = cleanupvalues(cells[5])
+        v = cleanupvalues(cells[6])
         try:
-            lc = cleanupvalues(cells[7].text)
+            lc = cleanupvalues(cells[7])
         except:
             lc = None
         if lc is not None:
@@ -95,22 +150,6 @@ def get_google_circ_parse_table_3(iop, thistable):
                            'alt_str': altstr,
                            'cardinal': degrees_to_cardinal(azi),
                            'p': p, 'v': v, 'lc_sec': lc}
-        # '2024-04-08T17:58:50.3Z'
-        year = int(date[:4])
-        month = int(date[5:7])
-        day = int(date[8:10])
-        hour = int(time[:2])
-        minute = int(time[3:5])
-        if len(time) == 5:
-            second = 0
-        else:
-            try:
-                second = float(time[6:].replace('*', ''))
-            except Exception as e:
-                print(e)
-
-        # iop[eventshort]['tt'] = ts.utc(year, month, day, hour, minute, second)
-        # iop[eventshort]['ordinal'] = iop[eventshort]['tt'].toordinal()
 
 
 def degrees_to_cardinal(d):
@@ -128,14 +167,14 @@ def degrees_to_cardinal(d):
 
 
 def get_google_circ_parse_table_2(iop, thistable):
-    rows = thistable.find_all('tr')
-    depthcell = rows[0].find_all('td')[0].contents
-    if len(depthcell) == 5:
-        iop['umberal depth'], _, iop['path width'], _, iop['obscuration'] = depthcell
-    elif len(depthcell) == 3:
+    rows = thistable
+    depthcell = rows[0][0]
+    if len(depthcell) == 3:
+        iop['umberal depth'], iop['path width'], iop['obscuration'] = depthcell
+    elif len(depthcell) == 2:
         iop['umberal depth'] = depthcell[0].replace(u'\xa0', u' ')
         iop['path width'] = None
-        iop['obscuration'] = depthcell[2].replace(u'\xa0', u' ')
+        iop['obscuration'] = depthcell[1].replace(u'\xa0', u' ')
     elif len(depthcell) == 1:
         iop['umberal depth'] = None
         iop['path width'] = None
@@ -154,11 +193,11 @@ def get_google_circ_parse_table_2(iop, thistable):
         iop['path_width_km'] = float(iop['path width'].replace('km', ''))
         iop['path_width_mi'] = round(iop['path_width_km'] * 0.621371, 1)
 
-    magnitudecell = rows[0].find_all('td')[4].contents
-    if len(magnitudecell) == 5:
-        iop['mag'], _, iop['moon/sun size ratio'], _, iop['umbral velocity'] = magnitudecell
-    elif len(magnitudecell) == 3:
-        iop['mag'], _, iop['moon/sun size ratio'] = magnitudecell
+    magnitudecell = rows[0][4]
+    if len(magnitudecell) == 3:
+        iop['mag'], iop['moon/sun size ratio'], iop['umbral velocity'] = magnitudecell
+    elif len(magnitudecell) == 2:
+        iop['mag'], iop['moon/sun size ratio'] = magnitudecell
         iop['umbral velocity'] = None
     elif len(magnitudecell) == 1:
         iop['mag'] = None
@@ -192,17 +231,17 @@ def cleanupvalues(v):
 
 
 def get_google_circ_parse_table_1(iop, thistable):
-    rows = thistable.find_all('tr')
-    iop['lat'] = cleanupvalues(rows[0].find_all('td')[2].text.replace(u'\xa0', u' ').replace('º', ''))
-    iop['lon'] = cleanupvalues(rows[1].find_all('td')[2].text.replace(u'\xa0', u' ').replace('º', ''))
+    rows = thistable
+    iop['lat'] = cleanupvalues(''.join(rows[0][2]).replace(u'\xa0', u' ').replace('º', ''))
+    iop['lon'] = cleanupvalues(''.join(rows[1][2]).replace(u'\xa0', u' ').replace('º', ''))
 
     iop['duration'] = None
     iop['duration_limb_corrected'] = None
-    durationcell = rows[0].find_all('td')[4].contents
-    if len(durationcell) == 3:
+    durationcell = rows[0][4]
+    if len(durationcell) == 2:
         iop['duration'] = cleanupvalues(durationcell[0])
-        iop['duration_limb_corrected'] = cleanupvalues(durationcell[2])
-    elif len(durationcell) < 3:
+        iop['duration_limb_corrected'] = cleanupvalues(durationcell[1])
+    elif len(durationcell) < 2:
         iop['duration'] = str(durationcell[0])
     for durattr in ['duration', 'duration_limb_corrected']:
         if iop[durattr] is None:
@@ -217,8 +256,10 @@ def get_google_circ_parse_table_1(iop, thistable):
     #
 
 
-def fetch_google_circ(eclipse, height, latstr, lonstr):
+def fetch_google_circ(eclipse, height, latstr, lonstr, session=None):
     # doc http://xjubier.free.fr/en/site_pages/solar_eclipses/xSE_GoogleMap3_Help.html
+    if session is None:
+        session = cached_session(SESSION_CACHE)
     url = f'http://xjubier.free.fr/php/GE_xSE_LocalCircumstances.php?Eclipse={eclipse}&Details=1&Release=100&&HTTPCLIENT=7.3.6.9345,2.2,Google+Earth+Pro,en&BBOX={lonstr},{latstr},{height},0,0'
     headers = {
         'Accept': 'application/vnd.google-earth.kml+xml, application/vnd.google-earth.kmz, image/*, */*',
@@ -227,7 +268,9 @@ def fetch_google_circ(eclipse, height, latstr, lonstr):
         'Accept-Encoding': 'gzip, deflate',
         'Accept-Language': 'en-US,*'
     }
-    r = session.get(url, headers=headers)
+    with metrics.stage('http', source='jubier'):
+        r = session.get(url, headers=headers)
+    metrics.http_response('jubier', r)
     if not (r.from_cache, url):
         print(url, 'not from cache')
     s = r.text
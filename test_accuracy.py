@@ -0,0 +1,24 @@
+import unittest
+
+from benchmarks.accuracy import MAX_ERROR_S, TIER_ERROR_S, load_golden_dataset, run_harness
+
+
+class PrecisionTiers(unittest.TestCase):
+
+    def test_tiers_within_bounds(self):
+        golden = load_golden_dataset()
+        self.assertEqual('analytic', golden['source'])
+        report = run_harness(golden=golden)
+        self.assertEqual(set(TIER_ERROR_S), set(report))
+        for tier, result in report.items():
+            self.assertEqual(len(golden['cases']), len(result['cases']))
+            for case in result['cases']:
+                self.assertTrue(all(isinstance(e, float) for e in case['errors_s'].values()), (tier, case))
+            for name, errors in result['errors_s'].items():
+                bound = MAX_ERROR_S if name == 'max' else TIER_ERROR_S[tier]
+                self.assertGreater(errors['n'], 0)
+                self.assertLessEqual(errors['max'], bound, (tier, name))
+
+
+if __name__ == '__main__':
+    unittest.main()
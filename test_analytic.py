@@ -0,0 +1,56 @@
+import unittest
+
+import numpy as np
+
+from circumstances.analytic import analytic_positions, eclipse_span, hybrid_contacts, moon_position, sun_position
+from circumstances.path import shadow_axis_intercept
+from circumstances.skyfieldcalcs import eclipse_window, geocentric_positions, local_contacts
+from circumstances.sweep import analytic_source
+from circumstances.utils import greatest_eclipse_tt, ts
+
+
+class AnalyticTheory(unittest.TestCase):
+
+    def test_moon_position(self):
+        # Meeus example 47.a, 1992 April 12 0h TD
+        longitude, latitude, distance = moon_position(2448724.5)
+        self.assertAlmostEqual(133.167265, longitude, places=4)
+        self.assertAlmostEqual(-3.229126, latitude, places=5)
+        self.assertAlmostEqual(368409.7, distance, places=0)
+
+    def test_sun_position(self):
+        # Meeus example 25.a, 1992 October 13 0h TD
+        longitude, distance = sun_position(2448908.5)
+        self.assertAlmostEqual(199.90895, longitude, places=2)
+        self.assertAlmostEqual(0.99766, distance / 149597870.7, places=4)
+
+    def test_greatest_eclipse(self):
+        # 2017 August 21, greatest eclipse 18:26:40 TD at 36 58N 87 40W
+        g = analytic_positions(ts.tt(2017, 8, 21, 18, 26, np.array([40, 100])))
+        (lat, lon), found = shadow_axis_intercept(g['sun'], g['moon'])
+        self.assertAlmostEqual(36.97, lat[0], delta=0.3)
+        self.assertAlmostEqual(-87.67, lon[0], delta=0.3)
+
+    def test_eclipse_span(self):
+        scan = analytic_positions(ts.utc(2024, 4, 8, 12, range(-1440, 1441)))
+        first, last = eclipse_span(scan, [32.7767, -33.45], [-96.797, -70.67])
+        # Dallas, C1 17:23:20 and C4 20:02:48 UT, never seen from Santiago
+        self.assertAlmostEqual(ts.utc(2024, 4, 8, 17, 23, 20).tt, first[0], delta=5 / 1440)
+        self.assertAlmostEqual(ts.utc(2024, 4, 8, 20, 2, 48).tt, last[0], delta=5 / 1440)
+        self.assertTrue(np.isnan(first[1]))
+
+    def test_hybrid_contacts(self):
+        # the analytic theory stands in for the kernel, the windows must find what a pass over the day finds
+        eph = analytic_source()
+        tt = greatest_eclipse_tt({'date_ut1': '2024-Apr-08', 'ge_time_td': '18:18:29', 'delta_t': 74})
+        full = local_contacts(geocentric_positions(eclipse_window(tt, hours=4), eph), 32.7767, -96.797)
+        hybrid = hybrid_contacts(tt, 32.7767, -96.797, eph=eph)
+        self.assertEqual(full['type'][0], hybrid['type'][0])
+        for attr in ['c1', 'c2', 'mid', 'c3', 'c4']:
+            self.assertAlmostEqual(full[attr][0], hybrid[attr][0], delta=1e-3 / 86400)
+        self.assertAlmostEqual(full['duration'][0], hybrid['duration'][0], delta=1e-3)
+        self.assertTrue(np.isnan(hybrid_contacts(tt, -33.45, -70.67, eph=eph)['c1'][0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import json
+import os
+import tempfile
+import unittest
+
+from circumstances.batch import dedupe_sites, load_checkpoint, read_sites, run_batch, worker_driver
+
+
+def echo_site(site, years, places):
+    '''stands in for localize_site, which needs Chrome'''
+    if site['name'] == 'Nowhere':
+        raise ValueError('no such place')
+    return {'key': site['key'], 'names': site['names'], 'years': years}
+
+
+class marker_driver(object):
+    '''stands in for a selenium driver, leaves a file behind when it is quit'''
+
+    def __init__(self, directory):
+        self.filename = os.path.join(directory, f"driver-{os.getpid()}")
+        open(self.filename, 'w').close()
+
+    def quit(self):
+        os.rename(self.filename, self.filename + '.quit')
+
+
+def driver_site(site, years, places):
+    worker_driver(lambda: marker_driver(site['directory']))
+    return {'key': site['key']}
+
+
+class Batch(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.csv = os.path.join(self.directory.name, 'sites.csv')
+        fp = open(self.csv, 'w')
+        fp.write('name,lat,lon,ele,tz\n'
+                 'Raleigh,35.7945,-78.6376,100,US/Eastern\n'
+                 'Raleigh City Hall,35.7912,-78.6421,100,US/Eastern\n'
+                 'Raleigh Airport,35.7912,-78.6421,130,US/Eastern\n'
+                 'Dallas,32.7767,-96.797,,\n'
+                 'Nowhere,0,0,,\n')
+        fp.close()
+        self.output = os.path.join(self.directory.name, 'out', 'results.jsonl')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_read_and_dedupe(self):
+        sites = read_sites(self.csv)
+        self.assertEqual({'name': 'Raleigh', 'lat': 35.7945, 'lon': -78.6376, 'ele': 100, 'tz': 'US/Eastern'},
+                         sites[0])
+        self.assertNotIn('ele', sites[3])
+        unique = dedupe_sites(sites)
+        # the same place at another elevation is another site
+        self.assertEqual(['35.79,-78.64,100 US/Eastern', '35.79,-78.64,130 US/Eastern', '32.78,-96.8', '0.0,0.0'],
+                         list(unique))
+        self.assertEqual(['Raleigh', 'Raleigh City Hall'], unique['35.79,-78.64,100 US/Eastern']['names'])
+
+    def test_resume(self):
+        sites = read_sites(self.csv)
+        report = run_batch(sites, self.output, years=[2024], max_workers=2, task=echo_site)
+        self.assertEqual({'done': 3, 'skipped': 0, 'failed': 1, 'merged': 1}, report)
+
+        # interrupted while writing a line
+        fp = open(self.output, 'a')
+        fp.write('{"key": "0,0", "na')
+        fp.close()
+        self.assertEqual({'35.79,-78.64,100 US/Eastern', '35.79,-78.64,130 US/Eastern', '32.78,-96.8'},
+                         load_checkpoint(self.output))
+
+        report = run_batch(sites, self.output, years=[2024], max_workers=2, task=echo_site)
+        self.assertEqual({'done': 0, 'skipped': 3, 'failed': 1, 'merged': 1}, report)
+        fp = open(self.output)
+        lines = [json.loads(line) for line in fp]
+        fp.close()
+        self.assertEqual(3, len(lines))
+
+    def test_drivers_quit(self):
+        sites = [dict(site, directory=self.directory.name) for site in read_sites(self.csv)]
+        report = run_batch(sites, self.output, max_workers=2, task=driver_site)
+        self.assertEqual(4, report['done'])
+        drivers = [filename for filename in os.listdir(self.directory.name) if filename.startswith('driver-')]
+        self.assertGreater(len(drivers), 0)
+        self.assertTrue(all(filename.endswith('.quit') for filename in drivers), drivers)
+
+
+if __name__ == '__main__':
+    unittest.main()
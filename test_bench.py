@@ -0,0 +1,25 @@
+import unittest
+
+from benchmarks.bench import run_benchmarks
+
+# the timings the suite was asked for, each from the fixtures shipped in benchmarks/fixtures
+REQUESTED = ['eclipse_fraction', 'circumstances_coarse', 'circumstances_fine', 'contact_points',
+             'get_canon_Espenak_cold', 'get_canon_Espenak_warm', 'process_gsfc_history_table', 'localize',
+             'distance_to_path', 'parse_jubier_kml']
+
+
+class OfflineBenchmarks(unittest.TestCase):
+
+    def test_requested(self):
+        results = run_benchmarks(repeat=1)['results']
+        for name in REQUESTED:
+            self.assertIn(name, results)
+            self.assertGreater(results[name]['best_s'], 0, name)
+        for name, result in results.items():
+            self.assertNotIn('error', result, name)
+        self.assertEqual(1, results['get_canon_Espenak_cold']['pages'])
+        self.assertEqual(224, results['get_canon_Espenak_warm']['eclipses'])
+
+
+if __name__ == '__main__':
+    unittest.main()
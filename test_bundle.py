@@ -0,0 +1,204 @@
+import hashlib
+import io
+import json
+import os
+import pickle
+import tempfile
+import unittest
+import zipfile
+
+import numpy as np
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+from circumstances.bundle import BUNDLE_VERSION, MANIFEST, cache_bundle, export_bundle, import_bundle
+from circumstances.circumstances import process_gsfc_history_table, solar_eclipse_local
+from circumstances.snapshot import eclipse_snapshot
+from circumstances.utils import OFFLINE_ENV, cached_session, ephemeris_file, installed_excerpts, load_ephemeris, \
+    offline_error, set_offline
+from testdata import gsfc_table
+
+elevation_url = 'https://api.opentopodata.org/v1/test-dataset?locations=32.78,-96.8'
+
+
+def cache_response(session, url, content):
+    '''stores a response in a requests_cache session as if it had been fetched'''
+    raw = urllib3.HTTPResponse(body=io.BytesIO(content), headers={'Content-Type': 'application/json'}, status=200,
+                               preload_content=False, request_url=url)
+    r = HTTPAdapter().build_response(requests.Request('GET', url).prepare(), raw)
+    r.content
+    session.cache.save_response(r)
+
+
+class Bundle(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.offline = os.environ.get(OFFLINE_ENV)
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+        os.makedirs('source/caches/gsfc_local')
+        eclipses, by_year = process_gsfc_history_table(gsfc_table)
+        entry = {'city': 'Dallas', 'lat': 32.78, 'lon': -96.8, 'ele': 100, 'centuries_checked': [20],
+                 'eclipses': {'+2024-Apr-08': eclipses['+2024-Apr-08']}, 'by_year': {}}
+        for filename, data in [('gsfc_local/32.78,-96.8.pickle', {'32.78,-96.8,100': entry}),
+                               ('espenak_solar_eclipse_canon.pickle', {'results': {}, 'otherdates': {}})]:
+            fp = open(f'source/caches/{filename}', 'wb')
+            pickle.dump(data, fp)
+            fp.close()
+        self.snapshot = eclipse_snapshot(np.arange(2 * 4 * 3 * 11, dtype=float).reshape(2, 4, 3, 11), 2460409.0,
+                                         600, meta={'corrections': 'apparent'})
+        self.snapshot.save('source/caches/snapshots/+2024-04-08')
+        cache_response(cached_session('source/caches/http.sqllite'), elevation_url,
+                       b'{"results": [{"elevation": 100}]}')
+        for filename in ['.abc.tmp', 'sites.jsonl']:  # not caches
+            open(f'source/caches/{filename}', 'w').close()
+        self.manifest = export_bundle('caches.zip', caches='source/caches')
+
+    def tearDown(self):
+        if self.offline is None:
+            os.environ.pop(OFFLINE_ENV, None)
+        else:
+            os.environ[OFFLINE_ENV] = self.offline
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def test_export(self):
+        kinds = {entry['name']: entry['kind'] for entry in self.manifest['entries']}
+        self.assertEqual({'caches/espenak_solar_eclipse_canon.pickle': 'canon', 'caches/http.sqllite': 'http',
+                          'caches/gsfc_local/32.78,-96.8.pickle': 'local',
+                          'caches/snapshots/+2024-04-08.json': 'snapshot',
+                          'caches/snapshots/+2024-04-08.npy': 'snapshot'}, kinds)
+        bundle = cache_bundle('caches.zip')
+        self.assertEqual([], bundle.verify())
+        self.assertEqual(100, bundle.load_pickle('caches/gsfc_local/32.78,-96.8.pickle')['32.78,-96.8,100']['ele'])
+        snapshot = bundle.snapshot('caches/snapshots/+2024-04-08')
+        np.testing.assert_array_equal(self.snapshot.coefficients, snapshot.coefficients)
+        self.assertEqual(600, snapshot.segment)
+        del snapshot
+        bundle.close()
+
+    def test_import_and_offline(self):
+        report = import_bundle('caches.zip', caches='caches')
+        self.assertEqual({'written': 5, 'unchanged': 0, 'kept': 0}, report)
+        self.assertEqual({'written': 0, 'unchanged': 5, 'kept': 0}, import_bundle('caches.zip', caches='caches'))
+        set_offline()
+        uut = solar_eclipse_local('Dallas', 32.7767, -96.797, timezone='US/Central')
+        self.assertEqual(100, uut.ele)  # from the bundled HTTP cache
+        self.assertIn('+2024-Apr-08', uut.get_year([2024])['eclipses'])
+        with self.assertRaises(offline_error):
+            solar_eclipse_local('Boston', 42.36, -71.06, timezone='US/Eastern')
+        with self.assertRaises(offline_error):
+            solar_eclipse_local('Boston', 42.36, -71.06, ele=10, timezone='US/Eastern').get_year([2024])
+        with self.assertRaises(offline_error):
+            load_ephemeris(-2000)
+
+    def test_damaged(self):
+        bundle = cache_bundle('caches.zip')
+        offset = bundle.offsets['caches/gsfc_local/32.78,-96.8.pickle']
+        bundle.close()
+        fp = open('caches.zip', 'r+b')
+        fp.seek(offset + 10)
+        byte = fp.read(1)
+        fp.seek(offset + 10)
+        fp.write(bytes([byte[0] ^ 0xff]))
+        fp.close()
+        bundle = cache_bundle('caches.zip')
+        self.assertEqual(['caches/gsfc_local/32.78,-96.8.pickle'], bundle.verify())
+        bundle.close()
+        with self.assertRaises(ValueError):
+            import_bundle('caches.zip', caches='caches')
+        self.assertFalse(os.path.exists('caches'))
+
+    def test_not_a_bundle(self):
+        archive = zipfile.ZipFile('other.zip', 'w', zipfile.ZIP_DEFLATED)
+        archive.writestr('a.txt', 'a')
+        archive.close()
+        with self.assertRaises(ValueError):
+            cache_bundle('other.zip')
+
+
+def write_bundle(filename, members):
+    '''
+    a bundle written member by member, as export_bundle lays one out
+    :param members: list of (name, content, extra manifest fields)
+    '''
+    entries = [dict({'name': name, 'kind': kind, 'size': len(content), 'sha256': hashlib.sha256(content).hexdigest()},
+                    **extra) for name, content, kind, extra in members]
+    archive = zipfile.ZipFile(filename, 'w', zipfile.ZIP_STORED)
+    archive.writestr(MANIFEST, json.dumps({'version': BUNDLE_VERSION, 'entries': entries}))
+    for name, content, kind, extra in members:
+        archive.writestr(name, content)
+    archive.close()
+
+
+def kernel_bundle(filename, kernel, first, last):
+    '''a bundle holding only an excerpt of kernel for years first to last, as export_bundle writes one'''
+    stem = kernel.split('.')[0]
+    write_bundle(filename, [(f"ephemeris/{stem}.{first}-{last}.bsp", f"{kernel} {first} {last}".encode(), 'ephemeris',
+                             {'kernel': kernel, 'years': [first, last]})])
+
+
+class Excerpts(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.offline = os.environ.get(OFFLINE_ENV)
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+        os.makedirs('ephemeris')
+        for name, first, last in [('narrow', 2020, 2030), ('narrower', 2022, 2024), ('wide', 2000, 2050)]:
+            kernel_bundle(f'{name}.zip', 'de421.bsp', first, last)
+
+    def tearDown(self):
+        if self.offline is None:
+            os.environ.pop(OFFLINE_ENV, None)
+        else:
+            os.environ[OFFLINE_ENV] = self.offline
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def install(self, name):
+        report = import_bundle(f'{name}.zip', caches='caches', ephemeris_dir='ephemeris')
+        return [status for status, n in report.items() if n == 1]
+
+    def test_coverage(self):
+        self.assertEqual(['written'], self.install('narrow'))
+        self.assertEqual({'de421.bsp': {'file': 'de421.2020-2030.bsp', 'years': [2020, 2030]}},
+                         installed_excerpts('ephemeris'))
+        self.assertEqual('de421.2020-2030.bsp', ephemeris_file(2025, ephemeris_dir='ephemeris'))
+        set_offline()
+        with self.assertRaises(offline_error):
+            ephemeris_file(2040, ephemeris_dir='ephemeris')
+        self.assertEqual(['kept'], self.install('narrower'))
+        self.assertEqual(['written'], self.install('wide'))
+        self.assertEqual(['de421.2000-2050.bsp', 'excerpts.json'], sorted(os.listdir('ephemeris')))
+        self.assertEqual('de421.2000-2050.bsp', ephemeris_file(2040, ephemeris_dir='ephemeris'))
+        self.assertEqual(['unchanged'], self.install('wide'))
+        self.assertEqual(['kept'], self.install('narrow'))
+
+    def test_traversal(self):
+        os.makedirs('caches')
+        excerpt = 'ephemeris/de421.2020-2030.bsp'
+        for members in [[('caches/../../escaped.txt', b'escaped', 'pickle', {})],
+                        [('caches/ok.pickle', b'ok', 'pickle', {}), ('elsewhere/escaped.txt', b'x', 'pickle', {})],
+                        [(excerpt, b'x', 'ephemeris', {'kernel': '../escaped.bsp', 'years': [2020, 2030]})],
+                        [(excerpt, b'x', 'ephemeris', {'kernel': 'de421.bsp', 'years': ['/', 2030]})]]:
+            write_bundle('crafted.zip', members)
+            with self.assertRaises(ValueError):
+                import_bundle('crafted.zip', caches='caches', ephemeris_dir='ephemeris')
+            self.assertEqual([], os.listdir('caches'))
+            self.assertEqual([], os.listdir('ephemeris'))
+        self.assertEqual(['caches', 'crafted.zip', 'ephemeris', 'narrow.zip', 'narrower.zip', 'wide.zip'],
+                         sorted(os.listdir('.')))
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, '..', 'escaped.txt')))
+
+    def test_full_kernel(self):
+        open('ephemeris/de421.bsp', 'w').close()
+        self.assertEqual(['kept'], self.install('wide'))
+        self.assertEqual('de421.bsp', ephemeris_file(2040, ephemeris_dir='ephemeris'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import pickle
+import tempfile
+import unittest
+
+from circumstances.canon_index import canon_index, degrees, get_canon_index
+from circumstances.circumstances import parse_canon_page
+
+# date, time TD, delta T, luna, saros, type, gamma, latitude and longitude of greatest eclipse
+eclipses = [('2006-Mar-29', '10:12:23', '65', '-82', '139', 'T', '0.3843', '23N', '17E'),
+            ('2017-Aug-21', '18:26:40', '69', '218', '145', 'T', '0.4367', '37N', '88W'),
+            ('2023-Oct-14', '18:00:41', '74', '286', '134', 'A', '0.3753', '11N', '83W'),
+            ('2024-Apr-08', '18:18:29', '74', '291', '139', 'T', '0.3431', '25N', '104W'),
+            ('2024-Oct-02', '18:46:13', '74', '297', '144', 'A', '-0.3509', '22S', '115W'),
+            ('2042-Apr-20', '02:17:30', '79', '514', '139', 'T', '0.2910', '27N', '137E'),
+            ('2060-Apr-30', '10:11:17', '87', '737', '139', 'T', '0.2799', '28N', '34E'),
+            ('-0500-Jan-01', '06:00:00', '17000', '-31000', '10', 'Pb', '1.4000', '65S', '170E')]
+
+
+def canon_page(rows):
+    cells = ''.join(f"<tr><td>{date}</td><td>{td}</td><td>{dt}</td><td>1</td><td>{luna}</td><td>{saros}</td>"
+                    f"<td>{kind}</td><td>p</td><td>{gamma}</td><td>1.0</td><td>{lat}</td><td>{lon}</td>"
+                    f"<td>70</td><td>198</td><td>04m28s</td></tr>"
+                    for date, td, dt, luna, saros, kind, gamma, lat, lon in rows)
+    return f"<html><table><tbody>{cells}</tbody></table></html>"
+
+
+class CanonIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.results = {}
+        self.otherdates = {}
+        parse_canon_page(canon_page(eclipses), self.results, self.otherdates)
+        self.index = canon_index(self.results)
+
+    def test_query(self):
+        self.assertEqual(['2024-Apr-08'], self.index.query(saros=139, eclipse_type='T', region='north_america'))
+        self.assertEqual(['2017-Aug-21', '2023-Oct-14', '2024-Apr-08'], self.index.query(region='north_america'))
+        self.assertEqual(['2023-Oct-14', '2024-Oct-02'], self.index.query(eclipse_type='A', years=(2020, 2030)))
+        self.assertEqual(['-0500-Jan-01'], self.index.query(eclipse_type='P'))
+        self.assertEqual([], self.index.query(eclipse_type='Pn'))
+        self.assertEqual(['2024-Oct-02', '2042-Apr-20', '2060-Apr-30'], self.index.query(gamma=(-0.36, 0.3)))
+        self.assertEqual(['2042-Apr-20'], self.index.query(region=(20, 30, 130, -170)))  # across 180
+        self.assertEqual(8, len(self.index.query()))
+
+    def test_saros_series(self):
+        self.assertEqual(['2006-Mar-29', '2024-Apr-08', '2042-Apr-20', '2060-Apr-30'],
+                         list(self.index.saros_series(139)))
+        self.assertEqual(['2042-Apr-20', '2060-Apr-30'], list(self.index.saros_series(139, start='2024-Oct-02')))
+        self.assertEqual(['2024-Apr-08', '2006-Mar-29'],
+                         list(self.index.saros_series(139, start='2024-Apr-08', reverse=True)))
+        self.assertEqual('-0500-Jan-01', next(self.index.chronological()))
+
+    def test_degrees(self):
+        self.assertEqual(-104, degrees('104W'))
+        self.assertEqual(22.5, degrees(' 22.5N'))
+        self.assertIsNone(degrees('-'))
+
+    def test_persisted(self):
+        cwd = os.getcwd()
+        directory = tempfile.TemporaryDirectory()
+        os.chdir(directory.name)
+        try:
+            os.makedirs('caches')
+            fp = open('caches/espenak_solar_eclipse_canon.pickle', 'wb')
+            pickle.dump({'results': self.results, 'otherdates': self.otherdates}, fp)
+            fp.close()
+            index = get_canon_index()
+            self.assertEqual(['2024-Apr-08'], index.query(saros=139, years=(2024, 2024)))
+            fp = open('caches/espenak_solar_eclipse_canon.pickle', 'rb')
+            self.assertEqual(index.order, pickle.load(fp)['index'].order)
+            fp.close()
+            self.assertEqual(index.order, get_canon_index().order)
+        finally:
+            os.chdir(cwd)
+            directory.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import hashlib
+import io
+import os
+import pickle
+import tempfile
+import unittest
+
+import urllib3
+from requests.adapters import BaseAdapter, HTTPAdapter
+
+from circumstances.circumstances import canon_page_url, get_canon_Espenak
+from circumstances.utils import cached_session
+
+
+def canon_page(rows):
+    """eclipsewise century page with rows of date, time TD, delta T, type and gamma"""
+    cells = ''.join(f"<tr><td>{date}</td><td>{td}</td><td>{dt}</td><td>1</td><td>300</td><td>139</td>"
+                    f"<td>{kind}</td><td>p</td><td>{gamma}</td><td>1.0566</td><td>25.3N</td><td>104.1W</td>"
+                    f"<td>70</td><td>198</td><td>04m28s</td></tr>" for date, td, dt, kind, gamma in rows)
+    return f"<html><table><tbody>{cells}</tbody></table></html>"
+
+
+class etag_adapter(BaseAdapter):
+    """serves pages from a dictionary of url to html, answering conditional requests with 304"""
+
+    def __init__(self, pages):
+        super().__init__()
+        self.pages = pages
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        text = self.pages[request.url].encode()
+        etag = f'"{hashlib.md5(text).hexdigest()}"'
+        status, body = (304, b'') if request.headers.get('If-None-Match') == etag else (200, text)
+        self.requests.append((request.url, request.headers.get('If-None-Match'), status))
+        raw = urllib3.HTTPResponse(body=io.BytesIO(body), headers={'ETag': etag, 'Content-Type': 'text/html'},
+                                   status=status, preload_content=False, request_url=request.url)
+        return HTTPAdapter().build_response(request, raw)
+
+    def close(self):
+        pass
+
+
+class CanonRefresh(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+        self.pages = {canon_page_url(1901): canon_page([('1999-Aug-11', '11:04:09', '64', 'T', '0.5062')]),
+                      canon_page_url(2001): canon_page([('2024-Apr-08', '18:18:29', '74', 'T', '0.3431')])}
+        self.adapter = etag_adapter(self.pages)
+        cached_session('caches/espenak_eclipse_cache.sqlite').mount('https://eclipsewise.com/', self.adapter)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def test_refresh(self):
+        canon, otherdates = get_canon_Espenak(1901, 2101)
+        self.assertEqual(['1999-Aug-11', '2024-Apr-08'], sorted(canon))
+        self.assertEqual('2024-Apr-08', otherdates['+2024-Apr-09'])
+        # a correction to one century and a new eclipse in it
+        self.pages[canon_page_url(2001)] = canon_page([('2023-Oct-14', '18:00:41', '74', 'A', '0.3753'),
+                                                       ('2024-Apr-08', '18:18:29', '74', 'T', '0.3432')])
+        self.adapter.requests.clear()
+        canon, otherdates = get_canon_Espenak(1901, 2101, force=True)
+        self.assertEqual(['1999-Aug-11', '2023-Oct-14', '2024-Apr-08'], sorted(canon))
+        self.assertEqual(0.3432, canon['2024-Apr-08']['gamma'])
+        self.assertEqual('2023-Oct-14', otherdates['+2023-Oct-14'])
+        # both centuries were revalidated with the ETag kept in the canon, only the corrected one was sent again
+        self.assertEqual(2, len([etag for url, etag, status in self.adapter.requests if etag is not None]))
+        self.assertEqual([304, 200], [status for url, etag, status in self.adapter.requests])
+        fp = open('caches/espenak_solar_eclipse_canon.pickle', 'rb')
+        pages = pickle.load(fp)['pages']
+        fp.close()
+        self.assertEqual([1901, 2001], sorted(pages))
+        self.assertEqual(canon_page_url(2001), pages[2001]['url'])
+        self.adapter.requests.clear()
+        canon, otherdates = get_canon_Espenak(1901, 2101, force=True)
+        self.assertEqual([304, 304], [status for url, etag, status in self.adapter.requests])
+        self.assertEqual(3, len(canon))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+
+import numpy as np
+from skyfield.api import GREGORIAN_START, load
+from skyfield.timelib import julian_day
+
+from circumstances.analytic import analytic_positions
+from circumstances.deltat import EARTH_ROTATION, deltat_circumstances, deltat_longitudes, ut1_iso
+from circumstances.skyfieldcalcs import eclipse_positions, eclipse_window, local_contacts
+from circumstances.utils import greatest_eclipse_tt, ts, utc_iso_to_tt
+
+total = {'date_ut1': '2024-Apr-08', 'ge_time_td': '18:18:29', 'delta_t': 74, 'delta_sigma_s': 0}
+
+
+class DeltaT(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tt = greatest_eclipse_tt(total)
+        cls.geo = eclipse_positions(cls.tt, engine='analytic')
+
+    def test_rotation(self):
+        # positions computed with delta T 60 s larger, against the site turned by 60 s of rotation
+        shifted = load.timescale()
+        shifted.delta_t_function = lambda tt: ts.delta_t_function(tt) + 60
+        geo = analytic_positions(shifted.tt_jd(self.tt, (eclipse_window(self.tt).tt - self.tt)))
+        model = float(ts.tt_jd(self.tt).delta_t)
+        expected = local_contacts(geo, 32.78, -96.8)
+        result = local_contacts(self.geo, 32.78, deltat_longitudes(-96.8, model + 60, model))
+        self.assertEqual('T', result['type'][0])
+        for attr in ['c1', 'c2', 'c3', 'c4']:
+            self.assertAlmostEqual(expected[attr][0], result[attr][0], delta=1 / 86400)
+        self.assertAlmostEqual(-96.8 - 60 * EARTH_ROTATION, float(deltat_longitudes(-96.8, model + 60, model)))
+
+    def test_certain(self):
+        summary = deltat_circumstances(total, 32.78, -96.8, n=200, geo=self.geo)
+        self.assertEqual(1.0, summary['probability']['total'])
+        c2 = summary['contacts']['c2']
+        self.assertEqual(1.0, c2['probability'])
+        self.assertAlmostEqual(utc_iso_to_tt('+2024-04-08T18:40:44Z'), utc_iso_to_tt(c2['ut1_iso'][50]),
+                               delta=60 / 86400)
+        self.assertLess(c2['spread_s'], 1)
+
+    def test_uncertain(self):
+        summary = deltat_circumstances(total, 32.78, -96.8, n=4000, sigma=3000, seed=1, geo=self.geo,
+                                       keep_samples=True)
+        self.assertLess(0.05, summary['probability']['total'])
+        self.assertLess(summary['probability']['total'], 0.95)
+        self.assertEqual(1.0, summary['probability']['eclipse'])
+        self.assertAlmostEqual(summary['probability']['total'], summary['contacts']['c2']['probability'])
+        c1 = summary['contacts']['c1']['ut1_iso']
+        self.assertLess(utc_iso_to_tt(c1[5]), utc_iso_to_tt(c1[95]))
+        self.assertAlmostEqual(3000, np.std(summary['draws']['delta_t']), delta=150)
+        self.assertGreater(summary['duration']['percentiles'][95], summary['duration']['percentiles'][5])
+
+    def test_ut1_iso(self):
+        jd = julian_day(-584, 5, 28, julian_before=GREGORIAN_START) - 0.5 + 0.25
+        self.assertEqual('-0584-05-28T06:00:00Z', ut1_iso(jd))
+        self.assertEqual('+2024-04-08T18:40:44Z', ut1_iso(ts.utc(2024, 4, 8, 18, 40, 44).ut1))
+        self.assertAlmostEqual(ts.ut1_jd(jd).tt, utc_iso_to_tt(ut1_iso(jd)), delta=1 / 86400)
+
+
+if __name__ == '__main__':
+    unittest.main()
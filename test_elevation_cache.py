@@ -0,0 +1,101 @@
+import copy
+import os
+import pickle
+import tempfile
+import unittest
+
+from circumstances.circumstances import elevation_adjusted, elevation_sensitivity, process_gsfc_history_table, \
+    solar_eclipse_local
+from testdata import gsfc_table, jsex_driver
+
+
+class ElevationCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+        os.makedirs('caches/gsfc_local')
+        eclipses, by_year = process_gsfc_history_table(gsfc_table)
+        self.entry = {'city': 'Dallas', 'lat': 32.78, 'lon': -96.8, 'ele': 100, 'centuries_checked': [20],
+                      'eclipses': {'+2024-Apr-08': eclipses['+2024-Apr-08']}, 'by_year': {}}
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def write_cache(self, data):
+        fp = open('caches/gsfc_local/32.78,-96.8.pickle', 'wb')
+        pickle.dump(data, fp)
+        fp.close()
+
+    def test_nearby_elevation(self):
+        self.write_cache({'32.78,-96.8,100': self.entry})
+        uut = solar_eclipse_local('Dallas', 32.7767, -96.797, ele=140, timezone='US/Central')
+        self.assertEqual('32.78,-96.8,140', uut.key)
+        data = uut.get_year([2024])
+        self.assertEqual(140, data['ele'])
+        self.assertEqual(100, data['ele_source'])
+        c2 = data['eclipses']['+2024-Apr-08']['c2']
+        self.assertAlmostEqual(0.0006, c2['dt_dh'], delta=0.0002)  # seconds per meter
+        self.assertAlmostEqual(40 * c2['dt_dh'], (c2['tt'].tt - self.entry['eclipses']['+2024-Apr-08']['c2']['tt'].tt)
+                               * 86400, places=3)
+        # the rates are kept with the cached entry, and the adjusted entry under the site's own key
+        data, years_in_cache, years_not_in_cache, filename_pickle = uut._get_cache_local(years=[2024])
+        self.assertIn('dt_dh', data['32.78,-96.8,100']['eclipses']['+2024-Apr-08']['c1'])
+        self.assertEqual(100, data['32.78,-96.8,140']['ele_source'])
+        self.assertEqual([2024], years_in_cache)
+        self.assertEqual(c2['tt'].tt, uut.get_year([2024])['eclipses']['+2024-Apr-08']['c2']['tt'].tt)
+        # and isn't adjusted again for another elevation
+        self.assertIsNone(solar_eclipse_local('Dallas', 32.7767, -96.797, ele=160)._nearby_elevation(data, [2024]))
+
+    def test_legacy_key(self):
+        self.write_cache({'32.7767,-96.797,100': self.entry})
+        uut = solar_eclipse_local('Dallas', 32.7767, -96.797, ele=100, timezone='US/Central')
+        data, years_in_cache, years_not_in_cache, filename_pickle = uut._get_cache_local(years=[2024])
+        self.assertEqual([2024], years_in_cache)
+        self.assertNotIn('32.7767,-96.797,100', data)
+
+    def test_exact_entry_preferred(self):
+        # the site's own scrape covers this century, the entry 40 m down also covers 500 BC
+        eclipses, by_year = process_gsfc_history_table(gsfc_table)
+        exact = copy.deepcopy(self.entry)
+        exact['ele'] = 140
+        exact['eclipses']['+2024-Apr-08']['obs'] = 0.5
+        self.entry['centuries_checked'].append(-5)
+        self.entry['eclipses']['-0500-Jan-01'] = eclipses['-0500-Jan-01']
+        self.write_cache({'32.78,-96.8,100': self.entry, '32.78,-96.8,140': exact})
+        uut = solar_eclipse_local('Dallas', 32.7767, -96.797, ele=140, timezone='US/Central')
+        data = uut.get_year([2024, -500])
+        self.assertEqual(['-0500-Jan-01', '+2024-Apr-08'], list(data['eclipses']))
+        self.assertEqual(0.5, data['eclipses']['+2024-Apr-08']['obs'])
+        self.assertEqual([-500, 2024], list(data['by_year']))
+        self.assertEqual(100, data['ele_source'])
+        self.assertEqual([-5, 20], data['centuries_checked'])
+        # the site's own entry is left as it was
+        data, years_in_cache, years_not_in_cache, filename_pickle = uut._get_cache_local(years=[2024, -500])
+        self.assertNotIn('ele_source', data['32.78,-96.8,140'])
+        self.assertEqual([20], data['32.78,-96.8,140']['centuries_checked'])
+        self.assertEqual([-500], years_not_in_cache)
+
+    def test_fetch_replaces_adjusted(self):
+        elevation_sensitivity(self.entry, 32.78, -96.8)
+        self.write_cache({'32.78,-96.8,100': self.entry, '32.78,-96.8,140': elevation_adjusted(self.entry, 140)})
+        driver = jsex_driver()
+        uut = solar_eclipse_local('Dallas', 32.7767, -96.797, ele=140, timezone='US/Central', driver=driver)
+        # the entry 40 m down doesn't cover 2500, both centuries are fetched into a fresh entry
+        data = uut.get_year([2024, 2500])
+        self.assertEqual([20, 25], driver.clicks)
+        self.assertNotIn('ele_source', data)
+        self.assertEqual([20, 25], data['centuries_checked'])
+        c2 = data['eclipses']['+2024-Apr-08']['c2']
+        self.assertNotIn('dt_dh', c2)
+        self.assertEqual('+2024-04-08T18:34:12Z', c2['utc_iso'])
+        data, years_in_cache, years_not_in_cache, filename_pickle = uut._get_cache_local(years=[2024, 2500])
+        self.assertNotIn('ele_source', data['32.78,-96.8,140'])
+        self.assertEqual([2024, 2500], years_in_cache)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import datetime
+import json
+import os
+import tempfile
+import unittest
+
+from circumstances.circumstances import process_gsfc_history_table
+from circumstances.export import SCHEMA, duration_seconds, epoch_seconds, jsonl_to_parquet, localize_rows, record_rows, \
+    write_parquet
+from testdata import gsfc_table
+
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+def record():
+    eclipses, by_year = process_gsfc_history_table(gsfc_table)
+    total, ancient = eclipses['+2024-Apr-08'], eclipses['-0500-Jan-01']
+    return {'key': '32.78,-96.8,150', 'name': 'Dallas', 'lat': 32.78, 'lon': -96.8, 'ele': 150, 'tz': 'US/Central',
+            'inpath': {'T': {'+2024-04-08T12:18:03': total}}, 'nearpath': {}, 'farpath': {'P': {'x': ancient}},
+            'prevnextevents': {'T': {'next_in_path': total, 'last_in_path': None}, 'any': {'next': total}}}
+
+
+class Export(unittest.TestCase):
+
+    def test_rows(self):
+        rows = localize_rows(record())
+        self.assertEqual(2, len(rows))
+        self.assertEqual([name for name, kind in SCHEMA], list(rows[0]))
+        self.assertEqual(['inpath', 'farpath'], [row['category'] for row in rows])
+        self.assertEqual(epoch_seconds('+2024-04-08T18:34:12Z') * 1000, rows[0]['c2_utc'])
+        self.assertEqual(1712601252000, rows[0]['c2_utc'])
+        self.assertIsNone(rows[1]['c2_utc'])
+        self.assertEqual(210, rows[0]['duration_s'])
+        self.assertEqual(1.014, rows[0]['magnitude'])
+        self.assertEqual('T.next_in_path,any.next', rows[0]['events'])
+        self.assertEqual('underway at sunrise', rows[1]['notes'])
+        # records written with their rows are taken as they are
+        self.assertEqual(rows + rows, record_rows([record(), dict(record(), rows=rows)]))
+
+    def test_julian_calendar(self):
+        # 1582 Oct 4 (Julian) was followed by Oct 15 (Gregorian)
+        self.assertEqual(86400, epoch_seconds('+1582-10-15T00:00:00Z') - epoch_seconds('+1582-10-04T00:00:00Z'))
+        self.assertEqual(12 * 60 + 3, duration_seconds('12m03s'))
+        self.assertEqual(1712601252.25, epoch_seconds('+2024-04-08T18:34:12.25Z'))
+
+    @unittest.skipIf(pyarrow is None, 'requires pyarrow')
+    def test_parquet(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'sites.parquet')
+            write_parquet([record()], filename)
+            table = pyarrow.parquet.read_table(filename)
+            self.assertEqual(2, table.num_rows)
+            self.assertEqual('timestamp[ms, tz=UTC]', str(table.schema.field('c1_utc').type))
+            self.assertEqual(datetime.datetime(2024, 4, 8, 18, 34, 12, tzinfo=datetime.timezone.utc),
+                             table.column('c2_utc')[0].as_py())
+            # before the range of datetime, the milliseconds are kept
+            self.assertEqual(epoch_seconds('-0500-01-01T06:18:00Z') * 1000,
+                             table.column('c1_utc').cast(pyarrow.int64())[1].as_py())
+
+    @unittest.skipIf(pyarrow is None, 'requires pyarrow')
+    def test_jsonl(self):
+        with tempfile.TemporaryDirectory() as directory:
+            jsonl = os.path.join(directory, 'sites.jsonl')
+            fp = open(jsonl, 'w')
+            for n in range(5):
+                site = dict(record(), key=f"site{n}")
+                if n % 2 == 0:
+                    site['rows'] = localize_rows(site)  # as batch writes them
+                fp.write(json.dumps(site, default=lambda t: t.tt) + '\n')
+            fp.close()
+            filename = os.path.join(directory, 'sites.parquet')
+            self.assertEqual(10, jsonl_to_parquet(jsonl, filename, batch_size=2))
+            parquet = pyarrow.parquet.ParquetFile(filename)
+            self.assertEqual(3, parquet.num_row_groups)
+            table = parquet.read()
+        self.assertEqual([f"site{n}" for n in range(5) for row in range(2)], table.column('key').to_pylist())
+        self.assertEqual([210.0, None] * 5, table.column('duration_s').to_pylist())
+        self.assertEqual([1712601252000, None] * 5, table.column('c2_utc').cast(pyarrow.int64()).to_pylist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+
+from circumstances import metrics
+from circumstances.circumstances import process_gsfc_history_table
+from testdata import gsfc_table
+
+
+class Metrics(unittest.TestCase):
+
+    def tearDown(self):
+        metrics.disable()
+        metrics.reset()
+
+    def test_disabled(self):
+        metrics.disable()
+        process_gsfc_history_table(gsfc_table)
+        metrics.counter('pickle_cache', source='canon', cache='hit')
+        self.assertEqual({'enabled': False, 'counters': {}, 'timers': {}}, metrics.snapshot())
+
+    def test_snapshot(self):
+        metrics.enable()
+        process_gsfc_history_table(gsfc_table)
+        process_gsfc_history_table(gsfc_table)
+        metrics.counter('pickle_cache', source='canon', cache='hit')
+        snapshot = metrics.snapshot()
+        self.assertEqual(2, snapshot['timers']['parse{source=gsfc}']['count'])
+        self.assertEqual(1, snapshot['counters']['pickle_cache{cache=hit,source=canon}'])
+
+        text = metrics.prometheus_text()
+        self.assertIn('circumstances_pickle_cache_total{cache="hit",source="canon"} 1', text)
+        self.assertIn('circumstances_parse_seconds_count{source="gsfc"} 2', text)
+
+    def test_trace_hook(self):
+        spans = []
+        metrics.enable()
+        metrics.set_trace_hook(lambda name, labels, start, elapsed, exc: spans.append((name, labels)))
+        try:
+            process_gsfc_history_table(gsfc_table)
+        finally:
+            metrics.set_trace_hook(None)
+        self.assertEqual([('parse', {'source': 'gsfc'})], spans)
+
+
+if __name__ == '__main__':
+    unittest.main()
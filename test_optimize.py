@@ -0,0 +1,58 @@
+import unittest
+
+import numpy as np
+
+from circumstances.optimize import best_site, central_line
+from circumstances.path import great_circle_km
+from circumstances.skyfieldcalcs import eclipse_positions, local_contacts
+from circumstances.utils import greatest_eclipse_tt
+
+total = {'date_ut1': '2024-Apr-08', 'ge_time_td': '18:18:29', 'delta_t': 74}
+
+
+class BestSite(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tt = greatest_eclipse_tt(total)
+        cls.geo = eclipse_positions(cls.tt, engine='analytic')
+
+    def test_against_brute_force(self):
+        # home outside the path, which passes within reach to the southeast
+        result = best_site(self.tt, 35.0, -98.0, radius_km=250, geo=self.geo)
+        self.assertEqual(0, result['home']['duration'])
+        best = result['best']
+        self.assertEqual('T', best['type'])
+        self.assertLessEqual(best['distance_km'], 250 + 1e-6)
+        self.assertLess(result['evaluations'], 1500)
+        lat, lon = [x.ravel() for x in np.meshgrid(np.linspace(32, 38, 241), np.linspace(-102, -94, 241))]
+        within = great_circle_km(35.0, -98.0, lat, lon) <= 250
+        grid = local_contacts(self.geo, lat[within], lon[within])
+        self.assertGreaterEqual(best['duration'], grid['duration'].max() - 0.5)
+        # the profile crosses the path through the best site
+        profile = result['profile']
+        self.assertEqual(best['duration'], profile['duration'][20])
+        self.assertEqual('P', profile['type'][0])
+        self.assertEqual('P', profile['type'][-1])
+        self.assertFalse(profile['within_radius'].all())
+
+    def test_partial_and_sun_altitude(self):
+        # the path is out of reach, the best is the greatest obscuration at the edge toward it
+        result = best_site(self.tt, 38.9, -77.0, radius_km=100, geo=self.geo)
+        best = result['best']
+        self.assertEqual('P', best['type'])
+        self.assertGreater(best['obscuration'], result['home']['obscuration'])
+        self.assertAlmostEqual(100, best['distance_km'], places=3)
+        self.assertIsNone(best_site(self.tt, 32.78, -96.8, radius_km=50, geo=self.geo, min_sun_alt=70)['best'])
+
+    def test_path_data(self):
+        lat, lon = central_line(self.geo, step=60)
+        path_data = {n: {'central': {'lat': round(a, 2), 'lon': round(b, 2)}} for n, (a, b) in enumerate(zip(lat, lon))}
+        seeded = best_site(self.tt, 35.0, -98.0, radius_km=250, geo=self.geo, path_data=path_data, rings=2)
+        self.assertNotIn('distance_km', path_data[0])  # the caller's path is left as it was
+        self.assertAlmostEqual(best_site(self.tt, 35.0, -98.0, radius_km=250, geo=self.geo)['best']['duration'],
+                               seeded['best']['duration'], delta=0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+
+from circumstances.circumstances import process_gsfc_history_table
+from circumstances.xavier_circ import parse_jubier_kml
+from testdata import gsfc_table
+
+# Google Earth KML in the shape returned by Xavier Jubier's local circumstances service
+jubier_kml = '''<?xml version="1.0" encoding="UTF-8"?><kml><Document><name><![CDATA[Eclipse]]></name><Placemark><description><![CDATA[<table><tr><td>Total Solar Eclipse</td></tr></table>
+<table><tr><td>Lat.</td><td>:</td><td>35.7945º</td><td>Duration</td><td>4m26.9s<br>4m24.2s (lunar limb)</td></tr>
+<tr><td>Lng.</td><td>:</td><td>-78.6376º</td><td></td><td></td></tr></table>
+<table><tr><td>Umbral depth : 80.1%<br>Path width : 197.2km<br>Obscuration : 100.00%</td><td></td><td></td><td></td><td>Magnitude : 1.0115<br>Moon/Sun size ratio : 1.0172<br>Umbral vel. : 0.731km/s</td></tr></table>
+<table><tr><th>Event</th></tr>
+<tr><td>Start of partial eclipse (C1)</td><td>2024/04/08</td><td>17:18:45.1</td><td>61.4&deg;</td><td>167.5&deg;</td><td>234&deg;</td><td>11.2</td><td></td></tr>
+<tr><td>Start of total eclipse (C2)</td><td>2024/04/08</td><td>18:34:10.8</td><td>61.0&deg;</td><td>194.9&deg;</td><td>52&deg;</td><td>4.9</td><td>1.2s</td></tr>
+<tr><td>Maximum eclipse (MAX)</td><td>2024/04/08</td><td>18:36:24.3</td><td>60.9&deg;</td><td>195.8&deg;</td><td>340&deg;</td><td>1.3</td></tr>
+</table> ]]></description></Placemark></Document></kml>'''
+
+
+class GSFCHistoryTable(unittest.TestCase):
+
+    def test_process_gsfc_history_table(self):
+        result, by_year = process_gsfc_history_table(gsfc_table)
+        self.assertEqual(['+2024-Apr-08', '-0500-Jan-01', '+2500-Feb-28'], list(result.keys()))
+        self.assertEqual([2024, -500, 2500], list(by_year.keys()))
+
+        total = result['+2024-Apr-08']
+        self.assertEqual('+2024-04-08T18:34:12Z', total['c2']['utc_iso'])
+        self.assertEqual(179, total['mid']['sun_azi'])
+        self.assertEqual(60, total['mid']['sun_alt'])
+        self.assertEqual(total['c4']['tt'].utc_iso(), '2024-04-08T19:56:40Z')
+
+        ancient = result['-0500-Jan-01']
+        self.assertIsNone(ancient['c2'])
+        self.assertEqual('-0500-01-01T06:18:00Z', ancient['c1']['utc_iso'])
+        self.assertEqual(ancient['mid']['utc_iso'], ancient['c4']['utc_iso'])  # NaN:NaN contact
+        self.assertEqual(['underway at sunrise'], ancient['notes'])
+
+        self.assertEqual(['underway at sunset'], result['+2500-Feb-28']['notes'])
+
+
+class JubierKML(unittest.TestCase):
+
+    def test_parse_jubier_kml(self):
+        data = parse_jubier_kml(jubier_kml)
+        self.assertEqual(35.7945, data['lat'])
+        self.assertEqual(266.9, data['duration_sec'])
+        self.assertEqual(264.2, data['duration_limb_corrected_sec'])
+        self.assertEqual(197.2, data['path_width_km'])
+        self.assertEqual(100.0, data['obscuration'])
+        self.assertEqual(1.0172, data['moon/sun size ratio'])
+        self.assertEqual('2024-04-08T18:34:10.8Z', data['c2']['utc_iso'])
+        self.assertEqual(1.2, data['c2']['lc_sec'])
+        self.assertEqual(('SSW', 'south-southwest'), data['max']['cardinal'])
+        self.assertIsNone(data['c4']['utc_datetime'])
+
+    def test_no_eclipse(self):
+        self.assertIsNone(parse_jubier_kml('<kml><![CDATA[NO&nbsp;SOLAR&nbsp;ECLIPSE]]></kml>'))
+
+
+if __name__ == '__main__':
+    unittest.main()
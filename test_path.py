@@ -0,0 +1,56 @@
+import os
+import unittest
+
+from skyfield.api import load_file
+
+from benchmarks.bench import FIXTURE_FILES, FIXTURES
+from circumstances.circumstances import distance_to_path
+from circumstances.path import compute_eclipse_path
+
+total = {'id': '+20240408', 'date_ut1': '2024-Apr-08', 'ge_time_td': '18:18:29', 'delta_t': 74}
+partial = {'id': '+20250329', 'date_ut1': '2025-Mar-29', 'ge_time_td': '10:48:36', 'delta_t': 75}
+
+
+class ComputeEclipsePath(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.eph = load_file(os.path.join(FIXTURES, FIXTURE_FILES['ephemeris']))
+
+    def test_total(self):
+        path = compute_eclipse_path('+2024-04-08', 'T', canondata=total, eph=self.eph, force=True)
+        self.assertEqual('16:41', list(path)[0])
+        self.assertEqual('19:54', list(path)[-1])
+
+        # greatest eclipse, 25.3N 104.1W with a 198 km wide path, is a minute before this row
+        row = path['18:18']
+        self.assertAlmostEqual(25.3, row['central']['lat'], delta=0.5)
+        self.assertAlmostEqual(-104.1, row['central']['lon'], delta=0.5)
+        self.assertGreater(row['northern']['lat'], row['central']['lat'])
+        self.assertLess(row['southern']['lat'], row['central']['lat'])
+        self.assertAlmostEqual(198, row['path width km'], delta=5)
+        self.assertTrue(row['duration'].startswith('04m'))
+        self.assertEqual(70, row['sun altitude'])
+
+        # cached, not recomputed without the canon entry or the kernel
+        self.assertEqual(path, compute_eclipse_path('+2024-04-08', 'T'))
+
+        path, mindist, bearing_deg, bearing_dir = distance_to_path(32.78, -96.8, path_data=path)
+        self.assertLess(mindist, 40)
+        self.assertIn('distance_km', path['18:18'])
+
+    def test_partial(self):
+        # the shadow axis misses the Earth, there is no path, and that is cached too
+        filename = 'caches/paths/+2025-03-29P_60.pickle'
+        self.assertEqual({}, compute_eclipse_path('+2025-03-29', 'P', canondata=partial, eph=self.eph, force=True))
+        self.assertTrue(os.path.exists(filename))
+        self.assertEqual({}, compute_eclipse_path('+2025-03-29', 'P'))
+
+        path, mindist, bearing_deg, bearing_dir = distance_to_path(48.85, 2.35, name='+2025-03-29', eclipsetype='P',
+                                                                   local=True)
+        self.assertEqual({}, path)
+        self.assertEqual((None, None, None), (mindist, bearing_deg, bearing_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
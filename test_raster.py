@@ -0,0 +1,81 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from circumstances.raster import RASTER_BANDS, eclipse_raster, load_raster_npy, save_raster_geotiff, save_raster_npy
+from circumstances.skyfieldcalcs import ECLIPSE_TYPE_CODES, eclipse_window, geocentric_positions, local_contacts
+from circumstances.sweep import analytic_source
+from circumstances.utils import greatest_eclipse_tt
+
+try:
+    import rasterio
+except ImportError:
+    rasterio = None
+
+total = {'date_ut1': '2024-Apr-08', 'ge_time_td': '18:18:29', 'delta_t': 74}
+
+
+class Raster(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # 4 x 4 cells across the path of totality in Texas, in chunks of 5 so the last chunk is short
+        cls.raster = eclipse_raster(total, lat_range=(28, 36), lon_range=(-100, -92), resolution=2, chunk_size=5,
+                                    max_workers=2, engine='analytic')
+
+    def test_grid(self):
+        np.testing.assert_array_equal([35, 33, 31, 29], self.raster['lats'])
+        np.testing.assert_array_equal([-99, -97, -95, -93], self.raster['lons'])
+        self.assertEqual((-100, 2, 0.0, 36, 0.0, -2), self.raster['geotransform'])
+        for band in RASTER_BANDS:
+            self.assertEqual((4, 4), self.raster[band].shape)
+
+    def test_cells(self):
+        tt = greatest_eclipse_tt(total)
+        geo = geocentric_positions(eclipse_window(tt, hours=4), analytic_source())
+        lon, lat = np.meshgrid(self.raster['lons'], self.raster['lats'])
+        expected = local_contacts(geo, lat.ravel(), lon.ravel(), coarse=60)
+        np.testing.assert_array_equal([ECLIPSE_TYPE_CODES[t] for t in expected['type']],
+                                      self.raster['type'].ravel())
+        np.testing.assert_allclose(expected['duration'], self.raster['duration'].ravel())
+        np.testing.assert_allclose(expected['obscuration'], self.raster['obscuration'].ravel())
+
+        # inside the path near Dallas, outside it at the south east corner of the grid
+        inside = self.raster['lats'].tolist().index(33), self.raster['lons'].tolist().index(-97)
+        outside = self.raster['lats'].tolist().index(29), self.raster['lons'].tolist().index(-93)
+        self.assertEqual(ECLIPSE_TYPE_CODES['T'], self.raster['type'][inside])
+        self.assertGreater(self.raster['duration'][inside], 180)
+        self.assertEqual(1, self.raster['obscuration'][inside])
+        self.assertEqual(ECLIPSE_TYPE_CODES['P'], self.raster['type'][outside])
+        self.assertEqual(0, self.raster['duration'][outside])
+        self.assertLess(self.raster['obscuration'][outside], 1)
+
+    def test_npy(self):
+        with tempfile.TemporaryDirectory() as directory:
+            prefix = os.path.join(directory, '+2024-04-08')
+            save_raster_npy(self.raster, prefix)
+            loaded = load_raster_npy(prefix)
+            for band in RASTER_BANDS:
+                self.assertIsInstance(loaded[band], np.memmap)
+                np.testing.assert_array_equal(self.raster[band], loaded[band])
+            np.testing.assert_array_equal(self.raster['lats'], loaded['lats'])
+            np.testing.assert_array_equal(self.raster['lons'], loaded['lons'])
+            self.assertEqual(self.raster['tt'], loaded['tt'])
+            self.assertEqual(self.raster['geotransform'], loaded['geotransform'])
+            del loaded
+
+    @unittest.skipIf(rasterio is None, 'requires rasterio')
+    def test_geotiff(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, '+2024-04-08.tif')
+            save_raster_geotiff(self.raster, filename, bands=['type', 'duration'])
+            with rasterio.open(filename) as src:
+                self.assertEqual(('type', 'duration'), src.descriptions)
+                self.assertEqual(self.raster['geotransform'], src.transform.to_gdal())
+                np.testing.assert_array_equal(self.raster['duration'], src.read(2))
+
+
+if __name__ == '__main__':
+    unittest.main()
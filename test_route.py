@@ -0,0 +1,67 @@
+import unittest
+
+import numpy as np
+
+from circumstances.path import destination, great_circle_km
+from circumstances.route import densify, route_circumstances, track_circumstances
+from circumstances.skyfieldcalcs import contacts_to_dict, eclipse_positions, local_contacts
+from circumstances.utils import greatest_eclipse_tt
+
+total = {'date_ut1': '2024-Apr-08', 'ge_time_td': '18:18:29', 'delta_t': 74}
+
+
+class Route(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tt = greatest_eclipse_tt(total)
+        cls.geo = eclipse_positions(cls.tt, engine='analytic')
+        cls.dallas = contacts_to_dict(local_contacts(cls.geo, 32.78, -96.8))
+
+    def test_densify(self):
+        lat, lon, ele, distance = densify([34.0, 31.5, 31.5], [-99.0, -95.0, -94.0], spacing_km=2, eles=[0, 400, 0])
+        self.assertEqual((34.0, -99.0), (lat[0], lon[0]))
+        self.assertEqual((31.5, -94.0), (lat[-1], lon[-1]))
+        self.assertLessEqual(np.diff(distance).max(), 2)
+        steps = great_circle_km(lat[:-1], lon[:-1], lat[1:], lon[1:])
+        np.testing.assert_allclose(np.diff(distance), steps, atol=1e-6)
+        self.assertEqual(400, ele.max())
+
+    def test_route(self):
+        # across the path of totality through Dallas
+        result = route_circumstances(self.tt, [(34.0, -99.0), (31.5, -95.0)], spacing_km=0.5, geo=self.geo)
+        points = result['points']
+        self.assertEqual({'P', 'T'}, set(points['type']))
+        best = result['best']
+        self.assertEqual(points['duration'].max(), best['duration'])
+        self.assertGreater(best['duration'], self.dallas['duration'])
+        exact = contacts_to_dict(local_contacts(self.geo, best['lat'], best['lon']))
+        self.assertAlmostEqual(exact['c2']['tt'], best['c2']['tt'], delta=1e-3 / 86400)
+        # the Sun is nowhere that high on the route
+        self.assertIsNone(route_circumstances(self.tt, [(34.0, -99.0), (31.5, -95.0)], geo=self.geo,
+                                              min_sun_alt=80)['best'])
+
+    def test_stationary_track(self):
+        mid = self.dallas['mid']['tt']
+        result = track_circumstances(self.tt, [(mid - 0.05, 32.78, -96.8), (mid + 0.05, 32.78, -96.8)], geo=self.geo)
+        self.assertEqual('T', result['type'])
+        for attr in ['c1', 'c2', 'mid', 'c3', 'c4']:
+            self.assertAlmostEqual(self.dallas[attr]['tt'], result[attr]['tt'], delta=0.5 / 86400)
+        self.assertAlmostEqual(self.dallas['duration'], result['duration'], delta=0.5)
+
+    def test_chasing_the_shadow(self):
+        # flying northeast with the shadow at 250 m/s lengthens totality
+        mid = self.dallas['mid']['tt']
+        lat0, lon0 = destination(32.78, -96.8, 225, 900)
+        lat1, lon1 = destination(32.78, -96.8, 45, 900)
+        result = track_circumstances(self.tt, [(mid - 1 / 24, lat0, lon0, 11000), (mid + 1 / 24, lat1, lon1, 11000)],
+                                     geo=self.geo)
+        self.assertEqual(1, len(result['central_intervals']))
+        self.assertGreater(result['duration'], self.dallas['duration'] + 60)
+        self.assertGreater(result['c3']['lat'], result['c2']['lat'])
+        self.assertEqual(11000, result['mid']['ele'])
+        self.assertIsNone(track_circumstances(self.tt, [(mid, -60, 0), (mid + 0.1, -60, 10)], geo=self.geo))
+
+
+if __name__ == '__main__':
+    unittest.main()
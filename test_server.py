@@ -0,0 +1,98 @@
+import asyncio
+import json
+import unittest
+
+from circumstances.server import circumstances_server, circumstances_service, make_executor
+from circumstances.utils import ts
+from testdata import canon
+
+
+class Service(unittest.TestCase):
+
+    def setUp(self):
+        self.service = circumstances_service(canon=canon, engine='analytic')
+
+    def test_sites(self):
+        dallas, santiago = self.service.sites('+2024-04-08', [32.7767, -33.45], [-96.797, -70.67], [150, 500])
+        self.assertEqual('T', dallas['type'])
+        self.assertEqual('America/Chicago', dallas['timezone'])
+        self.assertEqual('CT', dallas['c2']['local_tz'])
+        self.assertAlmostEqual(ts.utc(2024, 4, 8, 18, 40, 44).tt, dallas['c2']['tt'], delta=60 / 86400)
+        self.assertEqual('', santiago['type'])
+        self.assertEqual(self.service.sites('+20240408', 32.7767, -96.797, 150)[0]['c2'], dallas['c2'])
+        with self.assertRaises(KeyError):
+            self.service.sites('+2024-04-09', 32.7767, -96.797)
+
+    def test_best_site(self):
+        result = self.service.best_site('+2024-04-08', 35.0, -98.0, radius_km=250)
+        self.assertEqual('T', result['best']['type'])
+        self.assertEqual('America/Chicago', result['best']['timezone'])
+        self.assertEqual(41, len(result['profile']['duration']))
+
+    def test_search(self):
+        self.assertEqual('+20240408', self.service.search(32.7767, -96.797, date='+2024-01-01')['eclipse'])
+        self.assertEqual('+20231014', self.service.search(32.7767, -96.797, date='+2024-01-01', direction=-1)['eclipse'])
+        self.assertIsNone(self.service.search(32.7767, -96.797, date='+2024-05-01'))
+        self.assertIsNone(self.service.search(32.7767, -96.797, date='+2023-01-01', eclipsetype='A'))
+        # each service keeps its own pre-filter positions
+        self.assertGreater(self.service.coarse.cache_info().currsize, 0)
+        self.assertEqual(0, circumstances_service(canon=canon, engine='analytic').coarse.cache_info().currsize)
+
+
+class Server(unittest.TestCase):
+
+    def test_http(self):
+        batch = b'{"eclipse": "+20240408", "sites": [{"lat": 32.7767, "lon": -96.797}, {"lat": 0, "lon": 0}]}'
+        responses = asyncio.run(self.requests([
+            b'GET /circumstances?lat=32.7767&lon=-96.797&ele=150&eclipse=%2B2024-04-08 HTTP/1.1\r\n\r\n',
+            b'POST /batch HTTP/1.1\r\nContent-Length: %d\r\n\r\n%s' % (len(batch), batch),
+            b'GET /next?lat=32.7767&lon=-96.797&date=%2B2024-05-01 HTTP/1.1\r\n\r\n',
+            b'GET /circumstances?lat=32.7767&lon=-96.797&eclipse=%2B2024-04-09 HTTP/1.1\r\n\r\n',
+            b'GET /circumstances?lon=-96.797&eclipse=%2B2024-04-08 HTTP/1.1\r\nConnection: close\r\n\r\n',
+        ]))
+        status = [int(head.split()[1]) for head, body in responses]
+        self.assertEqual([200, 200, 200, 404, 400], status)
+        self.assertEqual('T', json.loads(responses[0][1])['type'])
+        self.assertEqual(['T', ''], [site['type'] for site in json.loads(responses[1][1])])
+        self.assertIsNone(json.loads(responses[2][1]))
+
+    def test_malformed(self):
+        for request in [b'GET /circumstances\r\n\r\n', b'GET / HTTP/1.1\r\nno colon\r\n\r\n']:
+            (head, body), = asyncio.run(self.requests([request]))
+            self.assertEqual(400, int(head.split()[1]))
+            self.assertIn('Connection: close', head)
+            self.assertIn('malformed request', json.loads(body)['error'])
+
+    def test_limits(self):
+        batch = b'{"eclipse": "+20240408", "sites": [{"lat": 32.7767, "lon": -96.797}, {"lat": 0, "lon": 0}]}'
+        responses = asyncio.run(self.requests([
+            b'POST /batch HTTP/1.1\r\nContent-Length: %d\r\n\r\n%s' % (len(batch), batch),
+            b'GET /circumstances?lat=32.7767&lon=-96.797&eclipse=%2B2024-04-08 HTTP/1.1\r\n\r\n',
+            b'POST /batch HTTP/1.1\r\nContent-Length: 1000\r\n\r\n',
+        ], max_batch=1, max_body=999))
+        self.assertEqual([413, 200, 413], [int(head.split()[1]) for head, body in responses])
+        self.assertIn('2 sites in a batch', json.loads(responses[0][1])['error'])
+        self.assertIn('keep-alive', responses[1][0])
+        # refused before the body is read, and the connection closed
+        self.assertIn('request body of 1000 bytes', json.loads(responses[2][1])['error'])
+        self.assertIn('Connection: close', responses[2][0])
+
+    async def requests(self, requests, **kwargs):
+        executor = make_executor(workers=2, threads=True, canon=canon, engine='analytic')
+        server = await asyncio.start_server(circumstances_server(executor, **kwargs).handle, '127.0.0.1', 0)
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+        responses = []
+        for request in requests:  # on one kept alive connection
+            writer.write(request)
+            head = (await reader.readuntil(b'\r\n\r\n')).decode()
+            length = int(head.split('Content-Length: ')[1].split('\r\n')[0])
+            responses.append((head, await reader.readexactly(length)))
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        executor.shutdown()
+        return responses
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+import math
+import os
+import threading
+import unittest
+
+import numpy as np
+from skyfield.api import load_file
+
+from benchmarks.bench import FIXTURE_FILES, FIXTURES
+from circumstances.path import path_limits, shadow_axis_intercept
+from circumstances.skyfieldcalcs import circumstances, eclipse_possible, local_contacts, obscuration, progressive_circumstances, \
+    site_xyz, visibility_filter
+from circumstances.utils import load_ephemeris, ts, utc_iso_to_tt
+
+
+def straight_line_eclipse(speed=1.0, hours=4, step=1):
+    '''
+    geocentric positions of a fixed Sun on the x axis and a Moon crossing in front of it along y at speed km/s,
+    an annular eclipse centered on the observer at 0N 0E at TT julian date 2460000
+    '''
+    t = np.arange(-hours * 3600, hours * 3600 + step, step).astype(float)
+    sun = np.zeros((3, len(t)))
+    sun[0] = 1.496e8
+    moon = np.zeros((3, len(t)))
+    moon[0] = 384400
+    moon[1] = speed * t
+    return {'tt': 2460000.0 + t / 86400, 'step': step, 'sun': sun, 'moon': moon}
+
+
+class VectorizedEngine(unittest.TestCase):
+
+    def test_obscuration(self):
+        self.assertEqual(0, obscuration(0.6, 0.27, 0.26))
+        self.assertEqual(1, obscuration(0.001, 0.26, 0.27))
+        self.assertAlmostEqual((0.26 / 0.27) ** 2, obscuration(0.001, 0.27, 0.26)[()])
+        self.assertAlmostEqual(0.5, obscuration(0, 0.27, [0.27 / math.sqrt(2)])[0])
+        partial = obscuration(np.linspace(0, 0.6, 50), 0.27, 0.26)
+        self.assertTrue(np.all(np.diff(partial) <= 0))
+
+    def test_local_contacts(self):
+        geo = straight_line_eclipse()
+        result = local_contacts(geo, [0, 1, 10, 80], [0, 0, 0, 0])
+        self.assertEqual(['A', 'P', 'P', ''], list(result['type']))
+        self.assertTrue(np.isnan(result['c1'][3]))
+
+        # separation is atan(y / distance to the Moon) from the observer
+        x = site_xyz(0, 0)[0, 0]
+        sun_r = math.degrees(math.asin(695700 / (1.496e8 - x)))
+        moon_r = math.degrees(math.asin(1737.4 / (384400 - x)))
+        duration = 2 * math.tan(math.radians(sun_r - moon_r)) * (384400 - x)
+        self.assertAlmostEqual(duration, result['duration'][0], places=2)
+        self.assertAlmostEqual(2460000.0, result['mid'][0], places=7)
+        self.assertAlmostEqual(result['c1'][0] - 2460000.0, 2460000.0 - result['c4'][0], places=7)
+        self.assertAlmostEqual(90, result['mid_sun_alt'][0], places=3)
+        self.assertAlmostEqual((moon_r / sun_r) ** 2, result['obscuration'][0], places=4)
+
+    def test_eclipse_possible(self):
+        geo = straight_line_eclipse()
+        coarse = {'tt': geo['tt'][::600], 'step': 600, 'sun': geo['sun'][:, ::600], 'moon': geo['moon'][:, ::600]}
+        lat, lon = np.meshgrid(np.linspace(-89, 89, 90), np.linspace(-180, 180, 37))
+        lat, lon = lat.ravel(), lon.ravel()
+        seen = local_contacts(geo, lat, lon)['type'] != ''
+        possible = eclipse_possible(coarse, lat, lon, require_sun_up=False)
+        self.assertFalse((seen & ~possible).any())
+
+        prefilter = visibility_filter()
+        prefilter.check(coarse, lat, lon)
+        self.assertEqual(len(lat), prefilter.report()['checked'])
+        self.assertTrue(0.5 < prefilter.rejection_rate < 1)
+
+    def test_shadow_axis_intercept(self):
+        geo = straight_line_eclipse()
+        rows = [0, len(geo['tt']) // 2, len(geo['tt']) // 2 + 600]
+        (lat, lon), found = shadow_axis_intercept(geo['sun'][:, rows], geo['moon'][:, rows])
+        self.assertEqual([False, True, True], list(found))
+        self.assertAlmostEqual(0, lat[1])
+        self.assertAlmostEqual(0, lon[1])
+        self.assertTrue(lon[2] > 0)  # the Moon is moving east along y
+
+        # the track runs east, so the limits lie north and south of the central line
+        northern, southern = path_limits(geo['sun'][:, rows[1:]], geo['moon'][:, rows[1:]], lat[1:], lon[1:])
+        self.assertAlmostEqual(-northern[0][0], southern[0][0], places=2)
+        self.assertTrue(0.1 < northern[0][0] < 0.3)
+
+
+class TimeStamps(unittest.TestCase):
+
+    def test_utc_iso_to_tt(self):
+        # the day after 1582 Oct 4 (Julian) was Oct 15 (Gregorian)
+        self.assertAlmostEqual(1, utc_iso_to_tt('+1582-10-15T12:00:00Z') - utc_iso_to_tt('+1582-10-04T12:00:00Z'), 5)
+        self.assertAlmostEqual(5, (utc_iso_to_tt('-0584-05-28T12:00:00Z') - 1507900.0) * 24, places=0)  # delta T
+        self.assertAlmostEqual(utc_iso_to_tt('2024-04-08T18:36:24.3Z'), utc_iso_to_tt('+2024-04-08T18:36:24.3Z'))
+
+
+class Circumstances(unittest.TestCase):
+
+    def test_analytic_scan(self):
+        # the scan with the analytic theory finds the same contacts as the minute scan with the kernel
+        eph = load_file(os.path.join(FIXTURES, FIXTURE_FILES['ephemeris']))
+        for (y, m, d), lat, lon in [((2024, 4, 8), 32.7767, -96.797), ((2024, 4, 8), 35.7945, -78.6376),
+                                    ((2024, 10, 2), -27.12, -109.35), ((2023, 10, 14), -33.45, -70.67)]:
+            full = circumstances(ts.utc(y, m, d), lat, lon, eph=eph)
+            scanned = circumstances(ts.utc(y, m, d), lat, lon, eph=eph, analytic_scan=True)
+            for a, b in zip(full, scanned):
+                self.assertEqual(a is None, b is None)
+                if a is not None:
+                    self.assertLessEqual(abs(a.jd - b.jd) * 86400, 1)
+        self.assertIsNotNone(full[0])
+
+    def test_no_eclipse(self):
+        # ruled out before a kernel is loaded
+        self.assertEqual((None,) * 5, circumstances(ts.utc(2024, 4, 8), -33.45, -70.67, analytic_scan=True))
+
+
+class Progressive(unittest.TestCase):
+
+    def test_no_eclipse(self):
+        # the analytic scan rules out Santiago before any kernel is loaded
+        result = progressive_circumstances(ts.utc(2024, 4, 8), -33.45, -70.67)
+        self.assertEqual('none', result.stage)
+        self.assertIs(result, result.refined())
+
+    @unittest.skipUnless(os.path.exists('/var/data/de421.bsp'), 'requires the DE421 kernel')
+    def test_refinement(self):
+        eph = load_ephemeris(2024)
+        refined = []
+        delivered = threading.Event()
+        result = progressive_circumstances(ts.utc(2024, 4, 8), 32.7767, -96.797, ele=150, budget=0, eph=eph,
+                                           callback=lambda r: (refined.append(r), delivered.set()))
+        self.assertEqual(('coarse', 60), (result.stage, result.precision))
+        final = result.refined(timeout=60)
+        self.assertEqual(('refined', 1), (final.stage, final.precision))
+        self.assertTrue(delivered.wait(60))
+        self.assertEqual([final], refined)
+        for coarse, fine in zip(result.contacts, final.contacts):
+            self.assertLessEqual(abs(coarse.jd - fine.jd) * 86400, 61)
+
+
+if __name__ == '__main__':
+    unittest.main()
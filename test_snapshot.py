@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from circumstances.analytic import analytic_positions
+from circumstances.skyfieldcalcs import eclipse_window, geocentric_positions
+from circumstances.snapshot import attach_snapshot, chebyshev_times, fit_snapshot, load_snapshot
+from circumstances.utils import ts
+
+
+def analytic_snapshot(tt, hours=2, segment=600, degree=10):
+    '''a snapshot fitted to the analytic theory, which stands in for the kernel'''
+    tt0 = tt - hours / 24
+    nodes = chebyshev_times(tt0, int(2 * hours * 3600 / segment), segment, degree)
+    geo = analytic_positions(ts.tt_jd(nodes))
+    return fit_snapshot(nodes, geo['sun'], geo['moon'], tt0, segment, degree, meta={'corrections': 'apparent'})
+
+
+class Snapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.tt = ts.utc(2024, 4, 8, 18, 17).tt
+        self.snap = analytic_snapshot(self.tt)
+
+    def test_geocentric_positions(self):
+        t = eclipse_window(self.tt, hours=1.9, step=7)
+        geo = geocentric_positions(t, self.snap)
+        expected = analytic_positions(t)
+        self.assertEqual(7, geo['step'])
+        self.assertLess(np.abs(geo['moon'] - expected['moon']).max(), 0.01)  # km
+        self.assertLess(np.abs(geo['sun'] - expected['sun']).max() / 1.5e8, 1e-8)  # radians
+        with self.assertRaises(ValueError):
+            geocentric_positions(eclipse_window(self.tt, hours=3), self.snap)
+        with self.assertRaises(ValueError):
+            geocentric_positions(t, self.snap, corrections='geometric')
+
+    def test_save_and_share(self):
+        with tempfile.TemporaryDirectory() as directory:
+            prefix = os.path.join(directory, '+2024-04-08')
+            self.snap.save(prefix)
+            loaded = load_snapshot(prefix)
+            self.assertIsInstance(loaded.coefficients, np.memmap)
+            np.testing.assert_array_equal(self.snap.evaluate(self.tt)[1], loaded.evaluate(self.tt)[1])
+
+        attached = attach_snapshot(self.snap.share())
+        try:
+            np.testing.assert_array_equal(self.snap.evaluate(self.tt)[0], attached.evaluate(self.tt)[0])
+        finally:
+            attached.close()
+            self.snap.close(unlink=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
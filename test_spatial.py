@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from circumstances.skyfieldcalcs import contacts_to_dict, local_contacts
+from circumstances.spatial import circumstance_grid
+from test_skyfieldcalcs import straight_line_eclipse
+
+
+class CircumstanceGrid(unittest.TestCase):
+
+    def setUp(self):
+        self.geo = straight_line_eclipse()
+        self.grid = circumstance_grid(2460000.0, geo=self.geo)
+
+    def test_interpolated(self):
+        for lat, lon in [(0.05, 0.37), (0.6, -1.23), (3.1, 0.5)]:
+            result = self.grid.query(lat, lon)
+            exact = contacts_to_dict(local_contacts(self.geo, lat, lon))
+            self.assertTrue(result['interpolated'])
+            self.assertEqual(exact['type'], result['type'])
+            for c in ['c1', 'c2', 'mid', 'c3', 'c4']:
+                if exact[c]:
+                    self.assertAlmostEqual(exact[c]['tt'], result[c]['tt'], delta=2 * result['error_estimate_s'] / 86400)
+            self.assertAlmostEqual(exact['obscuration'], result['obscuration'], delta=0.002)
+
+    def test_path_limit(self):
+        # the annular path ends between 0.185 and 0.19 degrees, cells across it can't be interpolated
+        result = self.grid.query(0.185, 0.013)
+        self.assertFalse(result['interpolated'])
+        self.assertEqual('A', result['type'])
+        outside = self.grid.query(0.19, 0.013)
+        self.assertEqual('P', outside['type'])
+        self.assertGreater(outside['level'], 0)
+
+    def test_exact_elevation(self):
+        # computed exactly at the site's own elevation, not the nearest multiple of ele_tolerance
+        result = self.grid.query(0.185, 0.013, ele=1020)
+        self.assertFalse(result['interpolated'])
+        self.assertEqual(0, result['error_estimate_s'])
+        exact = contacts_to_dict(local_contacts(self.geo, 0.185, 0.013, 1020))
+        self.assertEqual(exact, {k: v for k, v in result.items() if k in exact})
+        self.assertNotEqual(contacts_to_dict(local_contacts(self.geo, 0.185, 0.013, 1000))['c1'], result['c1'])
+
+    def test_save_and_load(self):
+        self.grid.query(0.6, -1.23)
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'grid.pkl')
+            self.grid.save(filename)
+            loaded = circumstance_grid(2460000.0, geo=self.geo)
+            loaded.load(filename)
+            loaded.query(0.6, -1.23)
+            self.assertEqual(0, loaded.stats['points'])
+            with self.assertRaises(ValueError):
+                circumstance_grid(2460000.0, geo=self.geo, cell=0.2).load(filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from circumstances.skyfieldcalcs import eclipse_window, geocentric_positions, local_contacts
+from circumstances.stream import obscuration_stream, write_stream_csv, write_stream_parquet
+from circumstances.sweep import analytic_source
+from circumstances.utils import greatest_eclipse_tt
+
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+total = {'date_ut1': '2024-Apr-08', 'ge_time_td': '18:18:29', 'delta_t': 74}
+
+
+class Stream(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.eph = analytic_source()
+        cls.tt = greatest_eclipse_tt(total)
+        geo = geocentric_positions(eclipse_window(cls.tt, hours=4), cls.eph)
+        cls.contacts = local_contacts(geo, 32.78, -96.8)
+        cls.chunks = list(obscuration_stream(32.78, -96.8, ge=total, chunk_seconds=600, eph=cls.eph))
+
+    def test_contacts(self):
+        stream = pd.concat(self.chunks, ignore_index=True)
+        c1, c4 = self.contacts['c1'][0], self.contacts['c4'][0]
+        self.assertEqual(c1, stream['tt'].iloc[0])
+        self.assertLessEqual(stream['tt'].iloc[-1], c4)
+        self.assertLess((c4 - stream['tt'].iloc[-1]) * 86400, 1)
+        self.assertLess(stream['obscuration'].iloc[0], 1e-3)
+        self.assertLess(stream['obscuration'].iloc[-1], 1e-3)
+        self.assertEqual(1, stream['obscuration'].max())
+        self.assertTrue(stream['utc_iso'].iloc[0].startswith('+2024-04-08T'))
+
+    def test_chunk_boundaries(self):
+        self.assertEqual([600] * (len(self.chunks) - 1), [len(chunk) for chunk in self.chunks[:-1]])
+        stream = pd.concat(self.chunks, ignore_index=True)
+        np.testing.assert_allclose(np.diff(stream['tt']) * 86400, 1, atol=1e-3)
+        self.assertTrue(stream['utc_iso'].is_unique)
+        whole = next(obscuration_stream(32.78, -96.8, ge=total, chunk_seconds=86400, eph=self.eph))
+        pd.testing.assert_frame_equal(whole, stream)
+
+    def test_window(self):
+        start = self.contacts['mid'][0]
+        chunks = list(obscuration_stream(32.78, -96.8, start=start, end=start + 1 / 86400, step=0.5, eph=self.eph))
+        self.assertEqual(3, sum(len(chunk) for chunk in chunks))
+        self.assertTrue(chunks[0]['utc_iso'].str.match(r'\+2024-04-08T18:\d\d:\d\d\.\dZ$').all())
+        with self.assertRaises(ValueError):
+            obscuration_stream(32.78, -96.8, start=start, eph=self.eph)
+        # not seen from the southern ocean
+        self.assertEqual([], list(obscuration_stream(-60.0, 0.0, ge=self.tt, eph=self.eph)))
+
+    def test_csv(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'stream.csv')
+            self.assertEqual(sum(len(chunk) for chunk in self.chunks), write_stream_csv(iter(self.chunks), filename))
+            written = pd.read_csv(filename)
+        stream = pd.concat(self.chunks, ignore_index=True)
+        self.assertEqual(list(stream.columns), list(written.columns))
+        self.assertEqual(list(stream['utc_iso']), list(written['utc_iso']))
+        np.testing.assert_allclose(stream['obscuration'], written['obscuration'])
+
+    @unittest.skipIf(pyarrow is None, 'requires pyarrow')
+    def test_parquet(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'stream.parquet')
+            self.assertEqual(sum(len(chunk) for chunk in self.chunks),
+                             write_stream_parquet(iter(self.chunks), filename))
+            parquet = pyarrow.parquet.ParquetFile(filename)
+            self.assertEqual(len(self.chunks), parquet.num_row_groups)
+            written = parquet.read().to_pandas()
+        pd.testing.assert_frame_equal(pd.concat(self.chunks, ignore_index=True), written)
+
+
+if __name__ == '__main__':
+    unittest.main()
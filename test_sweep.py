@@ -0,0 +1,41 @@
+import unittest
+
+from circumstances.analytic import analytic_positions
+from circumstances.skyfieldcalcs import contacts_to_dict, eclipse_window, local_contacts
+from circumstances.sweep import century_sweep, century_years
+from circumstances.utils import greatest_eclipse_tt, spanning_kernel
+from testdata import canon
+
+# one outside the century
+canon = dict(canon, **{'1999-Aug-11': {'id': '+19990811', 'date_ut1': '1999-Aug-11', 'ge_time_td': '11:04:09',
+                                       'delta_t': 64, 'eclipse_type': 'T'}})
+
+
+class CenturySweep(unittest.TestCase):
+
+    def test_against_local_contacts(self):
+        result = century_sweep(32.7767, -96.797, ele=150, canon=canon, engine='analytic')
+        self.assertEqual(['2023-Oct-14', '2024-Apr-08'], sorted(result))
+        for key, circumstances in result.items():
+            geo = analytic_positions(eclipse_window(greatest_eclipse_tt(canon[key])))
+            exact = contacts_to_dict(local_contacts(geo, 32.7767, -96.797, 150))
+            self.assertEqual(exact['type'], circumstances['type'])
+            self.assertTrue(circumstances['visible'])
+            for attr in ['c1', 'c2', 'mid', 'c3', 'c4']:
+                if exact[attr] is None:
+                    self.assertIsNone(circumstances[attr])
+                else:
+                    self.assertAlmostEqual(exact[attr]['tt'], circumstances[attr]['tt'], delta=0.1 / 86400)
+            self.assertAlmostEqual(exact['duration'], circumstances['duration'], delta=0.1)
+
+    def test_centuries(self):
+        self.assertEqual((2000, 2099), century_years(20))
+        self.assertEqual((-100, -1), century_years(-1))
+        self.assertEqual(['1999-Aug-11'], list(century_sweep(48.9, 2.3, canon=canon, century=19, engine='analytic')))
+        self.assertEqual('de440.bsp', spanning_kernel(*century_years(20)))  # de421 ends in 2052
+        self.assertEqual('de406.bsp', spanning_kernel(*century_years(15)))  # de440 starts in 1550
+        self.assertEqual('de421.bsp', spanning_kernel(*century_years(19)))
+
+
+if __name__ == '__main__':
+    unittest.main()
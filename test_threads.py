@@ -0,0 +1,191 @@
+import os
+import pickle
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmarks.bench import SITE, fixture, write_canon_pickle
+from circumstances import circumstances, metrics
+from circumstances.circumstances import driver_lock, parse_canon_page, process_gsfc_history_table, \
+    solar_eclipse_local
+from circumstances.server import circumstances_service
+from circumstances.skyfieldcalcs import refine_executor
+from circumstances.utils import cached_session, pickle_dump_atomic
+from testdata import canon, jsex_driver
+
+
+def localized(result):
+    '''what localize found, by list and eclipse: obscuration and contact times'''
+    inpath, nearpath, farpath, prevnextevents = result
+    return [{kind: {label: (row['obs'], [row[circ]['utc_iso'] for circ in ['c1', 'c2', 'mid', 'c3', 'c4']
+                                         if row[circ] is not None])
+                    for label, row in rows.items()}
+             for kind, rows in found.items()} for found in [inpath, nearpath, farpath]]
+
+
+class ThreadSafety(unittest.TestCase):
+
+    def test_concurrent_localizations(self):
+        service = circumstances_service(canon=canon, engine='analytic')
+        rng = np.random.default_rng(44)
+        sites = list(zip(rng.uniform(25, 45, 400), rng.uniform(-120, -70, 400)))
+        serial = [service.sites('+20240408', lat, lon)[0] for lat, lon in sites[:50]]
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            futures = [executor.submit(service.sites, eclipse, lat, lon)
+                       for lat, lon in sites for eclipse in ['+20240408', '+20231014']]
+            futures += [executor.submit(service.search, lat, lon, date='+2024-01-01') for lat, lon in sites[:40]]
+            results = [future.result() for future in futures]
+        self.assertEqual(serial, [results[2 * n][0] for n in range(50)])
+        self.assertTrue(all(r[0]['timezone'] for r in results[:2 * len(sites)]))
+
+    def test_concurrent_localize(self):
+        # one site at elevations that are cached, adjusted from the cached one, and fetched with the driver
+        elevations = [100, 130, 400, 700]
+        results = {}
+        for run in ['serial', 'threads']:
+            with tempfile.TemporaryDirectory() as directory:
+                cwd = os.getcwd()
+                os.chdir(directory)
+                try:
+                    results[run], data, driver = self.localize_site(elevations, threads=run == 'threads')
+                finally:
+                    os.chdir(cwd)
+            if run == 'serial':
+                serial = {ele: result for ele, result in zip(elevations, results[run])}
+        self.assertEqual(200, len(results['threads']))
+        for n, result in enumerate(results['threads']):
+            self.assertEqual(serial[elevations[n % 4]], result)
+        # every elevation is in the pickle, fetched ones once each
+        site = f"{round(SITE['lat'], 2)},{round(SITE['lon'], 2)}"
+        self.assertEqual({f"{site},{ele}" for ele in elevations}, set(data))
+        self.assertEqual(100, data[f"{site},130"]['ele_source'])
+        for ele in [100, 400, 700]:
+            entry = data[f"{site},{ele}"]
+            self.assertNotIn('ele_source', entry)
+            self.assertEqual([20], entry['centuries_checked'])
+            self.assertEqual(27, len(entry['eclipses']))
+        self.assertEqual([20, 20], driver.clicks)
+
+    def localize_site(self, elevations, threads=False):
+        '''
+        localize() of the benchmark site for 2024 with a cached canon and a cached entry at the first elevation,
+        200 times from 16 threads sharing a driver, or once for each elevation
+        :return: what was localized, the pickle of the site, the driver
+        '''
+        results, otherdates = {}, {}
+        parse_canon_page(fixture('canon'), results, otherdates)
+        write_canon_pickle(results, otherdates)
+        eclipses, by_year = process_gsfc_history_table(fixture('jsex'))
+        os.makedirs('caches/gsfc_local')
+        lat, lon = round(SITE['lat'], 2), round(SITE['lon'], 2)  # as solar_eclipse_local keeps them
+        pickle_dump_atomic({f"{lat},{lon},{elevations[0]}": {'city': SITE['name'], 'lat': lat, 'lon': lon,
+                                                            'ele': elevations[0], 'eclipses': eclipses,
+                                                            'by_year': by_year, 'centuries_checked': [20]}},
+                           f"caches/gsfc_local/{lat},{lon}.pickle")
+        driver = jsex_driver({20: fixture('jsex')})
+
+        def localize(ele):
+            uut = solar_eclipse_local(SITE['name'], SITE['lat'], SITE['lon'], ele=ele, timezone=SITE['tz'],
+                                      driver=driver)
+            return localized(uut.localize(years=[2024]))
+
+        if threads:
+            with ThreadPoolExecutor(max_workers=16) as executor:
+                found = list(executor.map(localize, [elevations[n % 4] for n in range(200)]))
+        else:
+            found = [localize(ele) for ele in elevations]
+        fp = open(f"caches/gsfc_local/{lat},{lon}.pickle", 'rb')
+        data = pickle.load(fp)
+        fp.close()
+        return found, data, driver
+
+    def test_driver_lock(self):
+        driver = jsex_driver()
+        lock = driver_lock(driver)
+        self.assertIs(lock, driver_lock(driver))
+        self.assertIsNot(lock, driver_lock(jsex_driver()))
+        locks = len(circumstances._driver_locks)
+        del driver
+        self.assertEqual(locks - 1, len(circumstances._driver_locks))
+
+    def test_refine_executor(self):
+        barrier = threading.Barrier(16)
+
+        def first_use():
+            barrier.wait()
+            return refine_executor()
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            executors = [future.result() for future in [executor.submit(first_use) for n in range(16)]]
+        self.assertEqual(1, len({id(e) for e in executors}))
+
+    def test_sessions(self):
+        sessions = {}
+
+        def session_of_thread(n):
+            sessions[n] = (cached_session('caches/threads.sqllite'), cached_session('caches/threads.sqllite'))
+
+        with tempfile.TemporaryDirectory() as directory:
+            cwd = os.getcwd()
+            os.chdir(directory)
+            try:
+                threads = [threading.Thread(target=session_of_thread, args=(n,)) for n in range(4)]
+                [thread.start() for thread in threads]
+                [thread.join() for thread in threads]
+            finally:
+                os.chdir(cwd)
+        self.assertTrue(all(a is b for a, b in sessions.values()))
+        self.assertEqual(4, len({id(a) for a, b in sessions.values()}))
+
+    def test_atomic_pickle(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'cache.pickle')
+            pickle_dump_atomic(list(range(10000)), filename)
+            errors = []
+
+            def writer(n):
+                for _ in range(50):
+                    pickle_dump_atomic(list(range(n, n + 10000)), filename)
+
+            def reader():
+                for _ in range(200):
+                    try:
+                        fp = open(filename, 'rb')
+                        self.assertEqual(10000, len(pickle.load(fp)))
+                        fp.close()
+                    except Exception as e:
+                        errors.append(e)
+
+            threads = [threading.Thread(target=writer, args=(n,)) for n in range(4)]
+            threads += [threading.Thread(target=reader) for _ in range(4)]
+            [thread.start() for thread in threads]
+            [thread.join() for thread in threads]
+            self.assertEqual([], errors)
+            self.assertEqual(['cache.pickle'], os.listdir(directory))
+
+    def test_metrics(self):
+        metrics.reset()
+        metrics.enable()
+        try:
+            def count():
+                for _ in range(2000):
+                    metrics.counter('stress')
+                    with metrics.stage('stress'):
+                        pass
+
+            threads = [threading.Thread(target=count) for _ in range(8)]
+            [thread.start() for thread in threads]
+            [thread.join() for thread in threads]
+            snapshot = metrics.snapshot()
+        finally:
+            metrics.disable()
+            metrics.reset()
+        self.assertEqual(16000, snapshot['counters']['stress'])
+        self.assertEqual(16000, snapshot['timers']['stress']['count'])
+
+
+if __name__ == '__main__':
+    unittest.main()
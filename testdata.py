@@ -0,0 +1,75 @@
+'''
+fixtures shared by the test modules
+'''
+import re
+
+# innerHTML of the JSEX el_resultstable as serialized by Chrome, trimmed to a few rows
+gsfc_table = '''<tbody><tr><th>Calendar Date</th><th>Ecl. Type</th></tr>
+<tr><td>2024-Apr-08</td><td>T</td><td>17:18:03</td><td>60</td><td>18:34:12</td><td>18:35:57</td><td>60</td><td>179</td><td>18:37:42</td><td>19:56:40</td><td>52</td><td>1.014</td><td>1.000</td><td>03m30s</td></tr>
+<tr><td>-0500-Jan-01</td><td>P</td><td>06:18(r)</td><td>0(r)</td><td>-</td><td>06:50:00</td><td>5</td><td>110</td><td>-</td><td>NaN:NaN</td><td>12</td><td>0.414</td><td>0.300(r)</td><td>-</td></tr>
+<tr><td>2500-Feb-29</td><td>P</td><td>06:18:00</td><td>0</td><td>-</td><td>07:00:00</td><td>5</td><td>110</td><td>-</td><td>07:56:40</td><td>12</td><td>0.414</td><td>0.300(s)</td><td>-</td></tr></tbody>'''
+
+
+# the part of the canon the tests need, greatest eclipse in TD
+canon = {'2023-Oct-14': {'id': '+20231014', 'date_ut1': '2023-Oct-14', 'ge_time_td': '18:00:41', 'delta_t': 74,
+                         'eclipse_type': 'A'},
+         '2024-Apr-08': {'id': '+20240408', 'date_ut1': '2024-Apr-08', 'ge_time_td': '18:18:29', 'delta_t': 74,
+                         'eclipse_type': 'T'},
+         '2024-Oct-02': {'id': '+20241002', 'date_ut1': '2024-Oct-02', 'ge_time_td': '18:46:13', 'delta_t': 74,
+                         'eclipse_type': 'A'}}
+
+
+class jsex_driver(object):
+    '''
+    stands in for the selenium driver on the JSEX page, each century button answers with the results table of
+    tables (keyed by century) or gsfc_table
+    '''
+
+    def __init__(self, tables=None):
+        self.tables = tables or {}
+        self.century = None
+        self.clicks = []  # centuries, in the order their buttons were clicked
+        self.typed = []
+
+    def find_element(self, by, value):
+        return jsex_element(self, value)
+
+
+class jsex_element(object):
+    '''an input, select, button or the results table of the JSEX page'''
+
+    def __init__(self, driver, xpath):
+        self.driver = driver
+        self.xpath = xpath
+        self.tag_name = 'select' if xpath.endswith('select') else 'input'
+
+    def click(self):
+        # century buttons are laid out 5 to a row from 1500 BC, see solar_eclipse_local.get_year
+        button = re.search(r'table\[2\]/tbody/tr\[(\d+)\]/td\[(\d+)\]', self.xpath)
+        if button:
+            self.driver.century = (int(button.group(1)) - 2) * 5 + int(button.group(2)) - 1 - 15
+            self.driver.clicks.append(self.driver.century)
+
+    def clear(self):
+        pass
+
+    def send_keys(self, value):
+        self.driver.typed.append(value)
+
+    def get_attribute(self, name):
+        return self.driver.tables.get(self.driver.century, gsfc_table)
+
+    def get_dom_attribute(self, name):
+        return None
+
+    def find_elements(self, by, value):
+        return [self]  # the option of a select
+
+    def value_of_css_property(self, name):
+        return 'visible'
+
+    def is_selected(self):
+        return False
+
+    def is_enabled(self):
+        return True